@@ -0,0 +1,400 @@
+# audit.py
+"""
+Офлайн-аудит завершённого опроса: повторная проверка всех бюллетеней и
+протокол подсчёта.
+
+    python audit.py run <poll_id> [--out FILE] [--sign-key auditor.pem]
+    python audit.py verify FILE [--pub auditor_pub.pem]
+
+run читает бюллетени серверным курсором в порядке user_id, проверяет
+подписи пачками в пуле криптоопераций (CRYPTO_WORKERS процессов, как
+tally.rebuild_tally), заново перемножает шифротексты и пишет протокол в
+JSON Lines (по умолчанию audit_poll_<id>.jsonl):
+
+    header    — опрос, модуль n, профиль, варианты, число бюллетеней;
+    chunk     — пачка бюллетеней [first, last] по user_id: произведения
+                шифротекстов, дайджесты учтённых бюллетеней
+                (tally.ballot_digest) и отклонённые с причиной (в том
+                числе short_public_key — ключ избирателя короче rsa_bits
+                профиля опроса);
+    result    — зашифрованные итоги, расшифрованные голоса (если есть
+                приватный ключ опроса), общий дайджест и сравнение с
+                сохранёнными итогами (poll_result);
+    signature — SHA-256 всех предыдущих строк и, с --sign-key, RSA-подпись
+                аудитора (PKCS#1 v1.5).
+
+Каждая пачка дописывается в файл сразу после проверки, поэтому прерванный
+аудит продолжается с того же места: повторный run пропускает диапазоны
+user_id, уже записанные в протокол. verify проверяет хеш и подпись
+протокола и то, что итоги сходятся с пачками.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import sys
+
+import asyncpg
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from phe import paillier
+
+import crypto_profiles
+import tally
+from ballot_format import (
+    ciphertext_count, ciphertext_width, decode_counts, max_plaintext, pack_ciphertexts, signed_hash,
+)
+from config import DB_CONFIG
+from crypto_executor import crypto
+from encryption import sign_hash, verify_hash
+from key_cache import private_keys, public_keys
+
+logger = logging.getLogger(__name__)
+
+TRANSCRIPT_VERSION = 1
+
+# Причины отклонения бюллетеня (коды в протоколе)
+NO_PUBLIC_KEY = "no_public_key"
+BAD_PUBLIC_KEY = "bad_public_key"
+SHORT_PUBLIC_KEY = "short_public_key"  # короче rsa_bits профиля опроса
+MALFORMED = "malformed_ballot"
+OPTION_COUNT = "option_count_mismatch"
+BAD_SIGNATURE = "bad_signature"
+
+
+class AuditError(Exception):
+    """Аудит невозможен (опрос открыт, протокол от другого опроса и т. п.)."""
+
+
+def _dumps(record: dict) -> str:
+    return json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n"
+
+
+# --- Проверка пачки (в процессе пула) ---
+def _audit_chunk(poll_id: int, n: int, option_count: int, rows: list[tuple], min_bits: int = 0) -> dict:
+    nsquare = n * n
+    width = ciphertext_width(n)
+    products = [tally.IDENTITY] * option_count
+    digest = 0
+    ballots, rejected = [], []
+    for user_id, ballot, ciphertexts, sig_format, signature, pub_der in rows:
+        try:
+            h, values = signed_hash(poll_id, user_id, ballot, ciphertexts, sig_format, width)
+        except (ValueError, TypeError):
+            rejected.append([user_id, MALFORMED])
+            continue
+        if pub_der is None:
+            rejected.append([user_id, NO_PUBLIC_KEY])
+            continue
+        try:
+            pub = public_keys.get(user_id, pub_der)
+        except (ValueError, IndexError, TypeError):
+            rejected.append([user_id, BAD_PUBLIC_KEY])
+            continue
+        if pub.size_in_bits() < min_bits:
+            rejected.append([user_id, SHORT_PUBLIC_KEY])
+            continue
+        if len(values) != option_count:
+            rejected.append([user_id, OPTION_COUNT])
+            continue
+        if not verify_hash(pub, h, signature):
+            rejected.append([user_id, BAD_SIGNATURE])
+            continue
+        for i, c in enumerate(values):
+            products[i] = products[i] * c % nsquare
+        packed = ballot if ballot is not None else pack_ciphertexts(values, width)
+        d = tally.ballot_digest(user_id, packed, signature)
+        digest = (digest + d) % tally.DIGEST_MOD
+        ballots.append([user_id, f"{d:064x}"])
+    return {
+        "type": "chunk",
+        "first": rows[0][0],
+        "last": rows[-1][0],
+        "products": [f"{p:x}" for p in products],
+        "counted": len(ballots),
+        "digest": f"{digest:064x}",
+        "ballots": ballots,
+        "rejected": rejected,
+    }
+
+
+def _fold(result: tally.TallyResult, chunk: dict, nsquare: int) -> tally.TallyResult:
+    return tally.merge(result, tally.TallyResult(
+        [int(p, 16) for p in chunk["products"]],
+        chunk["counted"],
+        len(chunk["rejected"]),
+        int(chunk["digest"], 16),
+    ), nsquare)
+
+
+# --- Протокол ---
+def _read_transcript(path: str) -> list[dict]:
+    """Строки протокола; недописанная последняя строка отрезается."""
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+    return [json.loads(line) for line in data[:end].splitlines() if line]
+
+
+def _sign_transcript(path: str, sign_key: RSA.RsaKey | None):
+    with open(path, "rb") as f:
+        h = SHA256.new(f.read())
+    record = {
+        "type": "signature",
+        "sha256": h.hexdigest(),
+        "signature": sign_hash(sign_key, h) if sign_key is not None else None,
+    }
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(_dumps(record))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+async def audit(conn, poll_id: int, path: str, sign_key: RSA.RsaKey | None = None) -> dict:
+    """Аудит опроса с продолжением по протоколу path; возвращает строку result."""
+    poll = await conn.fetchrow(
+        "SELECT public_key_n, encoding, slot_bits, crypto_profile, end_date <= now() AS is_closed "
+        "FROM poll WHERE id=$1",
+        poll_id,
+    )
+    if not poll:
+        raise AuditError(f"Опрос {poll_id} не найден")
+    if not poll["is_closed"]:
+        raise AuditError(f"Опрос {poll_id} ещё открыт: бюллетени могут меняться")
+    n = int(poll["public_key_n"])
+    nsquare = n * n
+    option_ids = [r["id"] for r in await conn.fetch(
+        "SELECT id FROM poll_options WHERE poll_id=$1 ORDER BY id", poll_id,
+    )]
+    encoding, slot_bits = poll["encoding"], poll["slot_bits"]
+    min_bits = crypto_profiles.get(poll["crypto_profile"]).rsa_bits
+    # Шифротекстов в бюллетене: по варианту или один упакованный
+    ct_count = ciphertext_count(encoding, len(option_ids))
+    total = await conn.fetchval("SELECT count(*) FROM vote WHERE poll_id=$1", poll_id)
+    header = {
+        "type": "header",
+        "version": TRANSCRIPT_VERSION,
+        "poll_id": poll_id,
+        "public_key_n": str(n),
+        "option_ids": option_ids,
+        "encoding": encoding,
+        "slot_bits": slot_bits,
+        "crypto_profile": poll["crypto_profile"],
+        "ballots": total,
+    }
+
+    # Продолжение прерванного аудита
+    records = _read_transcript(path)
+    if records:
+        started = records[0]
+        if {k: started.get(k) for k in header} != header:
+            raise AuditError(f"{path}: протокол другого опроса или бюллетени изменились")
+        done = [r for r in records if r["type"] == "result"]
+        if done:
+            if records[-1]["type"] != "signature":
+                _sign_transcript(path, sign_key)
+            logger.info("Аудит опроса %s уже завершён: %s", poll_id, path)
+            return done[0]
+    result = tally.TallyResult([tally.IDENTITY] * ct_count, 0, 0, 0)
+    ranges = []
+    for record in records[1:]:  # только пачки: протокол без result
+        result = _fold(result, record, nsquare)
+        ranges.append((record["first"], record["last"]))
+    ranges.sort()
+    if records:
+        logger.info("Продолжаем аудит опроса %s: проверено %s бюллетеней", poll_id, result.counted + result.rejected)
+
+    progress = tally.log_progress(poll_id)
+    size = tally.chunk_size(n, ct_count, total)
+    out = open(path, "a", encoding="utf-8")
+    try:
+        if not records:
+            header["started_at"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            out.write(_dumps(header))
+            out.flush()
+
+        inflight = set()
+
+        async def drain():
+            nonlocal result, inflight
+            done, inflight = await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                chunk = task.result()
+                out.write(_dumps(chunk))
+                out.flush()
+                result = _fold(result, chunk, nsquare)
+            progress(result.counted + result.rejected, total)
+
+        def submit(chunk):
+            inflight.add(asyncio.ensure_future(crypto.run(
+                "audit_chunk", _audit_chunk, poll_id, n, ct_count, chunk, min_bits, background=True,
+            )))
+
+        try:
+            async with conn.transaction(readonly=True, isolation="repeatable_read"):
+                # Порядок user_id даёт индекс vote_poll_user_key, сортировка не нужна
+                cursor = conn.cursor(
+                    'SELECT v.user_id, v.ballot, v.ciphertexts, v.sig_format, v.signature, u.rsa_public_key '
+                    'FROM vote v LEFT JOIN "user" u ON u.id = v.user_id '
+                    'WHERE v.poll_id=$1 ORDER BY v.user_id',
+                    poll_id,
+                    prefetch=size,
+                )
+                chunk, skip = [], 0
+                async for row in cursor:
+                    user_id = row[0]
+                    while skip < len(ranges) and ranges[skip][1] < user_id:
+                        skip += 1
+                    if skip < len(ranges) and ranges[skip][0] <= user_id:
+                        # Диапазон уже в протоколе; пачки не должны его перекрывать
+                        if chunk:
+                            submit(chunk)
+                            chunk = []
+                        continue
+                    chunk.append(tuple(row))
+                    if len(chunk) >= size:
+                        submit(chunk)
+                        chunk = []
+                        if len(inflight) >= tally.MAX_INFLIGHT:
+                            await drain()
+                if chunk:
+                    submit(chunk)
+                while inflight:
+                    await drain()
+        finally:
+            for task in inflight:
+                task.cancel()
+
+        # Расшифровка итогов (нужен приватный ключ опроса)
+        try:
+            values = await private_keys.decrypt_many(
+                poll_id, paillier.PaillierPublicKey(n=n), result.products,
+                max_plaintext=max_plaintext(encoding, slot_bits, len(option_ids), tally.MAX_COUNT),
+            )
+            counts = decode_counts(encoding, slot_bits, len(option_ids), values)
+            counts = dict(zip(map(str, option_ids), counts))
+        except FileNotFoundError:
+            logger.warning("Нет приватного ключа опроса %s — итоги только в зашифрованном виде", poll_id)
+            counts = None
+
+        stored = await conn.fetchrow(
+            "SELECT counts, ballot_count, ballots_digest FROM poll_result WHERE poll_id=$1",
+            poll_id,
+        )
+        matches = None
+        if stored is not None:
+            matches = (
+                stored["ballots_digest"] == f"{result.digest:064x}"
+                and stored["ballot_count"] == result.counted
+                and (counts is None or json.loads(stored["counts"]) == counts)
+            )
+            if not matches:
+                logger.warning("Сохранённые итоги опроса %s не совпадают с аудитом", poll_id)
+
+        final = {
+            "type": "result",
+            "products": [f"{p:x}" for p in result.products],
+            "counts": counts,
+            "counted": result.counted,
+            "rejected": result.rejected,
+            "digest": f"{result.digest:064x}",
+            "stored_result_matches": matches,
+            "finished_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        out.write(_dumps(final))
+        out.flush()
+    finally:
+        out.close()
+
+    _sign_transcript(path, sign_key)
+    logger.info(
+        "Аудит опроса %s: учтено %s, отклонено %s → %s",
+        poll_id, result.counted, result.rejected, path,
+    )
+    return final
+
+
+def verify_transcript(path: str, pub: RSA.RsaKey | None = None) -> list[str]:
+    """Проверяет протокол; возвращает список проблем (пустой — всё сходится)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    body_end = data.rstrip(b"\n").rfind(b"\n") + 1
+    records = [json.loads(line) for line in data.splitlines() if line]
+    if len(records) < 3 or records[0]["type"] != "header" or records[-1]["type"] != "signature" \
+            or records[-2]["type"] != "result":
+        return ["протокол неполный"]
+
+    problems = []
+    h = SHA256.new(data[:body_end])
+    signature = records[-1]
+    if h.hexdigest() != signature["sha256"]:
+        problems.append("SHA-256 протокола не совпадает")
+    if pub is not None and (not signature["signature"] or not verify_hash(pub, h, signature["signature"])):
+        problems.append("подпись аудитора не прошла проверку")
+
+    header, final = records[0], records[-2]
+    nsquare = int(header["public_key_n"]) ** 2
+    ct_count = ciphertext_count(header["encoding"], len(header["option_ids"]))
+    result = tally.TallyResult([tally.IDENTITY] * ct_count, 0, 0, 0)
+    for chunk in records[1:-2]:
+        digest = sum(int(d, 16) for _, d in chunk["ballots"]) % tally.DIGEST_MOD
+        if digest != int(chunk["digest"], 16) or len(chunk["ballots"]) != chunk["counted"]:
+            problems.append(f"пачка {chunk['first']}..{chunk['last']}: дайджесты не сходятся")
+        result = _fold(result, chunk, nsquare)
+    if result.counted + result.rejected != header["ballots"]:
+        problems.append(f"в пачках {result.counted + result.rejected} бюллетеней, ожидалось {header['ballots']}")
+    if [f"{p:x}" for p in result.products] != final["products"] or f"{result.digest:064x}" != final["digest"]:
+        problems.append("итоги не совпадают с пачками")
+    return problems
+
+
+async def _run_cli(poll_id: int, path: str, sign_key: RSA.RsaKey | None):
+    conn = await asyncpg.connect(**DB_CONFIG)
+    try:
+        return await audit(conn, poll_id, path, sign_key)
+    finally:
+        await conn.close()
+        crypto.shutdown()
+
+
+def _load_key(path: str | None) -> RSA.RsaKey | None:
+    if path is None:
+        return None
+    with open(path, "rb") as f:
+        return RSA.import_key(f.read())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="проверить опрос и записать протокол")
+    run_parser.add_argument("poll_id", type=int)
+    run_parser.add_argument("--out", help="файл протокола (по умолчанию audit_poll_<id>.jsonl)")
+    run_parser.add_argument("--sign-key", help="приватный RSA-ключ аудитора (PEM)")
+    verify_parser = commands.add_parser("verify", help="проверить протокол")
+    verify_parser.add_argument("path")
+    verify_parser.add_argument("--pub", help="публичный RSA-ключ аудитора (PEM)")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "run":
+            final = asyncio.run(_run_cli(
+                args.poll_id, args.out or f"audit_poll_{args.poll_id}.jsonl", _load_key(args.sign_key),
+            ))
+            print(json.dumps({k: v for k, v in final.items() if k != "products"}, indent=2, ensure_ascii=False))
+        else:
+            problems = verify_transcript(args.path, _load_key(args.pub))
+            for problem in problems:
+                print(f"❌ {problem}")
+            if problems:
+                sys.exit(1)
+            print("✅ Протокол сходится")
+    except AuditError as e:
+        sys.exit(f"❌ {e}")
@@ -0,0 +1,176 @@
+# ballot_format.py
+"""
+Формат хранения бюллетеня.
+
+Бюллетень хранится в vote.ballot (BYTEA) как склейка шифротекстов
+фиксированной ширины (big-endian, ширина = байтовая длина n²): для
+2048-битного модуля это 512 байт на вариант вместо ~1234 десятичных цифр
+в JSON, а разбор — int.from_bytes вместо квадратичного int(str).
+
+vote.sig_format определяет подписанное сообщение:
+    SIG_DECIMAL (1) — "poll:{id};user:{uid};choices:{c1},{c2},..."
+                      с десятичными шифротекстами (старые бюллетени);
+    SIG_PACKED  (2) — b"poll:{id};user:{uid};choices:" + vote.ballot.
+
+poll.encoding определяет, что зашифровано в бюллетене опроса из K вариантов:
+    ENCODING_VECTOR (1) — K шифротекстов, 1 у выбранного варианта, 0 у прочих;
+    ENCODING_PACKED (2) — один шифротекст B^index, B = 2^poll.slot_bits.
+В упакованном бюллетене у каждого варианта свой слот в одном открытом
+тексте; произведение шифротекстов складывает слоты, и итог опроса — одно
+число, которое после расшифровки делится на K счётчиков. Слот (SLOT_BITS)
+вмещает наибольшее возможное число голосов, поэтому переноса между
+слотами не бывает; всего K·SLOT_BITS бит должны поместиться в n.
+
+Перевод старых строк (JSON в vote.ciphertexts) в новый формат:
+    python ballot_format.py migrate [--batch N]
+Подписи старых бюллетеней при этом остаются проверяемыми (SIG_DECIMAL).
+"""
+import asyncio
+import json
+import logging
+import sys
+
+import asyncpg
+
+from config import DB_CONFIG
+from encryption import ballot_hash
+
+logger = logging.getLogger(__name__)
+
+SIG_DECIMAL = 1
+SIG_PACKED = 2
+
+ENCODING_VECTOR = 1
+ENCODING_PACKED = 2
+
+# Голосов за вариант не больше, чем пользователей ("user".id — INTEGER,
+# tally.MAX_COUNT = 2^31), так что 32-битный слот не переполняется
+SLOT_BITS = 32
+
+
+def ciphertext_width(n: int) -> int:
+    """Ширина шифротекста в байтах для модуля n (шифротексты < n²)."""
+    return ((n * n).bit_length() + 7) // 8
+
+
+def pack_ciphertexts(ciphertexts, width: int) -> bytes:
+    return b"".join(c.to_bytes(width, "big") for c in ciphertexts)
+
+
+def unpack_ciphertexts(blob: bytes, width: int) -> list[int]:
+    return [int.from_bytes(blob[i:i + width], "big") for i in range(0, len(blob), width)]
+
+
+def int_to_bytes(value: int) -> bytes:
+    """Число переменной длины в big-endian (для poll_tally.ciphertext)."""
+    return value.to_bytes((value.bit_length() + 7) // 8 or 1, "big")
+
+
+# --- Кодирование выбора ---
+def packed_fits(n: int, option_count: int, slot_bits: int = SLOT_BITS) -> bool:
+    """Помещаются ли слоты всех вариантов в открытый текст (< n)."""
+    return option_count * slot_bits < n.bit_length() - 1
+
+
+def ciphertext_count(encoding: int, option_count: int) -> int:
+    """Шифротекстов в бюллетене (и строк итогов в poll_tally)."""
+    return 1 if encoding == ENCODING_PACKED else option_count
+
+
+def encode_choice(encoding: int, slot_bits: int, option_count: int, index: int) -> list[int]:
+    """Открытые тексты бюллетеня с выбором варианта номер index."""
+    if encoding == ENCODING_PACKED:
+        return [1 << (index * slot_bits)]
+    return [1 if i == index else 0 for i in range(option_count)]
+
+
+def decode_counts(encoding: int, slot_bits: int, option_count: int, values: list[int]) -> list[int]:
+    """Счётчики по вариантам из расшифрованных значений бюллетеня или итогов."""
+    if encoding == ENCODING_PACKED:
+        mask = (1 << slot_bits) - 1
+        return [(values[0] >> (i * slot_bits)) & mask for i in range(option_count)]
+    return list(values)
+
+
+def max_plaintext(encoding: int, slot_bits: int, option_count: int, per_option: int) -> int:
+    """Верхняя граница открытого текста (для расшифровки по половине CRT)."""
+    if encoding == ENCODING_PACKED:
+        return 1 << (option_count * slot_bits)
+    return per_option
+
+
+def packed_hash(poll_id: int, user_id: int, blob: bytes):
+    """SHA-256 от сообщения бюллетеня в формате SIG_PACKED."""
+    from Crypto.Hash import SHA256  # лениво, как в encryption
+    return SHA256.new(f"poll:{poll_id};user:{user_id};choices:".encode() + blob)
+
+
+def read_ciphertexts(ballot: bytes | None, ciphertexts: str | None, width: int) -> list[int]:
+    """Шифротексты бюллетеня из vote.ballot или (старый формат) vote.ciphertexts."""
+    if ballot is not None:
+        return unpack_ciphertexts(ballot, width)
+    return [int(c) for c in json.loads(ciphertexts)]
+
+
+def signed_hash(poll_id: int, user_id: int, ballot: bytes | None, ciphertexts: str | None,
+                sig_format: int, width: int):
+    """
+    Хеш сообщения, которое подписал избиратель, и шифротексты бюллетеня:
+    (hash, list[int]).
+    """
+    if ballot is None:
+        strs = json.loads(ciphertexts)
+        return ballot_hash(poll_id, user_id, strs), [int(c) for c in strs]
+    values = unpack_ciphertexts(ballot, width)
+    if sig_format == SIG_PACKED:
+        return packed_hash(poll_id, user_id, ballot), values
+    # Перенесённый старый бюллетень: подпись по десятичной записи
+    return ballot_hash(poll_id, user_id, [str(c) for c in values]), values
+
+
+# --- Перевод старых бюллетеней в бинарный формат ---
+async def migrate(batch: int = 1000):
+    conn = await asyncpg.connect(**DB_CONFIG)
+    total = 0
+    try:
+        while True:
+            async with conn.transaction():
+                rows = await conn.fetch(
+                    """
+                    SELECT v.id, v.ciphertexts, p.public_key_n
+                    FROM vote v JOIN poll p ON p.id = v.poll_id
+                    WHERE v.ballot IS NULL
+                    LIMIT $1
+                    FOR UPDATE OF v SKIP LOCKED
+                    """,
+                    batch,
+                )
+                if not rows:
+                    break
+                await conn.executemany(
+                    "UPDATE vote SET ballot=$2, ciphertexts=NULL, sig_format=$3 WHERE id=$1",
+                    [
+                        (
+                            row["id"],
+                            pack_ciphertexts(
+                                [int(c) for c in json.loads(row["ciphertexts"])],
+                                ciphertext_width(int(row["public_key_n"])),
+                            ),
+                            SIG_DECIMAL,
+                        )
+                        for row in rows
+                    ],
+                )
+            total += len(rows)
+            logger.info("Перенесено бюллетеней: %s", total)
+    finally:
+        await conn.close()
+    logger.info("✅ Все бюллетени в бинарном формате.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        sys.exit("Использование: python ballot_format.py migrate [--batch N]")
+    size = int(sys.argv[sys.argv.index("--batch") + 1]) if "--batch" in sys.argv else 1000
+    asyncio.run(migrate(size))
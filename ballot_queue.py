@@ -0,0 +1,283 @@
+# ballot_queue.py
+"""
+Очередь записи бюллетеней с групповой фиксацией.
+
+vote_post шифрует и подписывает бюллетень, кладёт его в ограниченную
+очередь и ждёт подтверждения. Единственная задача-писатель забирает
+бюллетени пачками (до BALLOT_BATCH_SIZE или по истечении
+BALLOT_FLUSH_INTERVAL) и записывает пачку одной транзакцией на одном
+соединении:
+
+    1. блокирует итоги затронутых опросов (tally.lock_tally, по порядку id);
+    2. отбрасывает бюллетени завершённых и удалённых опросов;
+    3. читает прежние бюллетени одним запросом и сворачивает пачку в итоги;
+    4. COPY в временную таблицу vote_staging и слияние в vote
+       (INSERT ... SELECT ... ON CONFLICT DO UPDATE);
+    5. увеличивает poll.ballot_count на число новых избирателей и одним
+       NOTIFY (NOTIFY_CHANNEL) сообщает воркерам новую явку (см. live.py).
+
+Подтверждение (результат future) приходит только после фиксации. Если
+пачка не записалась, бюллетени записываются по одному, чтобы ошибка одного
+не отклоняла остальные. Когда очередь полна, submit ждёт (не дольше
+BALLOT_QUEUE_TIMEOUT), затем — BallotQueueFull (503).
+
+Переменные окружения:
+    BALLOT_QUEUE_SIZE     — ёмкость очереди (по умолчанию 1000)
+    BALLOT_BATCH_SIZE     — наибольший размер пачки (100)
+    BALLOT_FLUSH_INTERVAL — сколько ждать добора пачки, с (0.01)
+    BALLOT_QUEUE_TIMEOUT  — сколько ждать места в очереди, с (5)
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import NamedTuple
+
+import metrics
+import tally
+from ballot_format import read_ciphertexts
+
+logger = logging.getLogger(__name__)
+
+BALLOT_QUEUE_SIZE = int(os.getenv("BALLOT_QUEUE_SIZE", "1000"))
+BALLOT_BATCH_SIZE = int(os.getenv("BALLOT_BATCH_SIZE", "100"))
+BALLOT_FLUSH_INTERVAL = float(os.getenv("BALLOT_FLUSH_INTERVAL", "0.01"))
+BALLOT_QUEUE_TIMEOUT = float(os.getenv("BALLOT_QUEUE_TIMEOUT", "5"))
+
+_STAGING_COLUMNS = ("poll_id", "user_id", "ballot", "sig_format", "signature")
+
+# Канал NOTIFY с явкой опросов (слушает live.LiveHub)
+NOTIFY_CHANNEL = "poll_ballots"
+
+
+class BallotQueueFull(Exception):
+    """Очередь записи переполнена — сервер не успевает."""
+
+
+class BallotRejected(Exception):
+    """Бюллетень не принят (опрос завершён или удалён)."""
+
+
+class PendingBallot(NamedTuple):
+    poll_id: int
+    user_id: int
+    ballot: bytes
+    sig_format: int
+    signature: str
+    ciphertexts: list[int]  # те же шифротексты, что в ballot (для итогов)
+    option_ids: list[int]
+    nsquare: int
+    width: int
+
+
+class BallotWriter:
+    """Очередь бюллетеней и задача, записывающая их пачками."""
+
+    def __init__(self, maxsize: int, batch_size: int, flush_interval: float, timeout: float):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.queue: asyncio.Queue | None = None
+        self.db_pool = None
+        self._task: asyncio.Task | None = None
+        self.batches = self.written = self.rejected = 0
+
+    def start(self, db_pool):
+        self.db_pool = db_pool
+        self.queue = asyncio.Queue(self.maxsize)
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Дописывает всё, что уже в очереди, и останавливает писателя."""
+        if self._task is None:
+            return
+        await self.queue.join()
+        self._task.cancel()
+        self._task = None
+
+    def metrics(self) -> dict:
+        return {
+            "queued": self.queue.qsize() if self.queue else 0,
+            "capacity": self.maxsize,
+            "batches": self.batches,
+            "written": self.written,
+            "rejected": self.rejected,
+        }
+
+    async def submit(self, item: PendingBallot):
+        """Ставит бюллетень в очередь и ждёт фиксации его пачки."""
+        future = asyncio.get_running_loop().create_future()
+        with metrics.stage("ballot_queue"):
+            try:
+                await asyncio.wait_for(self.queue.put((item, future)), self.timeout)
+            except asyncio.TimeoutError:
+                raise BallotQueueFull()
+            await future
+
+    # --- Писатель ---
+    async def _collect(self) -> list:
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                await self._flush(batch)
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    if not future.done():
+                        future.cancel()
+                raise
+            except Exception as e:
+                logger.exception("Не удалось записать пачку бюллетеней (%s)", len(batch))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _flush(self, batch: list):
+        async with self.db_pool.acquire() as conn:
+            try:
+                results = await self._write(conn, [item for item, _ in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    results = [e]
+                else:
+                    # Находим виновника: пишем по одному
+                    results = []
+                    for item, _ in batch:
+                        try:
+                            results.extend(await self._write(conn, [item]))
+                        except Exception as single:
+                            logger.exception("Бюллетень опроса %s не записан", item.poll_id)
+                            results.append(single)
+        self.batches += 1
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                self.rejected += 1
+                metrics.ballots_written.inc(1, "rejected")
+                future.set_exception(result)
+            else:
+                self.written += 1
+                metrics.ballots_written.inc(1, "written")
+                future.set_result(None)
+
+    async def _write(self, conn, items: list[PendingBallot]) -> list:
+        """Записывает пачку одной транзакцией; результат на каждый бюллетень."""
+        poll_ids = sorted({item.poll_id for item in items})
+        async with conn.transaction():
+            open_polls = sorted(
+                row["id"] for row in await conn.fetch(
+                    "SELECT id FROM poll WHERE id = ANY($1::int[]) AND end_date > now()",
+                    poll_ids,
+                )
+            )
+            # Блокируем итоги только открытых опросов и в одном порядке — без
+            # взаимоблокировок и без ожидания чужих завершённых опросов
+            totals = {poll_id: await tally.lock_tally(conn, poll_id) for poll_id in open_polls}
+
+            results = [
+                None if item.poll_id in open_polls else BallotRejected("Голосование завершено.")
+                for item in items
+            ]
+            accepted = [item for item, r in zip(items, results) if r is None]
+            if not accepted:
+                return results
+
+            # Прежние бюллетени тех же избирателей
+            rows = await conn.fetch(
+                """
+                SELECT v.poll_id, v.user_id, v.ballot, v.ciphertexts
+                FROM vote v
+                JOIN unnest($1::int[], $2::int[]) AS k(poll_id, user_id)
+                  ON v.poll_id = k.poll_id AND v.user_id = k.user_id
+                """,
+                [item.poll_id for item in accepted],
+                [item.user_id for item in accepted],
+            )
+            current = {(r["poll_id"], r["user_id"]): (r["ballot"], r["ciphertexts"]) for r in rows}
+
+            # Сворачиваем по порядку: повторный голос в пачке заменяет предыдущий
+            latest: dict[tuple[int, int], PendingBallot] = {}
+            for item in accepted:
+                key = (item.poll_id, item.user_id)
+                if key in latest:
+                    old = latest[key].ciphertexts
+                elif key in current:
+                    old = read_ciphertexts(*current[key], item.width)
+                else:
+                    old = None
+                latest[key] = item
+                if totals[item.poll_id]:  # итоги не построены — их соберёт rebuild_tally
+                    tally.fold_ballot(
+                        totals[item.poll_id], item.option_ids, item.nsquare, item.ciphertexts, old,
+                    )
+
+            await conn.execute(
+                """
+                CREATE TEMP TABLE IF NOT EXISTS vote_staging (
+                    poll_id INTEGER, user_id INTEGER, ballot BYTEA,
+                    sig_format SMALLINT, signature TEXT
+                ) ON COMMIT DELETE ROWS
+                """
+            )
+            await conn.copy_records_to_table(
+                "vote_staging",
+                records=[
+                    (item.poll_id, item.user_id, item.ballot, item.sig_format, item.signature)
+                    for item in latest.values()
+                ],
+                columns=_STAGING_COLUMNS,
+            )
+            await conn.execute(
+                """
+                INSERT INTO vote (poll_id, user_id, ballot, sig_format, signature)
+                SELECT poll_id, user_id, ballot, sig_format, signature FROM vote_staging
+                ON CONFLICT (poll_id, user_id) DO UPDATE
+                SET ballot=EXCLUDED.ballot, ciphertexts=NULL,
+                    sig_format=EXCLUDED.sig_format, signature=EXCLUDED.signature
+                """
+            )
+            for poll_id, poll_totals in totals.items():
+                if poll_totals:
+                    await tally.store_tally(conn, poll_id, poll_totals)
+
+            # Явка: новые избиратели (повторный голос её не меняет)
+            added = dict.fromkeys(sorted({key[0] for key in latest}), 0)
+            for key in latest:
+                if key not in current:
+                    added[key[0]] += 1
+            counts = await conn.fetch(
+                """
+                UPDATE poll p SET ballot_count = p.ballot_count + d.added
+                FROM unnest($1::int[], $2::int[]) AS d(id, added)
+                WHERE p.id = d.id
+                RETURNING p.id, p.ballot_count
+                """,
+                list(added), list(added.values()),
+            )
+            # Доставляется при фиксации транзакции
+            await conn.execute(
+                "SELECT pg_notify($1, $2)",
+                NOTIFY_CHANNEL,
+                json.dumps([[r["id"], r["ballot_count"]] for r in counts]),
+            )
+        return results
+
+
+writer = BallotWriter(BALLOT_QUEUE_SIZE, BALLOT_BATCH_SIZE, BALLOT_FLUSH_INTERVAL, BALLOT_QUEUE_TIMEOUT)
@@ -0,0 +1,173 @@
+# benchmarks/crypto.py
+"""
+Микробенчмарки криптоопераций голосования.
+
+    python -m benchmarks.crypto [--profiles fast,standard,high]
+                                [--paillier-bits 1024] [--rsa-bits 4096]
+                                [--options 10] [--repeat 200] [--keygen-repeat 3]
+
+Для каждого профиля (crypto_profiles) и дополнительных размеров
+--paillier-bits: генерация ключа Paillier, шифрование (phe и с готовым
+множителем r^n), гомоморфное сложение, расшифровка (полная и половина
+CRT). Для RSA-ключей профилей и --rsa-bits: подпись и проверка
+бюллетеня. Для сравнения — подпись и проверка Ed25519 и ECDSA P-256.
+Плюс разбор бюллетеня из JSON и из упакованного формата
+(benchmarks.storage). Строки profile сводят замеры по профилю: время
+голоса (шифрование + подпись) и проверки бюллетеня при подсчёте.
+
+Результат — JSON в stdout: задержки (перцентили, мс), операций в секунду
+и пиковый RSS.
+"""
+import argparse
+import json
+import platform
+import secrets
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import ECC, RSA
+from Crypto.Signature import DSS, eddsa
+from phe import paillier
+
+import crypto_profiles
+from ballot_format import ciphertext_width, pack_ciphertexts, packed_hash
+from benchmarks import storage
+from benchmarks.report import peak_rss_mb, summarize, timed
+from encryption import decrypt_values, encrypt_with_obfuscator, sign_hash, verify_hash
+from obfuscators import generate_obfuscators
+
+
+def bench_paillier(bits: int, repeat: int, keygen_repeat: int) -> dict:
+    keys = []
+
+    def keygen():
+        keys.append(paillier.generate_paillier_keypair(n_length=bits))
+
+    results = {"keygen": summarize(timed(keygen, repeat=keygen_repeat))}
+    public_key, private_key = keys[-1]
+    nsquare = public_key.nsquare
+
+    obfs = generate_obfuscators(public_key.n, repeat)
+    results["encrypt"] = summarize(timed(lambda: public_key.raw_encrypt(1), repeat=repeat))
+    it = iter(obfs)
+    results["encrypt_pooled"] = summarize(
+        timed(lambda: encrypt_with_obfuscator(public_key, 1, next(it)), repeat=repeat)
+    )
+
+    a, b = obfs[0], obfs[1]
+    results["add"] = summarize(timed(lambda: a * b % nsquare, repeat=repeat))
+
+    c = encrypt_with_obfuscator(public_key, 1, obfs[2])
+    results["decrypt"] = summarize(timed(lambda: private_key.raw_decrypt(c), repeat=repeat))
+    results["decrypt_half_crt"] = summarize(
+        timed(lambda: decrypt_values(private_key, [c], max_plaintext=1), repeat=repeat)
+    )
+    return {"benchmark": "paillier", "key_bits": bits, **results}
+
+
+def bench_rsa(bits: int, options: int, repeat: int) -> dict:
+    key = RSA.generate(bits)
+    public = key.publickey()
+    # Подписывается хеш бюллетеня, так что длина модуля Paillier на время
+    # подписи почти не влияет; длину ключа RSA задаёт профиль (bits)
+    n = secrets.randbits(2048) | (1 << 2047) | 1
+    blob = pack_ciphertexts([secrets.randbelow(n * n) for _ in range(options)], ciphertext_width(n))
+    h = packed_hash(1, 1, blob)
+    signature = sign_hash(key, h)
+    return {
+        "benchmark": "rsa",
+        "key_bits": bits,
+        "options": options,
+        "sign": summarize(timed(lambda: sign_hash(key, packed_hash(1, 1, blob)), repeat=repeat)),
+        "verify": summarize(timed(lambda: verify_hash(public, packed_hash(1, 1, blob), signature), repeat=repeat)),
+        "import_private_key": summarize(timed(lambda: RSA.import_key(key.export_key()), repeat=max(1, repeat // 10))),
+    }
+
+
+def bench_ecc(options: int, repeat: int) -> list[dict]:
+    """Подписи на эллиптических кривых над тем же сообщением бюллетеня."""
+    n = secrets.randbits(2048) | (1 << 2047) | 1
+    blob = pack_ciphertexts([secrets.randbelow(n * n) for _ in range(options)], ciphertext_width(n))
+    message = packed_hash(1, 1, blob).digest()
+    results = []
+
+    key = ECC.generate(curve="Ed25519")
+    signer, verifier = eddsa.new(key, "rfc8032"), eddsa.new(key.public_key(), "rfc8032")
+    signature = signer.sign(message)
+    results.append({
+        "benchmark": "ed25519",
+        "sign": summarize(timed(lambda: signer.sign(message), repeat=repeat)),
+        "verify": summarize(timed(lambda: verifier.verify(message, signature), repeat=repeat)),
+    })
+
+    key = ECC.generate(curve="P-256")
+    h = SHA256.new(message)
+    signer, verifier = DSS.new(key, "fips-186-3"), DSS.new(key.public_key(), "fips-186-3")
+    signature = signer.sign(h)
+    results.append({
+        "benchmark": "ecdsa_p256",
+        "sign": summarize(timed(lambda: signer.sign(h), repeat=repeat)),
+        "verify": summarize(timed(lambda: verifier.verify(h, signature), repeat=repeat)),
+    })
+    return results
+
+
+def _p50(entry: dict, name: str) -> float:
+    return entry[name]["latency_ms"]["p50"]
+
+
+def compare_profiles(profiles: list[crypto_profiles.CryptoProfile], paillier: dict, rsa: dict,
+                     options: int) -> list[dict]:
+    """Сводка по профилям: голос и проверка одного бюллетеня-вектора (p50, мс)."""
+    rows = []
+    for profile in profiles:
+        p, r = paillier[profile.paillier_bits], rsa[profile.rsa_bits]
+        rows.append({
+            "benchmark": "profile",
+            "profile": profile.name,
+            "paillier_bits": profile.paillier_bits,
+            "rsa_bits": profile.rsa_bits,
+            "options": options,
+            "keygen_ms": _p50(p, "keygen"),
+            "vote_ms": options * _p50(p, "encrypt_pooled") + _p50(r, "sign"),
+            "tally_ballot_ms": _p50(r, "verify") + options * _p50(p, "add"),
+            "decrypt_ms": _p50(p, "decrypt_half_crt"),
+        })
+    return rows
+
+
+def run(profiles: list[str], paillier_bits: list[int], rsa_bits: list[int], options: int, repeat: int,
+        keygen_repeat: int) -> dict:
+    profiles = [crypto_profiles.get(name) for name in profiles]
+    paillier_bits = sorted({p.paillier_bits for p in profiles} | set(paillier_bits))
+    rsa_bits = sorted({p.rsa_bits for p in profiles} | set(rsa_bits))
+    by_paillier = {bits: bench_paillier(bits, repeat, keygen_repeat) for bits in paillier_bits}
+    by_rsa = {bits: bench_rsa(bits, options, repeat) for bits in rsa_bits}
+    results = list(by_paillier.values()) + list(by_rsa.values())
+    results += bench_ecc(options, repeat)
+    results += compare_profiles(profiles, by_paillier, by_rsa, options)
+    results.append(storage.run(options, crypto_profiles.DEFAULT_PROFILE.paillier_bits, repeat))
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", type=lambda v: [p for p in v.split(",") if p],
+                        default=list(crypto_profiles.PROFILES))
+    parser.add_argument("--paillier-bits", type=_int_list, default=[], help="дополнительные размеры Paillier")
+    parser.add_argument("--rsa-bits", type=_int_list, default=[], help="дополнительные размеры RSA")
+    parser.add_argument("--options", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--keygen-repeat", type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(run(
+        args.profiles, args.paillier_bits, args.rsa_bits, args.options, args.repeat, args.keygen_repeat,
+    ), indent=2))
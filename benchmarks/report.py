@@ -0,0 +1,53 @@
+# benchmarks/report.py
+"""Общие функции отчётов бенчмарков: перцентили задержек и пиковая память."""
+import resource
+import sys
+import time
+
+
+def percentile(sorted_samples: list[float], q: float) -> float:
+    """Перцентиль q ∈ [0, 100] уже отсортированной выборки (ближайший ранг)."""
+    if not sorted_samples:
+        return 0.0
+    rank = max(0, min(len(sorted_samples) - 1, round(q / 100 * len(sorted_samples)) - 1))
+    return sorted_samples[rank]
+
+
+def summarize(samples: list[float], elapsed: float | None = None, errors: int = 0) -> dict:
+    """
+    Сводка по задержкам (секунды): число, ошибки, операций в секунду
+    (по elapsed, если задано, иначе по сумме задержек) и перцентили в мс.
+    """
+    ordered = sorted(samples)
+    total = elapsed if elapsed is not None else sum(ordered)
+    return {
+        "count": len(ordered),
+        "errors": errors,
+        "ops_per_s": len(ordered) / total if total > 0 else 0.0,
+        "latency_ms": {
+            "mean": sum(ordered) / len(ordered) * 1e3 if ordered else 0.0,
+            "p50": percentile(ordered, 50) * 1e3,
+            "p90": percentile(ordered, 90) * 1e3,
+            "p99": percentile(ordered, 99) * 1e3,
+            "max": (ordered[-1] if ordered else 0.0) * 1e3,
+        },
+    }
+
+
+def timed(fn, *args, repeat: int) -> list[float]:
+    """Задержки repeat вызовов fn(*args) в секундах."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def peak_rss_mb() -> dict:
+    """Пиковый RSS этого процесса и его завершившихся дочерних процессов (МиБ)."""
+    scale = 1 / 1024 if sys.platform != "darwin" else 1 / 1024 / 1024  # КиБ в Linux, байты в macOS
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
@@ -0,0 +1,58 @@
+# benchmarks/storage.py
+"""
+Сравнение форматов хранения бюллетеня: JSON десятичных строк (vote.ciphertexts)
+и склейка шифротекстов фиксированной ширины (vote.ballot).
+
+    python -m benchmarks.storage [--options K] [--bits 2048] [--ballots N]
+
+Результат — JSON в stdout.
+"""
+import argparse
+import json
+import secrets
+import time
+
+from ballot_format import ciphertext_width, pack_ciphertexts, unpack_ciphertexts
+
+
+def run(options: int, bits: int, ballots: int) -> dict:
+    # Шифротексты Paillier равномерно распределены по Z*_{n²}, поэтому
+    # для замеров размера и разбора достаточно случайных чисел < n²
+    n = secrets.randbits(bits) | (1 << (bits - 1)) | 1
+    nsquare = n * n
+    width = ciphertext_width(n)
+    ballot = [secrets.randbelow(nsquare) for _ in range(options)]
+
+    as_json = json.dumps([str(c) for c in ballot])
+    as_blob = pack_ciphertexts(ballot, width)
+    assert unpack_ciphertexts(as_blob, width) == ballot
+
+    started = time.perf_counter()
+    for _ in range(ballots):
+        [int(c) for c in json.loads(as_json)]
+    json_parse = (time.perf_counter() - started) / ballots
+
+    started = time.perf_counter()
+    for _ in range(ballots):
+        unpack_ciphertexts(as_blob, width)
+    blob_parse = (time.perf_counter() - started) / ballots
+
+    return {
+        "benchmark": "ballot_storage",
+        "options": options,
+        "key_bits": bits,
+        "json_bytes": len(as_json.encode()),
+        "packed_bytes": len(as_blob),
+        "json_parse_us": json_parse * 1e6,
+        "packed_parse_us": blob_parse * 1e6,
+        "parse_speedup": json_parse / blob_parse,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--options", type=int, default=10)
+    parser.add_argument("--bits", type=int, default=2048)
+    parser.add_argument("--ballots", type=int, default=2000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.options, args.bits, args.ballots), indent=2))
@@ -0,0 +1,55 @@
+# client_ballots.py
+"""
+Бюллетени, зашифрованные и подписанные на стороне избирателя.
+
+Браузер (static/js/ballot.js) получает публичные параметры опроса
+(GET /api/poll/{id}/params, кэшируемый ответ), сам шифрует вектор 0/1
+(или упакованный выбор, см. ballot_format.ENCODING_PACKED) ключом
+Paillier и подписывает сообщение в прежнем формате SIG_DECIMAL:
+
+    poll:{id};user:{uid};choices:{c1},{c2},...
+
+Сервер проверяет только форму шифротекстов и подпись (в пуле
+криптоопераций) и ставит бюллетень в очередь записи. Приватный RSA-ключ
+на сервер не передаётся.
+
+Сервер не может проверить, что каждый шифротекст содержит 0 или 1 (для
+этого нужны доказательства с нулевым разглашением), поэтому приём таких
+бюллетеней включается явно: CLIENT_BALLOTS=1.
+"""
+import os
+from math import gcd
+
+CLIENT_BALLOTS = os.getenv("CLIENT_BALLOTS", "0") == "1"
+
+
+class ClientBallotError(ValueError):
+    """Бюллетень клиента имеет неверную форму."""
+
+
+def parse_ciphertexts(payload, n: int, option_count: int) -> tuple[list[str], list[int]]:
+    """
+    Проверяет {"ciphertexts": [десятичные строки], "signature": hex} и
+    возвращает (строки, числа). Строки должны быть в канонической записи —
+    ровно той, что подписана.
+    """
+    if not isinstance(payload, dict):
+        raise ClientBallotError("Ожидается JSON-объект.")
+    strs = payload.get("ciphertexts")
+    if not isinstance(strs, list) or len(strs) != option_count:
+        raise ClientBallotError("Число шифротекстов не совпадает с числом вариантов.")
+    signature = payload.get("signature")
+    if not isinstance(signature, str) or not signature:
+        raise ClientBallotError("Нет подписи бюллетеня.")
+
+    nsquare = n * n
+    values = []
+    for s in strs:
+        # isascii: isdigit() пропускает и надстрочные цифры ("²"), которые int() не разбирает
+        if not isinstance(s, str) or not (s.isascii() and s.isdigit()) or str(int(s)) != s:
+            raise ClientBallotError("Шифротекст должен быть десятичной строкой.")
+        c = int(s)
+        if not 0 < c < nsquare or gcd(c, n) != 1:
+            raise ClientBallotError("Шифротекст вне группы ключа опроса.")
+        values.append(c)
+    return strs, values
@@ -0,0 +1,36 @@
+# config.py
+import os
+
+from dotenv import load_dotenv
+
+# --- Конфиг подключения к Postgres ---
+load_dotenv()  # загружаем .env
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "port": int(os.getenv("DB_PORT")),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "database": os.getenv("DB_NAME")
+}
+
+# --- Пулы соединений ---
+# statement_cache_size=0 нужен за pgbouncer в режиме transaction
+POOL_CONFIG = {
+    "min_size": int(os.getenv("DB_POOL_MIN", "2")),
+    "max_size": int(os.getenv("DB_POOL_MAX", "10")),
+    "statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE", "100")),
+    "max_inactive_connection_lifetime": float(os.getenv("DB_POOL_IDLE_LIFETIME", "300")),
+}
+
+# Реплика для чтения (если не задана — всё читается с основного сервера)
+READ_DB_CONFIG = {
+    **DB_CONFIG,
+    "host": os.getenv("DB_READ_HOST"),
+    "port": int(os.getenv("DB_READ_PORT") or DB_CONFIG["port"]),
+} if os.getenv("DB_READ_HOST") else None
+
+READ_POOL_CONFIG = {
+    **POOL_CONFIG,
+    "max_size": int(os.getenv("DB_READ_POOL_MAX") or POOL_CONFIG["max_size"]),
+}
@@ -0,0 +1,154 @@
+# crypto_executor.py
+"""
+Выполнение тяжёлой криптографии вне event loop.
+
+Все CPU-ёмкие операции (генерация ключей, хеширование паролей, подписи,
+возведения в степень Paillier) отправляются в общий пул процессов через
+`await crypto.run(op, fn, *args)`. Длинные целые Python держат GIL во время
+pow(), поэтому по умолчанию пул процессный; fn и аргументы должны
+сериализоваться pickle.
+
+Очередь ограничена: если в работе уже CRYPTO_MAX_PENDING операций, запрос
+получает CryptoOverloaded (main.py отвечает 503). Фоновые задачи
+(background=True) не отклоняются, а ждут, пока загрузка упадёт ниже
+половины лимита, оставляя запас для запросов пользователей.
+
+Переменные окружения:
+    CRYPTO_WORKERS      — число процессов (по умолчанию os.cpu_count())
+    CRYPTO_MAX_PENDING  — предел операций в работе и в очереди (workers × 4)
+    CRYPTO_EXECUTOR     — process | thread (по умолчанию process)
+"""
+import asyncio
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+import metrics
+
+
+class CryptoOverloaded(Exception):
+    """Пул криптоопераций перегружен — запрос стоит повторить позже."""
+
+
+class OpStats:
+    """Счётчики одной операции: ожидание в очереди и время выполнения (сек)."""
+
+    __slots__ = ("count", "errors", "rejected", "wait_total", "wait_max", "exec_total", "exec_max")
+
+    def __init__(self):
+        self.count = self.errors = self.rejected = 0
+        self.wait_total = self.wait_max = 0.0
+        self.exec_total = self.exec_max = 0.0
+
+    def as_dict(self) -> dict:
+        done = self.count or 1
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "wait_avg": self.wait_total / done,
+            "wait_max": self.wait_max,
+            "exec_avg": self.exec_total / done,
+            "exec_max": self.exec_max,
+        }
+
+
+def _timed(fn, args):
+    """Выполняется в пуле: засекает фактическое начало и конец работы."""
+    # time.monotonic() на Linux общий для всех процессов (CLOCK_MONOTONIC)
+    started = time.monotonic()
+    result = fn(*args)
+    return started, time.monotonic(), result
+
+
+class CryptoExecutor:
+    """Ограниченный пул для криптоопераций с метриками."""
+
+    def __init__(self, workers: int, max_pending: int, kind: str = "process"):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.kind = kind
+        self.pending = 0
+        self.stats: dict[str, OpStats] = defaultdict(OpStats)
+        self._pool: Executor | None = None
+        self._cond: asyncio.Condition | None = None
+
+    @property
+    def pool(self) -> Executor:
+        if self._pool is None:
+            if self.kind == "thread":
+                self._pool = ThreadPoolExecutor(max_workers=self.workers)
+            else:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    async def run(self, op: str, fn, *args, background: bool = False):
+        """Выполняет fn(*args) в пуле; op — имя операции для метрик."""
+        stats = self.stats[op]
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+
+        async with self._cond:
+            if background:
+                await self._cond.wait_for(lambda: self.pending < max(1, self.max_pending // 2))
+            elif self.pending >= self.max_pending:
+                stats.rejected += 1
+                raise CryptoOverloaded(op)
+            self.pending += 1
+
+        submitted = time.monotonic()
+        try:
+            started, finished, result = await asyncio.get_running_loop().run_in_executor(
+                self.pool, _timed, fn, args,
+            )
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            async with self._cond:
+                self.pending -= 1
+                self._cond.notify_all()
+
+        wait, elapsed = max(0.0, started - submitted), finished - started
+        stats.count += 1
+        stats.wait_total += wait
+        stats.wait_max = max(stats.wait_max, wait)
+        stats.exec_total += elapsed
+        stats.exec_max = max(stats.exec_max, elapsed)
+        metrics.crypto_ops.observe(wait, op, "wait")
+        metrics.crypto_ops.observe(elapsed, op, "exec")
+        metrics.record("crypto", time.monotonic() - submitted)
+        return result
+
+    async def warm_up(self, fn) -> int:
+        """
+        Запускает процессы пула заранее и выполняет в них fn (импорты
+        тяжёлых модулей); возвращает, сколько процессов ответило. Пул
+        создаётся здесь, в воркере, а не при импорте — с gunicorn --preload
+        процессы не наследуются от мастера.
+        """
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*[loop.run_in_executor(self.pool, fn) for _ in range(self.workers)])
+        return len(set(pids))
+
+    def snapshot(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "ops": {op: s.as_dict() for op, s in self.stats.items()},
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+_workers = int(os.getenv("CRYPTO_WORKERS") or os.cpu_count() or 1)
+crypto = CryptoExecutor(
+    _workers,
+    int(os.getenv("CRYPTO_MAX_PENDING") or _workers * 4),
+    os.getenv("CRYPTO_EXECUTOR", "process"),
+)
@@ -0,0 +1,110 @@
+# crypto_jobs.py
+"""
+Задания для пула криптоопераций (crypto_executor). Ключи RsaKey не
+сериализуются pickle, поэтому в процесс передаются приватный ключ (PEM) и
+публичный ключ из профиля (DER), а разбор публичных ключей кэшируется
+в каждом процессе (key_cache.public_keys).
+
+pycryptodome и werkzeug импортируются внутри заданий: веб-воркеру они не
+нужны. preload_modules() импортирует их в процессах пула при старте приложения.
+"""
+import os
+
+from ballot_format import packed_hash, signed_hash
+from encryption import ballot_hash, sign_hash, verify_hash
+from key_cache import public_keys
+
+
+class BallotKeyError(Exception):
+    """Ключ избирателя не подходит; args = (сообщение, HTTP-статус)."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message, status_code)
+        self.message = message
+        self.status_code = status_code
+
+
+def _check_private_key(priv_key_pem: str, user_id: int, stored_pub_der: bytes | None):
+    """Разбирает приватный ключ и сверяет его с публичным ключом из профиля."""
+    from Crypto.PublicKey import RSA
+    try:
+        priv = RSA.import_key(priv_key_pem)  # ← приватный ключ пользователя
+    except (ValueError, IndexError, TypeError):
+        raise BallotKeyError("Неверный формат приватного ключа.")
+
+    if not stored_pub_der:
+        raise BallotKeyError("В вашем профиле отсутствует публичный ключ.")
+    try:
+        stored_pub = public_keys.get(user_id, stored_pub_der)
+    except (ValueError, IndexError, TypeError):
+        raise BallotKeyError("Сохранённый публичный ключ повреждён.", 500)
+
+    # Сравниваем параметры n и e
+    if priv.n != stored_pub.n or priv.e != stored_pub.e:
+        raise BallotKeyError("Приватный ключ не соответствует вашему публичному ключу.")
+    return priv, stored_pub
+
+
+def _check_key_size(stored_pub, min_bits: int):
+    """Профиль опроса (crypto_profiles) задаёт наименьшую длину ключа избирателя."""
+    if stored_pub.size_in_bits() < min_bits:
+        raise BallotKeyError(
+            f"Для этого опроса нужен ключ RSA не короче {min_bits} бит, "
+            f"ваш ключ — {stored_pub.size_in_bits()} бит.",
+            403,
+        )
+
+
+def sign_ballot_pem(priv_key_pem, user_id, stored_pub_der, poll_id, ballot: bytes, min_bits: int = 0) -> str:
+    """Проверяет ключ избирателя и подписывает бюллетень (SIG_PACKED, hex)."""
+    priv, stored_pub = _check_private_key(priv_key_pem, user_id, stored_pub_der)
+    _check_key_size(stored_pub, min_bits)
+    return sign_hash(priv, packed_hash(poll_id, user_id, ballot))
+
+
+def verify_own_ballot_pem(priv_key_pem, user_id, stored_pub_der, poll_id, vote, width) -> bool:
+    """
+    Проверяет ключ избирателя и подпись его сохранённого бюллетеня;
+    vote = (ballot, ciphertexts, sig_format, signature) из таблицы vote.
+    """
+    _, stored_pub = _check_private_key(priv_key_pem, user_id, stored_pub_der)
+    if vote is None:
+        return False
+    ballot, ciphertexts, sig_format, signature = vote
+    h, _ = signed_hash(poll_id, user_id, ballot, ciphertexts, sig_format, width)
+    return verify_hash(stored_pub, h, signature)
+
+
+def verify_client_ballot(user_id, stored_pub_der, poll_id, ciphertexts, signature, min_bits: int = 0) -> bool:
+    """
+    Проверяет подпись бюллетеня, зашифрованного избирателем (SIG_DECIMAL,
+    ciphertexts — десятичные строки в подписанном виде).
+    """
+    if not stored_pub_der:
+        raise BallotKeyError("В вашем профиле отсутствует публичный ключ.")
+    try:
+        stored_pub = public_keys.get(user_id, stored_pub_der)
+    except (ValueError, IndexError, TypeError):
+        raise BallotKeyError("Сохранённый публичный ключ повреждён.", 500)
+    _check_key_size(stored_pub, min_bits)
+    return verify_hash(stored_pub, ballot_hash(poll_id, user_id, ciphertexts), signature)
+
+
+# --- Пароли (werkzeug импортируется только в процессах пула) ---
+def hash_password(password: str) -> str:
+    from werkzeug.security import generate_password_hash
+    return generate_password_hash(password)
+
+
+def check_password(password_hash: str, password: str) -> bool:
+    from werkzeug.security import check_password_hash
+    return check_password_hash(password_hash, password)
+
+
+def preload_modules() -> int:
+    """Заранее импортирует в процессе пула то, что тут импортируется лениво."""
+    import Crypto.Hash.SHA256  # noqa: F401
+    import Crypto.PublicKey.RSA  # noqa: F401
+    import Crypto.Signature.pkcs1_15  # noqa: F401
+    import werkzeug.security  # noqa: F401
+    return os.getpid()
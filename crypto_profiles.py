@@ -0,0 +1,60 @@
+# crypto_profiles.py
+"""
+Профили криптографических параметров опроса.
+
+Профиль задаёт длину модуля Paillier ключа опроса и наименьшую длину
+RSA-ключа избирателя, которым можно подписать бюллетень. Профиль
+выбирается при создании опроса и записывается в poll.crypto_profile;
+ключ опроса берётся из запаса этого профиля (key_pool.paillier_pools),
+а приём бюллетеня отклоняет ключи избирателя короче rsa_bits.
+
+    fast     — Paillier-2048: внутренние опросы; ключ опроса генерируется,
+               а итоги расшифровываются в несколько раз быстрее;
+    standard — Paillier-3072 (как у опросов, созданных до профилей);
+    high     — Paillier-4096 и RSA-ключи избирателей не короче 3072 бит.
+
+Ключ избирателя один на все опросы; при регистрации он генерируется
+длиной VOTER_RSA_BITS — по умолчанию rsa_bits профиля CRYPTO_PROFILE,
+чтобы подпись и проверка бюллетеней обычных опросов не дорожали. Если
+проводятся опросы с профилем high, VOTER_RSA_BITS=3072 нужно задать явно:
+избиратели с более короткими ключами в них проголосовать не смогут.
+
+Подписи Ed25519/ECDSA в профили не входят: в pycryptodome их проверка
+в 3–4 раза медленнее проверки RSA (сравнение — в benchmarks.crypto),
+а подсчёт упирается именно в проверку.
+
+Переменные окружения:
+    CRYPTO_PROFILE — профиль новых опросов по умолчанию (standard)
+    VOTER_RSA_BITS — длина RSA-ключа новых избирателей (по умолчанию из CRYPTO_PROFILE)
+"""
+import os
+from typing import NamedTuple
+
+
+class CryptoProfile(NamedTuple):
+    name: str
+    paillier_bits: int  # длина модуля n ключа опроса
+    rsa_bits: int  # наименьшая длина ключа избирателя
+    title: str
+
+
+PROFILES = {profile.name: profile for profile in (
+    CryptoProfile("fast", 2048, 2048, "Быстрый (Paillier-2048)"),
+    CryptoProfile("standard", 3072, 2048, "Стандартный (Paillier-3072)"),
+    CryptoProfile("high", 4096, 3072, "Повышенный (Paillier-4096, RSA-3072)"),
+)}
+
+# Профиль опросов, созданных до появления профилей (DEFAULT в миграции)
+LEGACY_PROFILE = "standard"
+
+DEFAULT_PROFILE = PROFILES[os.getenv("CRYPTO_PROFILE", "standard")]
+
+VOTER_RSA_BITS = int(os.getenv("VOTER_RSA_BITS") or DEFAULT_PROFILE.rsa_bits)
+
+
+def get(name: str) -> CryptoProfile:
+    """Профиль по имени; ValueError, если такого нет."""
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"неизвестный профиль: {name!r}")
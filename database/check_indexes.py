@@ -0,0 +1,111 @@
+# check_indexes.py
+"""
+Проверка планов запросов приложения: каждый SQL-литерал, передаваемый
+в conn.fetch/fetchrow/fetchval/execute/executemany/cursor из модулей
+приложения, разбирается через EXPLAIN (GENERIC_PLAN) при запрещённом
+последовательном сканировании. Если планировщик всё равно выбирает
+Seq Scan — подходящего индекса нет, скрипт завершается с ошибкой.
+
+    python database/check_indexes.py
+
+Нужен PostgreSQL 16+ (EXPLAIN GENERIC_PLAN для запросов с $1, $2, ...).
+DDL и запросы без WHERE (полный обход по смыслу) пропускаются.
+"""
+import ast
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+
+import asyncpg
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# --- Конфиг подключения к Postgres ---
+load_dotenv()
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "port": int(os.getenv("DB_PORT")),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "database": os.getenv("DB_NAME")
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = [
+    "main.py", "tally.py", "result_cache.py", "poll_context.py", "audit.py", "shards.py",
+    "ballot_queue.py", "polls.py",
+]
+METHODS = {"fetch", "fetchrow", "fetchval", "execute", "executemany", "cursor"}
+
+
+def collect_queries(path: str):
+    """(строка, SQL) для каждого литерала-запроса в модуле."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and node.func.attr in METHODS
+            and node.args
+        ):
+            arg = node.args[0]
+            # Соседние литералы ('a' 'b') ast уже склеил в один Constant
+            if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                yield node.lineno, " ".join(arg.value.split())
+
+
+def needs_index(sql: str) -> bool:
+    head = sql.split(None, 1)[0].upper()
+    if head not in {"SELECT", "UPDATE", "DELETE", "INSERT", "WITH"}:
+        return False
+    # Служебные вызовы (pg_advisory_xact_lock и т.п.) и запросы без условий
+    return re.search(r"\bWHERE\b", sql, re.IGNORECASE) is not None
+
+
+def seq_scans(plan: dict):
+    if plan.get("Node Type") == "Seq Scan":
+        yield plan.get("Relation Name")
+    for child in plan.get("Plans", []):
+        yield from seq_scans(child)
+
+
+async def check():
+    conn = await asyncpg.connect(**DB_CONFIG)
+    failures = 0
+    try:
+        await conn.execute("SET enable_seqscan = off")
+        for module in MODULES:
+            for lineno, sql in collect_queries(os.path.join(ROOT, module)):
+                if not needs_index(sql):
+                    continue
+                # EXPLAIN не выполняет запрос, но откатываем на всякий случай
+                tr = conn.transaction()
+                await tr.start()
+                try:
+                    raw = await conn.fetchval(f"EXPLAIN (GENERIC_PLAN, FORMAT JSON) {sql}")
+                finally:
+                    await tr.rollback()
+                plan = json.loads(raw)[0]["Plan"]
+                tables = sorted({t for t in seq_scans(plan) if t})
+                if tables:
+                    failures += 1
+                    logger.error("❌ %s:%s — Seq Scan по %s: %s", module, lineno, ", ".join(tables), sql)
+                else:
+                    logger.info("✅ %s:%s", module, lineno)
+    finally:
+        await conn.close()
+    return failures
+
+
+if __name__ == "__main__":
+    failed = asyncio.run(check())
+    if failed:
+        sys.exit(f"Запросов без индекса: {failed}")
+    logger.info("✅ Все запросы используют индексы.")
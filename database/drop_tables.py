@@ -23,10 +23,13 @@ async def drop_all_tables():
     logger.info("✅ Подключились к БД, начинаем удаление таблиц...")
 
     # Удаляем все таблицы в правильном порядке
+    await conn.execute('DROP TABLE IF EXISTS poll_result CASCADE;')
+    await conn.execute('DROP TABLE IF EXISTS poll_tally CASCADE;')
     await conn.execute('DROP TABLE IF EXISTS vote CASCADE;')
     await conn.execute('DROP TABLE IF EXISTS poll_options CASCADE;')
     await conn.execute('DROP TABLE IF EXISTS poll CASCADE;')
     await conn.execute('DROP TABLE IF EXISTS "user" CASCADE;')
+    await conn.execute('DROP TABLE IF EXISTS schema_migrations;')
 
     logger.info("🗑️ Все таблицы удалены.")
     await conn.close()
@@ -0,0 +1,247 @@
+# migrations.py
+"""
+Версионированные миграции схемы.
+
+Каждая миграция — (версия, название, шаги); шаг — SQL-строка или
+async-функция от соединения. Применённые версии записываются в
+schema_migrations, каждая миграция выполняется в своей транзакции,
+а параллельный запуск исключён advisory-блокировкой.
+
+    python database/db_init.py   — применить все новые миграции
+"""
+import base64
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки на время миграций
+_LOCK_KEY = 0x6D6967  # "mig"
+
+
+# --- 1. Исходная схема (как её создавал init_db) ---
+BASELINE = [
+    '''
+    CREATE TABLE IF NOT EXISTS "user" (
+        id SERIAL PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        rsa_public_key TEXT,
+        password_hash TEXT NOT NULL,
+        is_admin BOOLEAN NOT NULL DEFAULT FALSE
+    );
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS poll (
+        id SERIAL PRIMARY KEY,
+        title TEXT NOT NULL,
+        end_date TEXT NOT NULL,
+        public_key_n TEXT,
+        public_key_g TEXT
+    );
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS poll_options (
+        id SERIAL PRIMARY KEY,
+        poll_id INTEGER NOT NULL REFERENCES poll(id) ON DELETE CASCADE,
+        option_text TEXT NOT NULL
+    );
+    ''',
+    # Голоса: ballot — шифротексты фиксированной ширины подряд (big-endian),
+    # ciphertexts — старый формат (JSON десятичных строк), см. ballot_format.py
+    '''
+    CREATE TABLE IF NOT EXISTS vote (
+        id SERIAL PRIMARY KEY,
+        poll_id INTEGER NOT NULL REFERENCES poll(id) ON DELETE CASCADE,
+        user_id INTEGER NOT NULL REFERENCES "user"(id) ON DELETE CASCADE,
+        ciphertexts TEXT,
+        ballot BYTEA,
+        sig_format SMALLINT NOT NULL DEFAULT 1,
+        signature TEXT
+    );
+    ALTER TABLE vote ADD COLUMN IF NOT EXISTS ballot BYTEA;
+    ALTER TABLE vote ADD COLUMN IF NOT EXISTS sig_format SMALLINT NOT NULL DEFAULT 1;
+    ALTER TABLE vote ALTER COLUMN ciphertexts DROP NOT NULL;
+    ''',
+    # Зашифрованные итоги по вариантам (произведение шифротекстов mod n²)
+    '''
+    CREATE TABLE IF NOT EXISTS poll_tally (
+        poll_id INTEGER NOT NULL REFERENCES poll(id) ON DELETE CASCADE,
+        option_id INTEGER NOT NULL REFERENCES poll_options(id) ON DELETE CASCADE,
+        ciphertext TEXT NOT NULL,
+        PRIMARY KEY (poll_id, option_id)
+    );
+    ''',
+    # Окончательные итоги завершённых опросов (см. result_cache.py)
+    '''
+    CREATE TABLE IF NOT EXISTS poll_result (
+        poll_id INTEGER PRIMARY KEY REFERENCES poll(id) ON DELETE CASCADE,
+        counts TEXT NOT NULL,
+        ballot_count INTEGER NOT NULL,
+        ballots_digest TEXT NOT NULL,
+        computed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    ''',
+]
+
+
+# --- 2. Индексы горячих запросов и один голос на пользователя ---
+async def _dedupe_votes(conn):
+    """Оставляет последний голос пользователя в опросе (до уникального индекса)."""
+    polls = await conn.fetch(
+        """
+        DELETE FROM vote v USING vote d
+        WHERE v.poll_id = d.poll_id AND v.user_id = d.user_id AND v.id < d.id
+        RETURNING v.poll_id
+        """
+    )
+    affected = sorted({r["poll_id"] for r in polls})
+    if affected:
+        # Итоги этих опросов включали удалённые дубли — tally.load_tally
+        # построит их заново при следующем обращении
+        await conn.execute("DELETE FROM poll_tally WHERE poll_id = ANY($1::int[])", affected)
+        await conn.execute("DELETE FROM poll_result WHERE poll_id = ANY($1::int[])", affected)
+        logger.warning("Удалены повторные голоса в опросах %s", affected)
+
+
+INDEXES = [
+    _dedupe_votes,
+    '''
+    CREATE UNIQUE INDEX vote_poll_user_key ON vote (poll_id, user_id);
+    ALTER TABLE vote ADD CONSTRAINT vote_poll_user_key UNIQUE USING INDEX vote_poll_user_key;
+    ''',
+    # Каскадное удаление пользователя
+    'CREATE INDEX vote_user_id_idx ON vote (user_id);',
+    'CREATE INDEX poll_options_poll_id_idx ON poll_options (poll_id, id);',
+]
+
+
+# --- 3. Типизированные столбцы ---
+def _int_to_bytes(value: int) -> bytes:
+    return value.to_bytes((value.bit_length() + 7) // 8 or 1, "big")
+
+
+async def _tally_to_bytea(conn):
+    """poll_tally.ciphertext: десятичная строка → big-endian BYTEA."""
+    await conn.execute("ALTER TABLE poll_tally ADD COLUMN ciphertext_bin BYTEA")
+    rows = await conn.fetch("SELECT poll_id, option_id, ciphertext FROM poll_tally")
+    await conn.executemany(
+        "UPDATE poll_tally SET ciphertext_bin=$3 WHERE poll_id=$1 AND option_id=$2",
+        [(r["poll_id"], r["option_id"], _int_to_bytes(int(r["ciphertext"]))) for r in rows],
+    )
+    await conn.execute(
+        """
+        ALTER TABLE poll_tally DROP COLUMN ciphertext;
+        ALTER TABLE poll_tally RENAME COLUMN ciphertext_bin TO ciphertext;
+        ALTER TABLE poll_tally ALTER COLUMN ciphertext SET NOT NULL;
+        """
+    )
+
+
+async def _rsa_keys_to_der(conn):
+    """user.rsa_public_key: PEM → DER (BYTEA)."""
+    rows = await conn.fetch('SELECT id, rsa_public_key FROM "user" WHERE rsa_public_key IS NOT NULL')
+    await conn.execute('ALTER TABLE "user" ADD COLUMN rsa_public_key_der BYTEA')
+    await conn.executemany(
+        'UPDATE "user" SET rsa_public_key_der=$2 WHERE id=$1',
+        [(r["id"], pem_to_der(r["rsa_public_key"])) for r in rows],
+    )
+    await conn.execute(
+        '''
+        ALTER TABLE "user" DROP COLUMN rsa_public_key;
+        ALTER TABLE "user" RENAME COLUMN rsa_public_key_der TO rsa_public_key;
+        '''
+    )
+
+
+def pem_to_der(pem: str) -> bytes:
+    body = re.sub(r"-----[^-]+-----|\s", "", pem)
+    return base64.b64decode(body)
+
+
+TYPED_COLUMNS = [
+    # Даты из формы хранились как ISO-строки без зоны — трактуем в зоне сервера БД
+    '''
+    ALTER TABLE poll
+        ALTER COLUMN end_date TYPE TIMESTAMPTZ USING end_date::timestamptz,
+        ALTER COLUMN public_key_n TYPE NUMERIC USING public_key_n::numeric,
+        ALTER COLUMN public_key_g TYPE NUMERIC USING public_key_g::numeric;
+    ''',
+    _tally_to_bytea,
+    _rsa_keys_to_der,
+]
+
+
+# --- 4. Фильтр открытых/завершённых опросов на главной ---
+POLL_END_DATE = [
+    'CREATE INDEX poll_end_date_idx ON poll (end_date, id);',
+]
+
+# --- 5. Упакованные бюллетени (см. ballot_format); старые опросы — по вариантам ---
+PACKED_BALLOTS = [
+    '''
+    ALTER TABLE poll
+        ADD COLUMN encoding SMALLINT NOT NULL DEFAULT 1,
+        ADD COLUMN slot_bits SMALLINT NOT NULL DEFAULT 32;
+    ''',
+]
+
+# --- 6. Явка опроса, которую ведёт очередь записи бюллетеней (для live.py) ---
+BALLOT_COUNT = [
+    'ALTER TABLE poll ADD COLUMN ballot_count INTEGER NOT NULL DEFAULT 0;',
+    'UPDATE poll SET ballot_count = (SELECT count(*) FROM vote WHERE vote.poll_id = poll.id);',
+]
+
+# --- 7. Профиль криптопараметров (см. crypto_profiles) ---
+# Старые опросы — ключи phe по умолчанию (Paillier-3072), то есть standard
+CRYPTO_PROFILE = [
+    "ALTER TABLE poll ADD COLUMN crypto_profile TEXT NOT NULL DEFAULT 'standard';",
+]
+
+
+MIGRATIONS = [
+    (1, "baseline", BASELINE),
+    (2, "indexes and one vote per user", INDEXES),
+    (3, "typed columns", TYPED_COLUMNS),
+    (4, "poll end_date index", POLL_END_DATE),
+    (5, "packed ballot encoding", PACKED_BALLOTS),
+    (6, "poll ballot count", BALLOT_COUNT),
+    (7, "poll crypto profile", CRYPTO_PROFILE),
+]
+
+
+async def current_version(conn) -> int:
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
+    return await conn.fetchval("SELECT coalesce(max(version), 0) FROM schema_migrations")
+
+
+async def migrate(conn) -> int:
+    """Применяет все ещё не применённые миграции; возвращает версию схемы."""
+    await conn.execute("SELECT pg_advisory_lock($1)", _LOCK_KEY)
+    try:
+        version = await current_version(conn)
+        for number, name, steps in MIGRATIONS:
+            if number <= version:
+                continue
+            async with conn.transaction():
+                for step in steps:
+                    if callable(step):
+                        await step(conn)
+                    else:
+                        await conn.execute(step)
+                await conn.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                    number, name,
+                )
+            version = number
+            logger.info("✅ Миграция %s (%s) применена.", number, name)
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", _LOCK_KEY)
+    return version
@@ -0,0 +1,136 @@
+# db_pools.py
+"""
+Пулы соединений: основной сервер и (необязательно) реплика для чтения.
+
+Обработчики только на чтение (главная, страница голосования, итоги)
+получают соединение через reader(): это реплика, если она задана
+(DB_READ_HOST), жива и отстаёт не больше DB_READ_MAX_LAG секунд, иначе —
+основной сервер. Состояние реплики проверяет фоновая задача раз в
+DB_HEALTH_INTERVAL секунд; при сбое чтение сразу переходит на основной
+сервер и возвращается, когда проверка снова проходит.
+
+Чтение своих записей: после записи (голос, создание и удаление опроса)
+обработчик вызывает pin_primary(session) — следующие
+DB_READ_MAX_LAG + DB_HEALTH_INTERVAL секунд этот пользователь читает
+с основного сервера, а за это время реплика гарантированно догоняет запись.
+
+Переменные окружения (см. также config.py):
+    DB_READ_MAX_LAG     — допустимое отставание реплики, с (по умолчанию 5)
+    DB_HEALTH_INTERVAL  — период проверки реплики, с (по умолчанию 5)
+"""
+import asyncio
+import logging
+import os
+import time
+
+import asyncpg
+
+import metrics
+from config import DB_CONFIG, POOL_CONFIG, READ_DB_CONFIG, READ_POOL_CONFIG
+
+logger = logging.getLogger(__name__)
+
+DB_READ_MAX_LAG = float(os.getenv("DB_READ_MAX_LAG", "5"))
+DB_HEALTH_INTERVAL = float(os.getenv("DB_HEALTH_INTERVAL", "5"))
+
+# Ключ сессии: до какого времени (unix) читать с основного сервера
+_PIN_KEY = "read_primary_until"
+
+
+class DatabasePools:
+    def __init__(self):
+        self.primary: asyncpg.Pool | None = None
+        self.replica: asyncpg.Pool | None = None
+        self.replica_healthy = False
+        self.replica_lag: float | None = None
+        self._health_task: asyncio.Task | None = None
+
+    async def start(self):
+        # Пулы открываются параллельно (min_size соединений каждый)
+        primary = asyncpg.create_pool(**DB_CONFIG, **POOL_CONFIG, init=metrics.init_connection)
+        if READ_DB_CONFIG is None:
+            self.primary = await primary
+            return
+        replica = asyncpg.create_pool(**READ_DB_CONFIG, **READ_POOL_CONFIG, init=metrics.init_connection)
+        self.primary, replica = await asyncio.gather(primary, replica, return_exceptions=True)
+        if isinstance(self.primary, BaseException):
+            error, self.primary = self.primary, None
+            if not isinstance(replica, BaseException):
+                await replica.close()
+            raise error
+        if isinstance(replica, (OSError, asyncpg.PostgresError)):
+            # Реплика недоступна при старте — работаем без неё
+            logger.error("Реплика для чтения недоступна, чтение с основного сервера: %s", replica)
+        elif isinstance(replica, BaseException):
+            raise replica
+        else:
+            self.replica = replica
+            await self.check_replica()
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        if self.replica is not None:
+            await self.replica.close()
+        if self.primary is not None:
+            await self.primary.close()
+
+    # --- Проверка реплики ---
+    async def check_replica(self) -> bool:
+        try:
+            async with self.replica.acquire(timeout=DB_HEALTH_INTERVAL) as conn:
+                lag = await conn.fetchval(
+                    """
+                    SELECT CASE
+                        WHEN NOT pg_is_in_recovery() THEN 0
+                        -- нет новых записей на основном сервере — отставать не от чего
+                        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                        ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+                    END
+                    """,
+                    timeout=DB_HEALTH_INTERVAL,
+                )
+            healthy = lag is not None and lag <= DB_READ_MAX_LAG
+            self.replica_lag = None if lag is None else float(lag)
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError):
+            healthy = False
+            self.replica_lag = None
+
+        if healthy != self.replica_healthy:
+            if healthy:
+                logger.info("Реплика для чтения доступна (отставание %.1f с)", self.replica_lag)
+            else:
+                logger.warning("Реплика для чтения недоступна или отстаёт, чтение с основного сервера")
+        self.replica_healthy = healthy
+        return healthy
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(DB_HEALTH_INTERVAL)
+            await self.check_replica()
+
+    # --- Выбор пула ---
+    def reader(self, session: dict | None = None) -> asyncpg.Pool:
+        """Пул для чтения с учётом состояния реплики и чтения своих записей."""
+        if self.replica is None or not self.replica_healthy:
+            return self.primary
+        if session is not None and session.get(_PIN_KEY, 0) > time.time():
+            return self.primary
+        return self.replica
+
+    def metrics(self) -> dict:
+        return {
+            "replica": self.replica is not None,
+            "replica_healthy": self.replica_healthy,
+            "replica_lag": self.replica_lag,
+        }
+
+
+def pin_primary(session: dict):
+    """После записи пользователь какое-то время читает с основного сервера."""
+    session[_PIN_KEY] = time.time() + DB_READ_MAX_LAG + DB_HEALTH_INTERVAL
+
+
+db = DatabasePools()
@@ -1,9 +1,11 @@
+# pycryptodome импортируется внутри функций: RSA нужен только в пуле
+# криптоопераций (crypto_executor), и веб-воркер запускается без него
 from phe import paillier
 
 
-def generate_homomorphic_keypair():
-    """Генерация ключей шифрования Paillier"""
-    public_key, private_key = paillier.generate_paillier_keypair()
+def generate_homomorphic_keypair(bits=paillier.DEFAULT_KEYSIZE):
+    """Генерация ключей шифрования Paillier (bits — длина модуля n)"""
+    public_key, private_key = paillier.generate_paillier_keypair(n_length=bits)
     return public_key, private_key
 
 
@@ -17,3 +19,55 @@ def deserialize_private_key(serialized_key, public_key):
     p, q = serialized_key.split(':')
     return paillier.PaillierPrivateKey(public_key, int(p), int(q))  # Используем p и q
 
+
+def generate_rsa_keypair(bits=2048):
+    """
+    Генерация RSA-ключей избирателя: (приватный PEM, публичный PEM,
+    публичный DER — так он хранится в "user".rsa_public_key)
+    """
+    from Crypto.PublicKey import RSA
+    key = RSA.generate(bits)
+    public = key.publickey()
+    return key.export_key().decode(), public.export_key().decode(), public.export_key("DER")
+
+
+def decrypt_values(private_key, ciphertexts, max_plaintext=None):
+    """
+    Расшифровка списка шифротекстов (int). Если открытый текст заведомо
+    не больше max_plaintext и это меньше p, достаточно половины CRT:
+    m = L(c^(p-1) mod p²) · hp mod p.
+    """
+    if max_plaintext is None or max_plaintext >= private_key.p:
+        return [private_key.raw_decrypt(c) for c in ciphertexts]
+
+    p, psquare, hp = private_key.p, private_key.psquare, private_key.hp
+    return [(pow(c, p - 1, psquare) - 1) // p * hp % p for c in ciphertexts]
+
+
+def encrypt_with_obfuscator(public_key, plaintext, obfuscator):
+    """Шифрование Paillier с заранее вычисленным множителем r^n mod n²"""
+    nude = public_key.raw_encrypt(plaintext, r_value=1)  # (1 + n·m) mod n²
+    return nude * obfuscator % public_key.nsquare
+
+
+def ballot_hash(poll_id, user_id, ciphertexts):
+    """SHA-256 от сообщения бюллетеня с десятичными шифротекстами (строками)"""
+    from Crypto.Hash import SHA256
+    msg = f"poll:{poll_id};user:{user_id};choices:{','.join(ciphertexts)}"
+    return SHA256.new(msg.encode())
+
+
+def sign_hash(rsa_private_key, h):
+    """Подпись хеша бюллетеня избирателем (hex)"""
+    from Crypto.Signature import pkcs1_15
+    return pkcs1_15.new(rsa_private_key).sign(h).hex()
+
+
+def verify_hash(rsa_public_key, h, signature_hex):
+    """Проверка подписи хеша бюллетеня; True, если подпись корректна"""
+    from Crypto.Signature import pkcs1_15
+    try:
+        pkcs1_15.new(rsa_public_key).verify(h, bytes.fromhex(signature_hex))
+    except (ValueError, TypeError):
+        return False
+    return True
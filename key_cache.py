@@ -0,0 +1,107 @@
+# key_cache.py
+"""Кэш разобранных ключей, чтобы не читать и не разбирать их на каждый запрос."""
+import os
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+from phe import paillier
+
+from crypto_executor import crypto
+from encryption import decrypt_values, deserialize_private_key
+
+if TYPE_CHECKING:
+    from Crypto.PublicKey.RSA import RsaKey
+
+
+class PublicKeyCache:
+    """
+    LRU-кэш RSA-ключей пользователей: user_id → (DER, RsaKey).
+    Запись сверяется с ключом из БД, поэтому смена ключа сразу её вытесняет.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._keys: OrderedDict[int, tuple[bytes, "RsaKey"]] = OrderedDict()
+
+    def get(self, user_id: int, der: bytes) -> "RsaKey":
+        """Ключ пользователя; ValueError/TypeError — если ключ повреждён."""
+        entry = self._keys.get(user_id)
+        if entry is not None and entry[0] == der:
+            self._keys.move_to_end(user_id)
+            return entry[1]
+
+        from Crypto.PublicKey import RSA  # RSA нужен только процессам пула
+        key = RSA.import_key(der)
+        self._keys[user_id] = (der, key)
+        self._keys.move_to_end(user_id)
+        if len(self._keys) > self.maxsize:
+            self._keys.popitem(last=False)
+        return key
+
+    def invalidate(self, user_id: int):
+        self._keys.pop(user_id, None)
+
+    def clear(self):
+        self._keys.clear()
+
+
+# Каждый процесс пула криптоопераций держит свой экземпляр
+public_keys = PublicKeyCache(int(os.getenv("RSA_KEY_CACHE_SIZE", "10000")))
+
+
+class PrivateKeyRegistry:
+    """
+    Приватные ключи Paillier опросов из secure_keys/ с LRU- и TTL-вытеснением.
+    Запись сверяется с mtime файла, так что подменённый ключ перечитывается.
+    PaillierPrivateKey при создании вычисляет CRT-параметры (p², q², hp, hq),
+    кэш сохраняет их между запросами.
+    """
+
+    def __init__(self, key_dir: str, maxsize: int, ttl: float):
+        self.key_dir = key_dir
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # poll_id → (mtime_ns, время загрузки, ключ)
+        self._keys: OrderedDict[int, tuple[int, float, paillier.PaillierPrivateKey]] = OrderedDict()
+
+    def path(self, poll_id: int) -> str:
+        return os.path.join(self.key_dir, f"poll_{poll_id}.key")
+
+    def get(self, poll_id: int, public_key) -> paillier.PaillierPrivateKey:
+        """Приватный ключ опроса (FileNotFoundError, если файла нет)."""
+        path = self.path(poll_id)
+        mtime = os.stat(path).st_mtime_ns
+        now = time.monotonic()
+
+        entry = self._keys.get(poll_id)
+        if (entry is not None and entry[0] == mtime and now - entry[1] < self.ttl
+                and entry[2].public_key.n == public_key.n):
+            self._keys.move_to_end(poll_id)
+            return entry[2]
+
+        with open(path, "r", encoding="utf-8") as f:
+            key = deserialize_private_key(f.read(), public_key)
+        self._keys[poll_id] = (mtime, now, key)
+        self._keys.move_to_end(poll_id)
+        if len(self._keys) > self.maxsize:
+            self._keys.popitem(last=False)
+        return key
+
+    async def decrypt_many(self, poll_id: int, public_key, ciphertexts, max_plaintext=None) -> list[int]:
+        """
+        Расшифровывает список шифротекстов (int) ключом опроса в пуле
+        криптоопераций (см. encryption.decrypt_values про половину CRT).
+        """
+        key = self.get(poll_id, public_key)
+        return await crypto.run("paillier_decrypt", decrypt_values, key, list(ciphertexts), max_plaintext)
+
+    def invalidate(self, poll_id: int):
+        self._keys.pop(poll_id, None)
+
+
+private_keys = PrivateKeyRegistry(
+    "secure_keys",
+    int(os.getenv("PAILLIER_KEY_CACHE_SIZE", "128")),
+    float(os.getenv("PAILLIER_KEY_CACHE_TTL", "600")),
+)
@@ -0,0 +1,211 @@
+# key_pool.py
+"""
+Запас заранее сгенерированных ключевых пар.
+
+Генерация RSA-ключа занимает сотни миллисекунд, а при открытии опроса
+регистрируются сотни пользователей сразу; ключ Paillier для нового опроса
+ищется секунды. KeyPool держит готовые пары,
+пополняя запас в фоне, когда пул криптоопераций свободен (background=True).
+Если запас пуст, пара генерируется сразу, как раньше.
+
+RSA-ключи избирателей генерируются длиной crypto_profiles.VOTER_RSA_BITS.
+Запасы ключей Paillier — свои у каждого профиля (paillier_pools[имя]);
+по умолчанию пополняется только запас профиля CRYPTO_PROFILE.
+
+При заданном KEY_POOL_SECRET запас сохраняется при остановке в
+KEY_POOL_DIR, зашифрованный AES-GCM (ключ — scrypt от секрета). Файл
+забирается при старте атомарным переименованием и сразу удаляется, поэтому
+одна и та же пара не может быть выдана дважды — даже после сбоя или
+при нескольких воркерах.
+
+Переменные окружения:
+    RSA_POOL_SIZE       — размер запаса RSA-пар (по умолчанию 32, 0 — выкл.)
+    RSA_POOL_LOW_WATER  — порог пополнения (по умолчанию половина размера)
+    PAILLIER_POOL_SIZE      — размер запаса ключей Paillier профиля по умолчанию (4)
+    PAILLIER_POOL_SIZE_<ПРОФИЛЬ> — размер запаса профиля, например
+                              PAILLIER_POOL_SIZE_HIGH (для прочих профилей 0)
+    PAILLIER_POOL_LOW_WATER — порог пополнения (по умолчанию половина размера)
+    KEY_POOL_SECRET     — секрет для шифрования запаса на диске
+    KEY_POOL_DIR        — каталог для запаса (secure_keys/pool)
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+from collections import deque
+
+from crypto_executor import crypto
+from phe import paillier
+
+from crypto_profiles import DEFAULT_PROFILE, PROFILES, VOTER_RSA_BITS
+from encryption import generate_homomorphic_keypair, generate_rsa_keypair
+
+logger = logging.getLogger(__name__)
+
+KEY_POOL_SECRET = os.getenv("KEY_POOL_SECRET")
+KEY_POOL_DIR = os.getenv("KEY_POOL_DIR", "secure_keys/pool")
+
+
+# AES и scrypt нужны только при заданном KEY_POOL_SECRET — импорт внутри
+def _seal(secret: str, payload: bytes) -> bytes:
+    from Crypto.Cipher import AES
+    from Crypto.Protocol.KDF import scrypt
+    from Crypto.Random import get_random_bytes
+
+    salt = get_random_bytes(16)
+    key = scrypt(secret, salt, 32, N=2 ** 15, r=8, p=1)
+    cipher = AES.new(key, AES.MODE_GCM)
+    data, tag = cipher.encrypt_and_digest(payload)
+    return json.dumps({
+        "salt": salt.hex(), "nonce": cipher.nonce.hex(), "tag": tag.hex(), "data": data.hex(),
+    }).encode()
+
+
+def _unseal(secret: str, blob: bytes) -> bytes:
+    from Crypto.Cipher import AES
+    from Crypto.Protocol.KDF import scrypt
+
+    box = json.loads(blob)
+    key = scrypt(secret, bytes.fromhex(box["salt"]), 32, N=2 ** 15, r=8, p=1)
+    cipher = AES.new(key, AES.MODE_GCM, nonce=bytes.fromhex(box["nonce"]))
+    return cipher.decrypt_and_verify(bytes.fromhex(box["data"]), bytes.fromhex(box["tag"]))
+
+
+class KeyPool:
+    """
+    Запас ключей, которые выдаёт factory(*args). encode/decode переводят
+    элемент в JSON-совместимый вид и обратно для сохранения на диск.
+    """
+
+    def __init__(self, name: str, factory, args: tuple, size: int, low_water: int,
+                 encode=lambda item: item, decode=lambda obj: obj):
+        self.name = name
+        self.factory = factory
+        self.args = args
+        self.size = size
+        self.low_water = low_water
+        self.encode = encode
+        self.decode = decode
+        self.items: deque = deque()
+        self.hits = self.misses = 0
+        self._refill_task: asyncio.Task | None = None
+
+    async def take(self):
+        """Готовая пара из запаса или, если он пуст, сгенерированная сразу."""
+        if self.items:
+            self.hits += 1
+            item = self.items.popleft()
+        else:
+            self.misses += 1
+            item = await crypto.run(self.name, self.factory, *self.args)
+        self._maybe_refill()
+        return item
+
+    def metrics(self) -> dict:
+        return {"size": self.size, "level": len(self.items), "hits": self.hits, "misses": self.misses}
+
+    def _maybe_refill(self):
+        if len(self.items) < self.low_water and self._refill_task is None:
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        try:
+            while len(self.items) < self.size:
+                # Не больше половины процессов, чтобы не вытеснять запросы
+                batch = min(self.size - len(self.items), max(1, crypto.workers // 2))
+                self.items.extend(await asyncio.gather(*[
+                    crypto.run(self.name, self.factory, *self.args, background=True)
+                    for _ in range(batch)
+                ]))
+        except Exception:
+            logger.exception("Не удалось пополнить запас ключей %s", self.name)
+        finally:
+            self._refill_task = None
+
+    # --- Сохранение запаса между перезапусками ---
+    def _pattern(self) -> str:
+        return os.path.join(KEY_POOL_DIR, f"{self.name}.*.bin")
+
+    def start(self):
+        """Забирает сохранённый запас (если есть) и запускает пополнение."""
+        if self.size <= 0:
+            return
+        if KEY_POOL_SECRET:
+            for path in glob.glob(self._pattern()):
+                claimed = f"{path}.{os.getpid()}.claim"
+                try:
+                    os.rename(path, claimed)  # атомарно: файл достанется одному воркеру
+                except OSError:
+                    continue
+                try:
+                    with open(claimed, "rb") as f:
+                        payload = _unseal(KEY_POOL_SECRET, f.read())
+                    self.items.extend(self.decode(obj) for obj in json.loads(payload))
+                except (ValueError, KeyError):
+                    logger.warning("Сохранённый запас %s повреждён и пропущен", path)
+                finally:
+                    os.remove(claimed)
+            self.items = deque(list(self.items)[:self.size])
+        self._maybe_refill()
+
+    def close(self):
+        """Останавливает пополнение и сохраняет оставшийся запас."""
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+        if not (KEY_POOL_SECRET and self.items):
+            return
+        os.makedirs(KEY_POOL_DIR, exist_ok=True)
+        path = os.path.join(KEY_POOL_DIR, f"{self.name}.{os.getpid()}.bin")
+        payload = json.dumps([self.encode(item) for item in self.items]).encode()
+        fd = os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(_seal(KEY_POOL_SECRET, payload))
+        os.replace(path + ".tmp", path)
+        self.items.clear()
+
+
+_rsa_size = int(os.getenv("RSA_POOL_SIZE", "32"))
+# Длина ключа в имени: запас, сохранённый при другом VOTER_RSA_BITS, не подхватывается.
+# Элемент — (приватный PEM, публичный PEM, публичный DER); запас старого
+# формата (пары PEM) лежит под именем rsa_generate_* и тоже не подхватывается.
+rsa_pool = KeyPool(
+    f"rsa_keypair_{VOTER_RSA_BITS}",
+    generate_rsa_keypair,
+    (VOTER_RSA_BITS,),
+    _rsa_size,
+    int(os.getenv("RSA_POOL_LOW_WATER") or _rsa_size // 2),
+    encode=lambda item: [item[0], item[1], item[2].hex()],
+    decode=lambda obj: (obj[0], obj[1], bytes.fromhex(obj[2])),
+)
+
+
+def _encode_paillier(keypair) -> list:
+    public_key, private_key = keypair
+    return [str(public_key.n), str(private_key.p), str(private_key.q)]
+
+
+def _decode_paillier(obj):
+    public_key = paillier.PaillierPublicKey(int(obj[0]))
+    return public_key, paillier.PaillierPrivateKey(public_key, int(obj[1]), int(obj[2]))
+
+
+PAILLIER_POOL_SIZE = int(os.getenv("PAILLIER_POOL_SIZE", "4"))
+
+
+def _paillier_pool(profile) -> KeyPool:
+    # Запас держим только для профиля по умолчанию, остальные — по запросу
+    default = PAILLIER_POOL_SIZE if profile.name == DEFAULT_PROFILE.name else 0
+    size = int(os.getenv(f"PAILLIER_POOL_SIZE_{profile.name.upper()}") or default)
+    return KeyPool(
+        f"paillier_generate_{profile.paillier_bits}",
+        generate_homomorphic_keypair,
+        (profile.paillier_bits,),
+        size,
+        int(os.getenv("PAILLIER_POOL_LOW_WATER") or size // 2) if size else 0,
+        encode=_encode_paillier,
+        decode=_decode_paillier,
+    )
+
+
+paillier_pools = {name: _paillier_pool(profile) for name, profile in PROFILES.items()}
@@ -0,0 +1,220 @@
+# live.py
+"""
+Живые итоги открытых опросов: GET /poll/{id}/live (server-sent events).
+
+Очередь записи бюллетеней ведёт явку (poll.ballot_count) и после каждой
+пачки шлёт NOTIFY с новыми значениями (ballot_queue.NOTIFY_CHANNEL).
+Каждый воркер держит одно слушающее соединение (LiveHub) и по опросу,
+у которого есть подписчики, — одну задачу-вещателя: не чаще раза в
+LIVE_INTERVAL секунд она собирает событие и отдаёт одну и ту же строку
+всем подписчикам. Подписчики базу не трогают; запросы к ней — одно
+чтение явки при первой подписке (и после переподключения слушателя) и,
+если LIVE_TOTALS=1, чтение и расшифровка итогов не чаще раза в
+LIVE_TOTALS_INTERVAL секунд. Нагрузка на базу не зависит от числа
+открытых панелей.
+
+Событие: {"poll_id": ..., "ballots": явка, "closed": bool,
+          "totals": [голоса по вариантам] — только с LIVE_TOTALS=1}
+
+Переменные окружения:
+    LIVE_INTERVAL        — минимальный интервал между событиями, с (1)
+    LIVE_TOTALS          — "1": рассылать и расшифрованные итоги (по умолчанию нет)
+    LIVE_TOTALS_INTERVAL — как часто пересчитывать итоги, с (10)
+    LIVE_KEEPALIVE       — комментарий-пинг при тишине, с (15)
+"""
+import asyncio
+import datetime
+import json
+import logging
+import os
+import time
+
+import asyncpg
+
+import poll_context
+import tally
+from ballot_queue import NOTIFY_CHANNEL
+from config import DB_CONFIG
+from db_pools import db
+from key_cache import private_keys
+
+logger = logging.getLogger(__name__)
+
+LIVE_INTERVAL = float(os.getenv("LIVE_INTERVAL", "1"))
+LIVE_TOTALS = os.getenv("LIVE_TOTALS", "0") == "1"
+LIVE_TOTALS_INTERVAL = float(os.getenv("LIVE_TOTALS_INTERVAL", "10"))
+LIVE_KEEPALIVE = float(os.getenv("LIVE_KEEPALIVE", "15"))
+
+_RECONNECT_DELAY = 5.0
+
+
+class Channel:
+    """Подписчики одного опроса и последнее разосланное событие."""
+
+    def __init__(self, poll_id: int):
+        self.poll_id = poll_id
+        self.subscribers = 0
+        self.ballots: int | None = None  # None — явку нужно прочитать из базы
+        self.totals_dirty = True
+        self.totals: list[int] | None = None
+        self.totals_at = 0.0
+        self.end_date: datetime.datetime | None = None  # из последнего события
+        self.closed = False  # последнее событие — закрывающее
+        self.message: bytes | None = None  # готовая строка SSE
+        self.version = 0
+        self.changed = asyncio.Event()  # есть что разослать
+        self.published = asyncio.Condition()
+        self.task: asyncio.Task | None = None
+
+
+class LiveHub:
+    def __init__(self):
+        self.channels: dict[int, Channel] = {}
+        self._listener: asyncio.Task | None = None
+
+    # --- Слушатель NOTIFY ---
+    def start(self):
+        self._listener = asyncio.create_task(self._listen())
+
+    async def close(self):
+        tasks = [self._listener] + [ch.task for ch in self.channels.values()]
+        for task in tasks:
+            if task is not None:
+                task.cancel()
+        self._listener = None
+
+    async def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(**DB_CONFIG)
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda _: lost.set())
+                await conn.add_listener(NOTIFY_CHANNEL, self._on_notify)
+                # Пока слушателя не было, уведомления могли потеряться
+                for ch in self.channels.values():
+                    ch.ballots = None
+                    ch.changed.set()
+                await lost.wait()
+                logger.warning("Соединение LISTEN потеряно, переподключаемся")
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                logger.exception("Не удалось подписаться на %s", NOTIFY_CHANNEL)
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(_RECONNECT_DELAY)
+
+    def _on_notify(self, conn, pid, channel, payload):
+        for poll_id, ballots in json.loads(payload):
+            ch = self.channels.get(poll_id)
+            if ch is not None:
+                ch.ballots = ballots
+                ch.totals_dirty = True
+                ch.changed.set()
+
+    # --- Вещатель опроса ---
+    async def _broadcast(self, ch: Channel):
+        sent_at = 0.0
+        while ch.subscribers:
+            timeout = None
+            if LIVE_TOTALS and ch.totals_dirty:
+                # итоги устарели — пересчитать, как только истечёт LIVE_TOTALS_INTERVAL
+                timeout = max(0.0, ch.totals_at + LIVE_TOTALS_INTERVAL - time.monotonic())
+            if ch.end_date is not None and not ch.closed:
+                # проснуться к концу опроса, даже если новых бюллетеней нет
+                until_end = (ch.end_date - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+                timeout = max(0.0, until_end if timeout is None else min(timeout, until_end))
+            try:
+                await asyncio.wait_for(ch.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            # Не чаще раза в LIVE_INTERVAL: всё, что пришло за паузу, уйдёт одним событием
+            delay = sent_at + LIVE_INTERVAL - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            ch.changed.clear()
+            if not ch.subscribers:
+                break
+            try:
+                event = await self._event(ch)
+            except Exception:
+                logger.exception("Не удалось собрать событие опроса %s", ch.poll_id)
+                ch.changed.set()
+                sent_at = time.monotonic()
+                continue
+            sent_at = time.monotonic()
+            ch.closed = event["closed"]
+            ch.message = f"data: {json.dumps(event)}\n\n".encode()
+            async with ch.published:
+                ch.version += 1
+                ch.published.notify_all()
+
+    async def _event(self, ch: Channel) -> dict:
+        pool = db.reader()
+        async with pool.acquire() as conn:
+            ctx = await poll_context.load(conn, ch.poll_id)
+            if ctx is None:
+                return {"poll_id": ch.poll_id, "deleted": True, "closed": True}
+            if ch.ballots is None:
+                ch.ballots = await conn.fetchval(
+                    "SELECT ballot_count FROM poll WHERE id=$1", ch.poll_id,
+                )
+            meta = ctx.meta
+            ch.end_date = meta.end_date
+            now = time.monotonic()
+            if LIVE_TOTALS and ch.totals_dirty and now - ch.totals_at >= LIVE_TOTALS_INTERVAL:
+                totals = await tally.read_tally(conn, ch.poll_id)
+                if totals:
+                    ch.totals = meta.decode(await private_keys.decrypt_many(
+                        ch.poll_id,
+                        meta.public_key,
+                        [totals[opt_id] for opt_id in meta.tally_option_ids],
+                        max_plaintext=meta.max_plaintext(tally.MAX_COUNT),
+                    ))
+                ch.totals_dirty = False
+                ch.totals_at = now
+        event = {"poll_id": ch.poll_id, "ballots": ch.ballots, "closed": meta.is_closed}
+        if ch.totals is not None:
+            event["totals"] = ch.totals
+        return event
+
+    # --- Подписка ---
+    async def subscribe(self, poll_id: int):
+        """Асинхронный поток строк SSE для одного подписчика."""
+        ch = self.channels.get(poll_id)
+        if ch is None:
+            ch = self.channels[poll_id] = Channel(poll_id)
+        ch.subscribers += 1
+        if ch.task is None or ch.task.done():
+            ch.changed.set()
+            ch.task = asyncio.create_task(self._broadcast(ch))
+        seen = 0
+        try:
+            while True:
+                async with ch.published:
+                    try:
+                        await asyncio.wait_for(
+                            ch.published.wait_for(lambda: ch.version > seen), LIVE_KEEPALIVE,
+                        )
+                    except asyncio.TimeoutError:
+                        yield b": keepalive\n\n"
+                        continue
+                seen = ch.version
+                yield ch.message
+                if ch.closed:
+                    return
+        finally:
+            ch.subscribers -= 1
+            if not ch.subscribers:
+                ch.changed.set()  # вещатель увидит, что подписчиков нет, и завершится
+                if self.channels.get(poll_id) is ch:
+                    del self.channels[poll_id]
+
+    def metrics(self) -> dict:
+        return {
+            "channels": len(self.channels),
+            "subscribers": sum(ch.subscribers for ch in self.channels.values()),
+        }
+
+
+hub = LiveHub()
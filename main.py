@@ -1,88 +1,151 @@
 # main.py
-import datetime
+import startup  # первым: от него считается время запуска воркера
+
+import asyncio
+import hashlib
 import json
-import logging
 import os
+import time
 from contextlib import asynccontextmanager
 
-import asyncpg
-from Crypto.Hash import SHA256
-from Crypto.PublicKey import RSA
-from Crypto.Signature import pkcs1_15
-from fastapi import FastAPI, Request, Form, Depends, status
-from fastapi.responses import RedirectResponse, HTMLResponse
+from fastapi import APIRouter, FastAPI, Request, Form, Depends, Query, UploadFile, File, Body, status
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from phe import paillier
+from jinja2 import FileSystemBytecodeCache
 from starlette.middleware.sessions import SessionMiddleware
-from werkzeug.security import generate_password_hash, check_password_hash
 
-from encryption import generate_homomorphic_keypair, deserialize_private_key, serialize_private_key
+import ballot_queue
+import client_ballots
+import crypto_profiles
+import live
+import metrics
+import obfuscators
+import poll_context
+import poll_index
+import polls
+import result_cache
+import tally
+from ballot_format import SIG_DECIMAL, SIG_PACKED, ciphertext_width, pack_ciphertexts, read_ciphertexts
+from crypto_executor import crypto, CryptoOverloaded
+from db_pools import db, pin_primary
+from crypto_jobs import (
+    BallotKeyError, check_password, hash_password, preload_modules, sign_ballot_pem, verify_client_ballot,
+    verify_own_ballot_pem,
+)
+from encryption import encrypt_with_obfuscator
+from key_cache import private_keys
+from key_pool import paillier_pools, rsa_pool
+
+
+# --- Lifespan: пулы соединений на стартап и шутдаун ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    # при старте параллельно открываем пулы соединений (основной и, если
+    # задана, реплику) и запускаем процессы криптоопераций
+    await asyncio.gather(db.start(), crypto.warm_up(preload_modules))
+    rsa_pool.start()
+    for pool in paillier_pools.values():
+        pool.start()
+    ballot_queue.writer.start(db.primary)
+    live.hub.start()
+    startup.ready(started)
+    yield
+    # при завершении закрываем (сначала дописываем очередь бюллетеней)
+    await live.hub.close()
+    await ballot_queue.writer.close()
+    await db.close()
+    obfuscators.registry.close()
+    rsa_pool.close()
+    for pool in paillier_pools.values():
+        pool.close()
+    crypto.shutdown()
 
-# --- Конфиг подключения к Postgres ---
-from dotenv import load_dotenv
-import os
 
-load_dotenv()  # загружаем .env
+# --- Маршруты (приложение собирает create_app в конце модуля) ---
+router = APIRouter()
 
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST"),
-    "port": int(os.getenv("DB_PORT")),
-    "user": os.getenv("DB_USER"),
-    "password": os.getenv("DB_PASSWORD"),
-    "database": os.getenv("DB_NAME")
-}
+# Скомпилированные шаблоны кэшируются на диске (TEMPLATE_CACHE_DIR,
+# по умолчанию во временном каталоге; пустая строка — не кэшировать)
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR")
 
 
-# --- Lifespan: пул соединений на стартап и шутдаун ---
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # при старте создаём пул
-    app.state.db_pool = await asyncpg.create_pool(**DB_CONFIG)
-    yield
-    # при завершении закрываем
-    await app.state.db_pool.close()
+class Templates(Jinja2Templates):
+    """Шаблоны с замером времени отрисовки (этап render)."""
+
+    def TemplateResponse(self, *args, **kwargs):
+        with metrics.stage("render"):
+            return super().TemplateResponse(*args, **kwargs)
 
+    def precompile(self):
+        """Компилирует все шаблоны заранее, а не на первом запросе воркера."""
+        for name in self.env.list_templates():
+            self.env.get_template(name)
 
-# --- Настройки FastAPI ---
-app = FastAPI(lifespan=lifespan)
-app.add_middleware(SessionMiddleware, secret_key="secret_key_for_session")
 
-templates = Jinja2Templates(directory="templates")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+templates = Templates(directory="templates")
+if TEMPLATE_CACHE_DIR != "":
+    if TEMPLATE_CACHE_DIR:
+        os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    templates.env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
 
 
-# --- Зависимость для получения соединения ---
+# --- Перегрузка пула криптоопераций ---
+async def crypto_overloaded(request: Request, exc: CryptoOverloaded):
+    return HTMLResponse(
+        "Сервер перегружен, повторите попытку позже.",
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
+
+
+# --- Переполнение очереди записи бюллетеней ---
+async def ballot_queue_full(request: Request, exc: ballot_queue.BallotQueueFull):
+    return HTMLResponse(
+        "Сервер перегружен, повторите попытку позже.",
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
+
+
+# --- Зависимости для получения соединения ---
 async def get_conn():
-    async with app.state.db_pool.acquire() as conn:
+    async with metrics.acquire(db.primary) as conn:
         yield conn
 
 
-# --- Зависимость для получения соединения ---
-async def get_conn():
-    async with app.state.db_pool.acquire() as conn:
+async def get_read_conn(request: Request):
+    """Соединение только для чтения: реплика, если она жива и пользователь недавно не писал."""
+    async with metrics.acquire(db.reader(request.session)) as conn:
         yield conn
 
 
 # --- Главная страница ---
-@app.get("/", response_class=HTMLResponse)
-async def index(request: Request, conn=Depends(get_conn)):
-    polls = await conn.fetch("SELECT id, title, end_date FROM poll ORDER BY id DESC")
-    now = datetime.datetime.now().isoformat()
+@router.get("/", response_class=HTMLResponse)
+async def index(
+        request: Request,
+        poll_status: str = Query("all", alias="status"),
+        before: int | None = None,
+        conn=Depends(get_read_conn)
+):
+    page = await poll_index.get_page(conn, poll_status, before)
     return templates.TemplateResponse("index.html", {
         "request": request,
-        "polls": polls,
-        "now": now
+        "polls": page.polls,
+        "next_before": page.next_before,
+        "before": before,
+        "status": poll_status if poll_status in poll_index.STATUSES else "all",
     })
 
 
 # --- Регистрация ---
-@app.get("/register", response_class=HTMLResponse)
+@router.get("/register", response_class=HTMLResponse)
 async def register_get(request: Request):
     return templates.TemplateResponse("register.html", {"request": request})
 
 
-@app.post("/register")
+@router.post("/register")
 async def register_post(
         request: Request,
         username: str = Form(...),
@@ -90,18 +153,17 @@ async def register_post(
         conn=Depends(get_conn)
 ):
     # 1) Хешируем пароль
-    password_hash = generate_password_hash(password)
+    password_hash = await crypto.run("password_hash", hash_password, password)
 
-    # 2) Генерируем пару RSA‑ключей
-    rsa_key = RSA.generate(2048)
-    private_pem = rsa_key.export_key().decode()
-    public_pem = rsa_key.publickey().export_key().decode()
+    # 2) Берём готовую пару RSA‑ключей из запаса (или генерируем сразу);
+    #    публичный ключ уже в DER — разбирать PEM в обработчике не нужно
+    private_pem, _, public_der = await rsa_pool.take()
 
     # 3) Сохраняем пользователя с публичным ключом
     rec = await conn.fetchrow(
         'INSERT INTO "user" (username, password_hash, rsa_public_key) '
         'VALUES ($1, $2, $3) RETURNING id',
-        username, password_hash, public_pem
+        username, password_hash, public_der
     )
 
     # 4) Автоматически логиним и сохраняем приватный ключ в сессии
@@ -114,7 +176,7 @@ async def register_post(
     return RedirectResponse(url="/mykey", status_code=status.HTTP_303_SEE_OTHER)
 
 
-@app.get("/mykey", response_class=HTMLResponse)
+@router.get("/mykey", response_class=HTMLResponse)
 async def show_my_key(request: Request):
     # Доступ только для залогиненных пользователей
     if not request.session.get("user_id"):
@@ -128,12 +190,12 @@ async def show_my_key(request: Request):
 
 
 # --- Вход ---
-@app.get("/login", response_class=HTMLResponse)
+@router.get("/login", response_class=HTMLResponse)
 async def login_get(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
 
 
-@app.post("/login")
+@router.post("/login")
 async def login_post(
         request: Request,
         username: str = Form(...),
@@ -144,7 +206,7 @@ async def login_post(
         'SELECT id, password_hash, is_admin FROM "user" WHERE username = $1',
         username
     )
-    if row and check_password_hash(row["password_hash"], password):
+    if row and await crypto.run("password_check", check_password, row["password_hash"], password):
         request.session["user_id"] = row["id"]
         request.session["username"] = username
         request.session["is_admin"] = row["is_admin"]
@@ -156,126 +218,118 @@ async def login_post(
 
 
 # --- Страница про гомоморфизм ---
-@app.get("/homomorphic-info", response_class=HTMLResponse)
+@router.get("/homomorphic-info", response_class=HTMLResponse)
 async def homomorphic_info(request: Request):
     return templates.TemplateResponse("homomorphic_info.html", {"request": request})
 
 
 # --- Создание голосования (админ) ---
-@app.get("/admin/create_poll", response_class=HTMLResponse)
+@router.get("/admin/create_poll", response_class=HTMLResponse)
 async def create_poll_get(request: Request):
     if not request.session.get("is_admin"):
         return HTMLResponse("Доступ запрещен", status_code=403)
-    return templates.TemplateResponse("create_poll.html", {"request": request})
+    return templates.TemplateResponse("create_poll.html", {
+        "request": request,
+        "profiles": crypto_profiles.PROFILES.values(),
+        "default_profile": crypto_profiles.DEFAULT_PROFILE.name,
+    })
 
 
-@app.post("/admin/create_poll")
+@router.post("/admin/create_poll")
 async def create_poll_post(
         request: Request,
         title: str = Form(...),
         end_date: str = Form(...),
         options: list[str] = Form(...),
+        packed: bool = Form(False),
+        profile: str = Form(crypto_profiles.DEFAULT_PROFILE.name),
         conn=Depends(get_conn)
 ):
     # 0) Доступ и валидации
     if not request.session.get("is_admin"):
         return HTMLResponse("Доступ запрещен", status_code=403)
-    if len(options) < 2:
-        return HTMLResponse("Ошибка: как минимум два варианта", status_code=400)
+    try:
+        spec = polls.make_spec(title, end_date, options, packed, profile)
+    except polls.PollSpecError as e:
+        return HTMLResponse(f"Ошибка: {e}", status_code=400)
 
-    # 1) Генерируем гомоморфный ключ Paillier
-    public_key, private_key = generate_homomorphic_keypair()
+    # 1) Ключ Paillier из запаса профиля (или генерируем сразу в пуле криптоопераций)
+    keypair = await paillier_pools[spec.profile].take()
 
-    # 2) Сохраняем публичные параметры в БД
-    rec = await conn.fetchrow(
-        '''
-        INSERT INTO poll (title, end_date, public_key_n, public_key_g)
-        VALUES ($1, $2, $3, $4)
-        RETURNING id
-        ''',
-        title,
-        end_date,
-        str(public_key.n),
-        str(public_key.g),
-    )
-    poll_id = rec["id"]
-
-    # 3) Кладём приватный ключ в защищённый каталог (не в БД!)
-    priv_path = f"secure_keys/poll_{poll_id}.key"
-    os.makedirs(os.path.dirname(priv_path), exist_ok=True)
-    with open(priv_path, "w", encoding="utf-8") as f:
-        f.write(serialize_private_key(private_key))
-    os.chmod(priv_path, 0o600)  # только для пользователя‑сервиса
-
-    # 4) Добавляем варианты ответа
-    for opt in options:
-        await conn.execute(
-            "INSERT INTO poll_options (poll_id, option_text) VALUES ($1, $2)",
-            poll_id,
-            opt,
-        )
+    # 2) Опрос, варианты, нулевые итоги и приватный ключ — одной транзакцией
+    try:
+        await polls.create_poll(conn, spec, keypair)
+    except polls.PollSpecError as e:
+        return HTMLResponse(f"Ошибка: {e}", status_code=400)
+    poll_index.invalidate()
+    pin_primary(request.session)
 
-    # 5) Готово
+    # 3) Готово
     return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
 
 
-def load_private_key(poll_id: int, public_key):
-    """Читает приватный ключ Paillier для указанного опроса из защищённого каталога."""
-    key_path = f"secure_keys/poll_{poll_id}.key"
-    with open(key_path, "r", encoding="utf-8") as f:
-        return deserialize_private_key(f.read(), public_key)
+# --- Пакетное создание голосований (админ, JSON или CSV) ---
+@router.post("/admin/polls/bulk")
+async def create_polls_bulk(
+        request: Request,
+        file: UploadFile = File(...),
+        conn=Depends(get_conn)
+):
+    if not request.session.get("is_admin"):
+        return HTMLResponse("Доступ запрещен", status_code=403)
+    try:
+        specs = polls.parse_bulk(await file.read(), file.filename or "")
+    except polls.PollSpecError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    try:
+        poll_ids = await polls.create_polls(conn, specs)
+    except polls.PollSpecError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    poll_index.invalidate()
+    pin_primary(request.session)
+    return JSONResponse({"created": poll_ids})
 
 
 # --- Голосование ---
-@app.get("/poll/{poll_id}", response_class=HTMLResponse)
+@router.get("/poll/{poll_id}", response_class=HTMLResponse)
 async def vote_get(
         request: Request,
         poll_id: int,
-        conn=Depends(get_conn)
+        conn=Depends(get_read_conn)
 ):
     # 0) Требуем авторизацию
     user_id = request.session.get("user_id")
     if not user_id:
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
 
-    # 1) Достаём публичные данные опроса
-    poll = await conn.fetchrow(
-        "SELECT title, public_key_n, end_date FROM poll WHERE id = $1",
-        poll_id
-    )
-    if not poll:
+    # 1) Опрос, варианты и предыдущий голос пользователя — одним запросом
+    ctx = await poll_context.load(conn, poll_id, user_id)
+    if ctx is None:
         return HTMLResponse("Голосование не найдено", status_code=404)
 
-    title = poll["title"]
-    public_key = paillier.PaillierPublicKey(n=int(poll["public_key_n"]))
-    private_key = load_private_key(poll_id, public_key)  # <- Читаем из /var/secure/keys
-    end_date = poll["end_date"]
-
-    # 2) Варианты ответов
-    options = await conn.fetch(
-        "SELECT id, option_text FROM poll_options WHERE poll_id = $1 ORDER BY id",
-        poll_id
-    )
+    meta = ctx.meta
+    public_key = meta.public_key
+    options = meta.options
 
-    # 3) Открыто ли голосование?
-    now = datetime.datetime.now().isoformat()
-    is_closed = now >= end_date
+    # 2) Открыто ли голосование?
+    is_closed = meta.is_closed
+    if not is_closed:
+        # Избиратель скоро проголосует — готовим множители для шифрования
+        obfuscators.registry.warm(poll_id, public_key.n, meta.end_date)
 
-    # 4) Ищем предыдущий голос пользователя (нужно для pre‑selection в форме)
-    prev = await conn.fetchrow(
-        "SELECT ciphertexts FROM vote WHERE poll_id = $1 AND user_id = $2",
-        poll_id,
-        user_id,
-    )
+    # 3) Предыдущий голос (нужен для pre‑selection в форме)
     previous_vote = None
-    if prev:
-        arr = json.loads(prev["ciphertexts"])
-        for (opt_id, _), cstr in zip(options, arr):
-            if private_key.decrypt(paillier.EncryptedNumber(public_key, int(cstr))) == 1:
+    if ctx.vote:
+        ballot, stored_cts = ctx.vote[:2]
+        arr = read_ciphertexts(ballot, stored_cts, ciphertext_width(public_key.n))
+        values = await private_keys.decrypt_many(poll_id, public_key, arr, max_plaintext=meta.max_plaintext(1))
+        for (opt_id, _), val in zip(options, meta.decode(values)):
+            if val == 1:
                 previous_vote = opt_id
                 break
 
-    # 5) Текст всплывающего уведомления после POST‑редиректа
+    # 4) Текст всплывающего уведомления после POST‑редиректа
     voted_id = request.query_params.get("voted")
     voted_text = None
     if voted_id:
@@ -284,226 +338,265 @@ async def vote_get(
                 voted_text = opt_text
                 break
 
-    # 6) Рендерим шаблон
+    # 5) Рендерим шаблон
     return templates.TemplateResponse(
         "vote.html",
         {
             "request": request,
-            "title": title,
+            "title": meta.title,
             "poll_id": poll_id,
             "options": options,
             "previous_vote": previous_vote,
             "is_closed": is_closed,
             "can_change": not is_closed,
             "voted_text": voted_text,
+            "client_ballots": client_ballots.CLIENT_BALLOTS,
         },
     )
 
 
-@app.post("/poll/{poll_id}")
+@router.post("/poll/{poll_id}")
 async def vote_post(
         request: Request,
         poll_id: int,
         selected_option: int = Form(..., alias="option"),
         priv_key_pem: str = Form(..., alias="priv_key"),
-        conn=Depends(get_conn)
 ):
     # --- Авторизация ---
     user_id = request.session.get("user_id")
     if not user_id:
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
 
-    # 1) Проверяем, что голосование ещё открыто
-    poll = await conn.fetchrow(
-        "SELECT public_key_n, end_date FROM poll WHERE id=$1",
-        poll_id,
-    )
-    if not poll:
+    # Соединение нужно только на чтение — шифрование, подпись и ожидание
+    # очереди записи его не держат
+    # 1-2) Опрос, варианты и публичный ключ избирателя — одним запросом
+    # (окончательно открытость опроса проверяет очередь записи)
+    async with metrics.acquire(db.primary) as conn:
+        ctx = await poll_context.load(conn, poll_id, user_id)
+    if ctx is None:
         return HTMLResponse("Голосование не найдено.", status_code=404)
-
-    if datetime.datetime.now().isoformat() >= poll["end_date"]:
+    meta = ctx.meta
+    if meta.is_closed:
         return HTMLResponse("Голосование завершено.", status_code=400)
-
-    # 2) Варианты
-    options = await conn.fetch(
-        "SELECT id FROM poll_options WHERE poll_id=$1 ORDER BY id",
-        poll_id,
-    )
-
-    # 3) Формируем вектор шифротекстов
-    public_key = paillier.PaillierPublicKey(n=int(poll["public_key_n"]))
-    ciphertexts = [
-        str(public_key.encrypt(1 if opt["id"] == selected_option else 0).ciphertext())
-        for opt in options
-    ]
-
-    # 4) Подписываем сообщение и проверяем приватный ключ
-    msg = f"poll:{poll_id};user:{user_id};choices:{','.join(ciphertexts)}"
-    h = SHA256.new(msg.encode())
-
-    try:
-        priv = RSA.import_key(priv_key_pem)  # ← приватный ключ пользователя
-    except (ValueError, IndexError, TypeError):
-        return HTMLResponse("Неверный формат приватного ключа.", status_code=400)
-
-    # --- НОВАЯ проверка соответствия приватного ⇄ публичного ---
-    stored_pub_pem = await conn.fetchval(
-        'SELECT rsa_public_key FROM "user" WHERE id=$1',
-        user_id,
-    )
-    if not stored_pub_pem:
-        return HTMLResponse("В вашем профиле отсутствует публичный ключ.", status_code=400)
-
+    stored_pub_der = ctx.rsa_public_key
+    plaintexts = meta.encode(selected_option)
+    if plaintexts is None:
+        return HTMLResponse("Неизвестный вариант ответа.", status_code=400)
+
+    # 3) Шифруем бюллетень: вектор 0/1 или один упакованный шифротекст
+    # (r^n mod n² берём из пула)
+    public_key = meta.public_key
+    obfs = await obfuscators.registry.take(poll_id, public_key.n, meta.end_date, len(plaintexts))
+    with metrics.stage("encrypt"):
+        ciphertexts = [
+            encrypt_with_obfuscator(public_key, m, r)
+            for m, r in zip(plaintexts, obfs)
+        ]
+    width = ciphertext_width(public_key.n)
+    ballot = pack_ciphertexts(ciphertexts, width)
+
+    # 4) Проверяем приватный ключ (и его длину по профилю опроса) и подписываем
+    # бюллетень (в пуле криптоопераций)
     try:
-        stored_pub = RSA.import_key(stored_pub_pem)
-    except (ValueError, IndexError, TypeError):
-        return HTMLResponse("Сохранённый публичный ключ повреждён.", status_code=500)
-
-    # Сравниваем параметры n и e
-    if priv.n != stored_pub.n or priv.e != stored_pub.e:
-        # --- НОВАЯ проверка соответствия приватного ⇄ публичного ---
-        stored_pub_pem = await conn.fetchval(
-            'SELECT rsa_public_key FROM "user" WHERE id=$1', user_id)
-
-        # ↓↓↓   вставьте отладку  ↓↓↓
-
-        logging.warning(
-            "DEBUG‑RSA user=%s\npriv.n=%s\npriv.e=%s\npub .n=%s\npub .e=%s",
-            user_id, hex(priv.n)[:80], priv.e, hex(RSA.import_key(stored_pub_pem).n)[:80],
-            RSA.import_key(stored_pub_pem).e,
-        )
-        # ↑↑↑   конец отладки  ↑↑↑
-
-        return HTMLResponse(
-            "Приватный ключ не соответствует вашему публичному ключу.",
-            status_code=400,
+        signature = await crypto.run(
+            "rsa_sign", sign_ballot_pem, priv_key_pem, user_id, stored_pub_der, poll_id, ballot,
+            meta.profile.rsa_bits,
         )
+    except BallotKeyError as e:
+        return HTMLResponse(e.message, status_code=e.status_code)
 
-    # 4‑б) Создаём подпись
-    signature = pkcs1_15.new(priv).sign(h).hex()
-
-    data = json.dumps(ciphertexts)
-
-    # 5) Сохраняем или обновляем голос
-    prev = await conn.fetchrow(
-        "SELECT id FROM vote WHERE poll_id=$1 AND user_id=$2",
-        poll_id,
-        user_id,
-    )
-    if prev:
-        await conn.execute(
-            "UPDATE vote SET ciphertexts=$1, signature=$2 WHERE id=$3",
-            data,
-            signature,
-            prev["id"],
-        )
-    else:
-        await conn.execute(
-            """
-            INSERT INTO vote (poll_id, user_id, ciphertexts, signature)
-            VALUES ($1, $2, $3, $4)
-            """,
-            poll_id,
-            user_id,
-            data,
-            signature,
-        )
-
-    # 6) Успешный редирект
+    # 5) Ставим бюллетень в очередь записи и ждём фиксации его пачки
+    try:
+        await ballot_queue.writer.submit(ballot_queue.PendingBallot(
+            poll_id=poll_id,
+            user_id=user_id,
+            ballot=ballot,
+            sig_format=SIG_PACKED,
+            signature=signature,
+            ciphertexts=ciphertexts,
+            option_ids=meta.tally_option_ids,
+            nsquare=public_key.nsquare,
+            width=width,
+        ))
+    except ballot_queue.BallotRejected as e:
+        return HTMLResponse(str(e), status_code=400)
+
+    # 6) Успешный редирект; страница после него должна увидеть этот голос
+    pin_primary(request.session)
     return RedirectResponse(
         url=f"/poll/{poll_id}?voted={selected_option}",
         status_code=status.HTTP_303_SEE_OTHER,
     )
 
 
-# --- Результаты ---
-@app.get("/poll/{poll_id}/results", response_class=HTMLResponse)
-async def poll_results(request: Request, poll_id: int, conn=Depends(get_conn)):
-    """
-    Подсчитываем итоги голосования гомоморфно и
-    учитываем только голоса, подпись которых корректна.
-    """
-    # 1) Получаем публичный ключ опроса
-    poll = await conn.fetchrow(
-        "SELECT public_key_n FROM poll WHERE id=$1",
-        poll_id,
-    )
-    if not poll:
-        return HTMLResponse("Голосование не найдено", status_code=404)
+# --- Публичные параметры опроса для шифрования на стороне клиента ---
+@router.get("/api/poll/{poll_id}/params")
+async def poll_params(request: Request, poll_id: int, conn=Depends(get_read_conn)):
+    ctx = await poll_context.load(conn, poll_id)
+    if ctx is None:
+        return JSONResponse({"error": "Голосование не найдено."}, status_code=404)
+    meta = ctx.meta
+    body = {
+        "poll_id": poll_id,
+        "public_key_n": str(meta.public_key.n),
+        "options": meta.option_ids,
+        "encoding": meta.encoding,
+        "slot_bits": meta.slot_bits,
+        "profile": meta.profile.name,
+        "min_rsa_bits": meta.profile.rsa_bits,
+        "end_date": meta.end_date.isoformat(),
+        "sig_format": SIG_DECIMAL,
+    }
+    # Параметры опроса не меняются — ответ можно кэшировать где угодно
+    etag = '"' + hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return JSONResponse(body, headers=headers)
+
+
+# --- Приём бюллетеня, зашифрованного и подписанного клиентом ---
+@router.post("/api/poll/{poll_id}/ballot")
+async def client_ballot_post(request: Request, poll_id: int, payload=Body(...)):
+    if not client_ballots.CLIENT_BALLOTS:
+        return JSONResponse({"error": "Приём клиентских бюллетеней выключен."}, status_code=404)
+    user_id = request.session.get("user_id")
+    if not user_id:
+        return JSONResponse({"error": "Требуется вход."}, status_code=401)
 
-    public_key = paillier.PaillierPublicKey(n=int(poll["public_key_n"]))
-    private_key = load_private_key(poll_id, public_key)  # /var/secure/keys/…
+    async with metrics.acquire(db.primary) as conn:
+        ctx = await poll_context.load(conn, poll_id, user_id)
+    if ctx is None:
+        return JSONResponse({"error": "Голосование не найдено."}, status_code=404)
+    meta = ctx.meta
+    if meta.is_closed:
+        return JSONResponse({"error": "Голосование завершено."}, status_code=400)
 
-    # 2) Варианты ответа
-    options = await conn.fetch(
-        "SELECT id, option_text FROM poll_options WHERE poll_id=$1 ORDER BY id",
-        poll_id,
-    )
+    n = meta.public_key.n
+    try:
+        strs, ciphertexts = client_ballots.parse_ciphertexts(payload, n, len(meta.tally_option_ids))
+        signature_ok = await crypto.run(
+            "rsa_verify", verify_client_ballot, user_id, ctx.rsa_public_key, poll_id, strs,
+            payload["signature"], meta.profile.rsa_bits,
+        )
+    except client_ballots.ClientBallotError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except BallotKeyError as e:
+        return JSONResponse({"error": e.message}, status_code=e.status_code)
+    if not signature_ok:
+        return JSONResponse({"error": "Подпись бюллетеня не прошла проверку."}, status_code=400)
+
+    width = ciphertext_width(n)
+    try:
+        await ballot_queue.writer.submit(ballot_queue.PendingBallot(
+            poll_id=poll_id,
+            user_id=user_id,
+            ballot=pack_ciphertexts(ciphertexts, width),
+            sig_format=SIG_DECIMAL,
+            signature=payload["signature"],
+            ciphertexts=ciphertexts,
+            option_ids=meta.tally_option_ids,
+            nsquare=n * n,
+            width=width,
+        ))
+    except ballot_queue.BallotRejected as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    pin_primary(request.session)
+    return JSONResponse({"ok": True})
 
-    # 3) Инициализируем сумму для каждого варианта (шифрование нуля)
-    totals = [public_key.encrypt(0) for _ in options]
 
-    # 4) Считываем все голоса вместе с подписью
-    rows = await conn.fetch(
-        "SELECT user_id, ciphertexts, signature FROM vote WHERE poll_id=$1",
-        poll_id,
-    )
+# --- Результаты ---
+async def final_results(conn, meta: poll_context.PollMeta) -> dict:
+    """Полный пересчёт опроса с проверкой подписей и расшифровкой итогов."""
+    totals, result = await tally.rebuild_tally(conn, meta.poll_id)
+    counts = meta.decode(await private_keys.decrypt_many(
+        meta.poll_id,
+        meta.public_key,
+        [totals[opt_id] for opt_id in meta.tally_option_ids],
+        max_plaintext=meta.max_plaintext(tally.MAX_COUNT),
+    ))
+    return {
+        "counts": dict(zip(meta.option_ids, counts)),
+        "ballot_count": result.counted,
+        "ballots_digest": f"{result.digest:064x}",
+    }
 
-    for row in rows:
-        ct_list = json.loads(row["ciphertexts"])
 
-        # --- Проверяем подпись бюллетеня ---
-        msg = f"poll:{poll_id};user:{row['user_id']};choices:{','.join(ct_list)}"
-        h = SHA256.new(msg.encode())
-        user_pub_pem = await conn.fetchval(
-            'SELECT rsa_public_key FROM "user" WHERE id=$1',
-            row["user_id"],
-        )
-        try:
-            pkcs1_15.new(RSA.import_key(user_pub_pem)).verify(
-                h,
-                bytes.fromhex(row["signature"]),
-            )
-        except (ValueError, TypeError):
-            # Подпись не совпала → игнорируем голос
-            continue
-
-        # 5) Гомоморфное сложение компонент
-        for i, cstr in enumerate(ct_list):
-            totals[i] = totals[i] + paillier.EncryptedNumber(public_key, int(cstr))
-
-    # 6) Расшифровка сумм → окончательные результаты
-    results = {
-        opt["option_text"]: private_key.decrypt(total)
-        for opt, total in zip(options, totals)
-    }
+@router.get("/poll/{poll_id}/results", response_class=HTMLResponse)
+async def poll_results(request: Request, poll_id: int, conn=Depends(get_read_conn)):
+    """
+    Расшифровываем гомоморфные итоги голосования. Пока опрос открыт,
+    итоги ведутся инкрементально в vote_post (учитываются только подписанные
+    голоса). Для завершённого опроса один раз выполняется полный пересчёт с
+    проверкой подписей (tally.rebuild_tally), его результат кэшируется.
+    Чтение идёт с реплики; пересчёт (запись) — на основном сервере.
+    """
+    # 1-2) Публичный ключ опроса и варианты ответа
+    ctx = await poll_context.load(conn, poll_id)
+    if ctx is None:
+        return HTMLResponse("Голосование не найдено", status_code=404)
+    meta = ctx.meta
+
+    # 3) Завершённый опрос — окончательные итоги из кэша
+    if meta.is_closed:
+        final = await result_cache.peek(conn, poll_id)
+        if final is None:
+            async with metrics.acquire(db.primary) as wconn:
+                final = await result_cache.get_or_compute(
+                    wconn, poll_id, lambda: final_results(wconn, meta),
+                )
+        counts = [final["counts"][opt_id] for opt_id in meta.option_ids]
+
+    # 4) Открытый опрос — расшифровка инкрементальных итогов
+    else:
+        final = None
+        totals = await tally.read_tally(conn, poll_id)
+        if not totals:
+            async with metrics.acquire(db.primary) as wconn:
+                totals = await tally.load_tally(wconn, poll_id)
+        counts = meta.decode(await private_keys.decrypt_many(
+            poll_id,
+            meta.public_key,
+            [totals[opt_id] for opt_id in meta.tally_option_ids],
+            max_plaintext=meta.max_plaintext(tally.MAX_COUNT),
+        ))
+    results = {opt_text: count for (_, opt_text), count in zip(meta.options, counts)}
 
     return templates.TemplateResponse(
         "results.html",
         {
             "request": request,
             "results": results,
+            "final": final,
             "poll_id": poll_id,
+            "live": not meta.is_closed,
         },
     )
 
 
-@app.get("/poll/{poll_id}/verify", response_class=HTMLResponse)
+# --- Живые итоги открытого опроса (server-sent events, см. live.py) ---
+@router.get("/poll/{poll_id}/live")
+async def poll_live(poll_id: int):
+    return StreamingResponse(
+        live.hub.subscribe(poll_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/poll/{poll_id}/verify", response_class=HTMLResponse)
 async def verify_vote_get(
         request: Request,
         poll_id: int,
-        conn=Depends(get_conn)  # ← нужно подключение
+        conn=Depends(get_read_conn)  # ← нужно подключение
 ):
     # требуем авторизацию
     if not request.session.get("user_id"):
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
 
     # берём название опроса
-    poll = await conn.fetchrow(
-        "SELECT title FROM poll WHERE id=$1",
-        poll_id,
-    )
-    if not poll:
+    ctx = await poll_context.load(conn, poll_id)
+    if ctx is None:
         return HTMLResponse("Опрос не найден.", status_code=404)
 
     return templates.TemplateResponse(
@@ -511,133 +604,196 @@ async def verify_vote_get(
         {
             "request": request,
             "poll_id": poll_id,
-            "title": poll["title"],  # ← передаём в шаблон
+            "title": ctx.meta.title,  # ← передаём в шаблон
         },
     )
 
 
 # --- Проверка голоса ---
-@app.post("/poll/{poll_id}/verify", response_class=HTMLResponse)
+@router.post("/poll/{poll_id}/verify", response_class=HTMLResponse)
 async def verify_vote_post(
         request: Request,
         poll_id: int,
         priv_key_pem: str = Form(..., alias="priv_key"),
         conn=Depends(get_conn)
 ):
-    import logging
-    log = logging.getLogger("uvicorn.error")
-
     user_id = request.session.get("user_id")
     if not user_id:
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
 
-    # Проверяем соответствие приватного и публичного ключа
-    try:
-        priv = RSA.import_key(priv_key_pem)
-    except (ValueError, IndexError, TypeError):
-        return HTMLResponse("Неверный формат приватного ключа.", status_code=400)
+    # Название опроса, Paillier ключ, бюллетень и подпись пользователя, его RSA-ключ
+    ctx = await poll_context.load(conn, poll_id, user_id)
+    if ctx is None:
+        return HTMLResponse("Опрос не найден.", status_code=404)
+    title = ctx.meta.title
+    public_key = ctx.meta.public_key
+    width = ciphertext_width(public_key.n)
+    row = ctx.vote
+    stored_pub_der = ctx.rsa_public_key
 
-    stored_pub_pem = await conn.fetchval(
-        'SELECT rsa_public_key FROM "user" WHERE id=$1', user_id
-    )
+    # Проверяем соответствие приватного и публичного ключа и подпись голоса
     try:
-        stored_pub = RSA.import_key(stored_pub_pem)
-    except (ValueError, IndexError, TypeError):
-        return HTMLResponse("Сохранённый публичный ключ повреждён.", status_code=500)
-
-    if priv.n != stored_pub.n or priv.e != stored_pub.e:
-        log.warning(
-            "VERIFY‑RSA mismatch user=%s\npriv.n=%s\npriv.e=%s\npub .n=%s\npub .e=%s",
-            user_id, hex(priv.n)[:80], priv.e, hex(stored_pub.n)[:80], stored_pub.e,
-        )
-        return HTMLResponse(
-            "Приватный ключ не соответствует вашему публичному ключу.",
-            status_code=400,
+        signature_ok = await crypto.run(
+            "rsa_verify", verify_own_ballot_pem, priv_key_pem, user_id, stored_pub_der,
+            poll_id, row, width,
         )
+    except BallotKeyError as e:
+        return HTMLResponse(e.message, status_code=e.status_code)
 
-    # Достаём зашифрованный бюллетень и подпись пользователя
-    row = await conn.fetchrow(
-        "SELECT ciphertexts, signature FROM vote WHERE poll_id=$1 AND user_id=$2",
-        poll_id,
-        user_id,
-    )
     if not row:
         return HTMLResponse("Ваш голос не найден.", status_code=404)
-
-    ct_list = json.loads(row["ciphertexts"])
-    msg = f"poll:{poll_id};user:{user_id};choices:{','.join(ct_list)}"
-    h = SHA256.new(msg.encode())
-    try:
-        pkcs1_15.new(stored_pub).verify(h, bytes.fromhex(row["signature"]))
-    except (ValueError, TypeError):
+    if not signature_ok:
         return HTMLResponse(
             "Ошибка: подпись вашего голоса не прошла проверку.",
             status_code=400,
         )
 
-    # Получаем название опроса + Paillier ключ
-    poll = await conn.fetchrow(
-        "SELECT title, public_key_n FROM poll WHERE id=$1",
-        poll_id,
-    )
-    if not poll:
-        return HTMLResponse("Опрос не найден.", status_code=404)
-    title = poll["title"]
-    public_key = paillier.PaillierPublicKey(n=int(poll["public_key_n"]))
-    private_key = load_private_key(poll_id, public_key)
-
     # Расшифровка
-    chosen_opt_id = None
-    for idx, cstr in enumerate(ct_list):
-        val = private_key.decrypt(
-            paillier.EncryptedNumber(public_key, int(cstr))
-        )
-        if val == 1:
-            chosen_opt_id = idx
-            break
+    values = ctx.meta.decode(await private_keys.decrypt_many(
+        poll_id,
+        public_key,
+        read_ciphertexts(row[0], row[1], width),
+        max_plaintext=ctx.meta.max_plaintext(1),
+    ))
+    chosen = values.index(1) if 1 in values else None
 
-    if chosen_opt_id is None:
+    if chosen is None or chosen >= len(ctx.meta.options):
         return HTMLResponse("Не удалось определить ваш выбор.", status_code=400)
 
-    option = await conn.fetchrow(
-        """
-        SELECT option_text
-        FROM   poll_options
-        WHERE  poll_id=$1
-        ORDER  BY id
-        OFFSET $2
-        LIMIT  1
-        """,
-        poll_id,
-        chosen_opt_id,
-    )
-
     return templates.TemplateResponse(
         "verify_vote.html",
         {
             "request": request,
             "poll_id": poll_id,
             "title": title,  # ← теперь передаётся в шаблон
-            "chosen": option["option_text"],
+            "chosen": ctx.meta.options[chosen][1],
         },
     )
 
 
 # --- Удаление опроса (админ) ---
-@app.post("/admin/poll/{poll_id}/delete")
+@router.post("/admin/poll/{poll_id}/delete")
 async def delete_poll(request: Request, poll_id: int, conn=Depends(get_conn)):
     if not request.session.get("is_admin"):
         return HTMLResponse("Доступ запрещен", status_code=403)
 
+    obfuscators.registry.discard(poll_id)
+    private_keys.invalidate(poll_id)
+    poll_context.invalidate(poll_id)
+    await result_cache.invalidate(conn, poll_id)
+    await conn.execute("DELETE FROM poll_tally WHERE poll_id = $1", poll_id)
     await conn.execute("DELETE FROM vote WHERE poll_id = $1", poll_id)
     await conn.execute("DELETE FROM poll_options WHERE poll_id = $1", poll_id)
     await conn.execute("DELETE FROM poll WHERE id = $1", poll_id)
+    poll_index.invalidate()
+    pin_primary(request.session)
 
     return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
 
 
+# --- Пересчёт итогов опроса (админ) ---
+@router.post("/admin/poll/{poll_id}/retally")
+async def retally_poll(request: Request, poll_id: int, conn=Depends(get_conn)):
+    if not request.session.get("is_admin"):
+        return HTMLResponse("Доступ запрещен", status_code=403)
+
+    await result_cache.invalidate(conn, poll_id)
+    try:
+        await tally.rebuild_tally(conn, poll_id)
+    except LookupError:
+        return HTMLResponse("Голосование не найдено", status_code=404)
+
+    return RedirectResponse(url=f"/poll/{poll_id}/results", status_code=status.HTTP_303_SEE_OTHER)
+
+
+# --- Метрики пула криптоопераций, запасов ключей и очереди бюллетеней (админ) ---
+@router.get("/admin/crypto_stats")
+async def crypto_stats(request: Request):
+    if not request.session.get("is_admin"):
+        return HTMLResponse("Доступ запрещен", status_code=403)
+    return JSONResponse({
+        **crypto.snapshot(),
+        "key_pools": {
+            "rsa": rsa_pool.metrics(),
+            **{f"paillier_{name}": pool.metrics() for name, pool in paillier_pools.items()},
+        },
+        "ballot_queue": ballot_queue.writer.metrics(),
+        "db": db.metrics(),
+        "live": live.hub.metrics(),
+        "startup": startup.report(),
+    })
+
+
+# --- Метрики Prometheus ---
+metrics.registry.add(metrics.Gauge(
+    "db_pool_connections", "Соединения пулов PostgreSQL.", ("pool", "state"),
+    lambda: {
+        **metrics.pool_gauges(db.primary, "primary"),
+        **metrics.pool_gauges(db.replica, "replica"),
+    },
+))
+metrics.registry.add(metrics.Gauge(
+    "db_replica_healthy", "Реплика для чтения доступна и не отстаёт.", (),
+    lambda: {(): int(db.replica_healthy)} if db.replica is not None else {},
+))
+metrics.registry.add(metrics.Gauge(
+    "crypto_pending", "Операции в пуле криптографии (в работе и в очереди).", (),
+    lambda: {(): crypto.pending},
+))
+metrics.registry.add(metrics.Gauge(
+    "key_pool_level", "Готовые ключи в запасе.", ("pool",),
+    lambda: {
+        ("rsa",): len(rsa_pool.items),
+        **{(f"paillier_{name}",): len(pool.items) for name, pool in paillier_pools.items()},
+    },
+))
+metrics.registry.add(metrics.Gauge(
+    "ballot_queue_depth", "Бюллетени в очереди записи.", (),
+    lambda: {(): ballot_queue.writer.metrics()["queued"]},
+))
+metrics.registry.add(metrics.Gauge(
+    "worker_startup_seconds", "Время запуска воркера по этапам (import, lifespan).", ("phase",),
+    lambda: {(phase,): seconds for phase, seconds in startup.timings.items()},
+))
+metrics.registry.add(metrics.Gauge(
+    "live_subscribers", "Открытые потоки живых итогов.", (),
+    lambda: {(): live.hub.metrics()["subscribers"]},
+))
+
+
+@router.get("/metrics")
+async def metrics_endpoint(request: Request):
+    if metrics.METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {metrics.METRICS_TOKEN}":
+        return Response(status_code=status.HTTP_401_UNAUTHORIZED)
+    return Response(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
 # --- Выход ---
-@app.get("/logout")
+@router.get("/logout")
 async def logout(request: Request):
     request.session.clear()
     return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
+
+
+# --- Сборка приложения ---
+def create_app() -> FastAPI:
+    """
+    Фабрика приложения (uvicorn --factory main:create_app). Всё, что она
+    создаёт, воркеры только читают, поэтому с gunicorn --preload приложение
+    и скомпилированные шаблоны собираются один раз в мастере и достаются
+    воркерам при fork; соединения, процессы и задачи открывает lifespan
+    уже в воркере.
+    """
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(SessionMiddleware, secret_key="secret_key_for_session")
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.mount("/static", StaticFiles(directory="static"), name="static")
+    app.add_exception_handler(CryptoOverloaded, crypto_overloaded)
+    app.add_exception_handler(ballot_queue.BallotQueueFull, ballot_queue_full)
+    app.include_router(router)
+    templates.precompile()
+    startup.imported()
+    return app
+
+
+app = create_app()
@@ -0,0 +1,274 @@
+# metrics.py
+"""
+Метрики в текстовом формате Prometheus (GET /metrics) и разбивка времени
+запроса по этапам.
+
+Гистограммы:
+    http_request_duration_seconds{route,method,status} — запрос целиком
+    request_stage_seconds{stage}                 — этапы: db, db_acquire,
+                                                   crypto, render, ...
+    db_query_duration_seconds{statement,error}   — каждый SQL-запрос
+                                                   (логгер запросов asyncpg)
+    crypto_op_seconds{op,phase}                  — операции пула
+                                                   криптографии (wait/exec)
+    tally_duration_seconds                       — полный пересчёт опроса
+Счётчики и показатели: tally_ballots_total, ballots_written_total, а также
+значения, вычисляемые при опросе (соединения пула, очередь, крипто-пул).
+
+Этапы запроса собираются в contextvar: MetricsMiddleware заводит словарь
+на запрос, stage()/record() добавляют в него время. Если запрос дольше
+SLOW_REQUEST_SECONDS, разбивка пишется в журнал. Потоки событий
+(text/event-stream, см. live.py) в гистограмму и журнал не попадают: они
+открыты, пока открыта страница. Накладные расходы — несколько вызовов
+time.perf_counter и bisect на этап.
+
+Переменные окружения:
+    SLOW_REQUEST_SECONDS — порог медленного запроса (по умолчанию 1.0)
+    METRICS_TOKEN        — если задан, /metrics требует "Authorization: Bearer <токен>"
+"""
+import bisect
+import contextvars
+import logging
+import os
+import re
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1.0"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LONG_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+# Этапы текущего запроса: {этап: секунды} или None вне запроса
+_stages: contextvars.ContextVar[dict | None] = contextvars.ContextVar("request_stages", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        # значения меток → [счётчики по корзинам..., +Inf], сумма
+        self._counts: dict[tuple, list[int]] = {}
+        self._sums: dict[tuple, float] = defaultdict(float)
+
+    def observe(self, value: float, *labels):
+        counts = self._counts.get(labels)
+        if counts is None:
+            counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[labels] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {self._sums[labels]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self._values: dict[tuple, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, *labels):
+        self._values[labels] += amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.label_names, k)} {v}" for k, v in self._values.items()]
+        return lines
+
+
+class Gauge:
+    """Показатель, вычисляемый при опросе: fn() → {значения меток: число}."""
+
+    def __init__(self, name: str, help_text: str, labels: tuple, fn):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self.fn = fn
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.fn()
+        except Exception:
+            logger.exception("Не удалось вычислить %s", self.name)
+            return lines
+        lines += [f"{self.name}{_labels(self.label_names, k)} {v}" for k, v in values.items()]
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.add(Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса.", ("route", "method", "status"),
+))
+request_stages = registry.add(Histogram(
+    "request_stage_seconds", "Время этапов обработки запроса.", ("stage",),
+))
+db_queries = registry.add(Histogram(
+    "db_query_duration_seconds", "Время SQL-запросов.", ("statement", "error"),
+))
+crypto_ops = registry.add(Histogram(
+    "crypto_op_seconds", "Операции пула криптографии: ожидание (wait) и выполнение (exec).", ("op", "phase"),
+))
+tally_duration = registry.add(Histogram(
+    "tally_duration_seconds", "Полный пересчёт итогов опроса.", (), LONG_BUCKETS,
+))
+tally_ballots = registry.add(Counter(
+    "tally_ballots_total", "Бюллетени, обработанные полными пересчётами.", ("result",),
+))
+ballots_written = registry.add(Counter(
+    "ballots_written_total", "Бюллетени, записанные очередью записи.", ("result",),
+))
+
+
+# --- Этапы запроса ---
+def record(stage: str, seconds: float):
+    """Добавляет время этапа в гистограмму и в разбивку текущего запроса."""
+    request_stages.observe(seconds, stage)
+    stages = _stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+@asynccontextmanager
+async def acquire(pool):
+    """pool.acquire() с учётом ожидания свободного соединения (этап db_acquire)."""
+    started = time.perf_counter()
+    async with pool.acquire() as conn:
+        record("db_acquire", time.perf_counter() - started)
+        yield conn
+
+
+# --- SQL-запросы ---
+_statement_names: dict[str, str] = {}
+
+
+def statement_name(query: str) -> str:
+    """Короткая метка запроса: первые слова без лишних пробелов."""
+    name = _statement_names.get(query)
+    if name is None:
+        name = re.sub(r"\s+", " ", query).strip()[:80]
+        if len(_statement_names) < 1000:
+            _statement_names[query] = name
+    return name
+
+
+def _log_query(record_):
+    db_queries.observe(
+        record_.elapsed, statement_name(record_.query), "1" if record_.exception else "0",
+    )
+    # Вызов запланирован call_soon в контексте запроса — разбивка та же
+    record("db", record_.elapsed)
+
+
+async def init_connection(conn):
+    """init= для asyncpg.create_pool: время каждого запроса соединения."""
+    conn.add_query_logger(_log_query)
+
+
+def pool_gauges(pool, name: str) -> dict:
+    if pool is None:  # до старта приложения или реплика не задана
+        return {}
+    return {
+        (name, "size"): pool.get_size(),
+        (name, "idle"): pool.get_idle_size(),
+        (name, "in_use"): pool.get_size() - pool.get_idle_size(),
+        (name, "max"): pool.get_max_size(),
+    }
+
+
+# --- ASGI middleware ---
+class MetricsMiddleware:
+    """Время запроса по маршрутам и журнал медленных запросов с разбивкой."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stages: dict[str, float] = {}
+        token = _stages.set(stages)
+        status_code = 500
+        streaming = False
+
+        async def send_wrapper(message):
+            nonlocal status_code, streaming
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                # Поток событий (live.py) открыт минутами — это не время запроса
+                streaming = any(
+                    name.lower() == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", ())
+                )
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _stages.reset(token)
+            if not streaming:
+                route = scope.get("route")
+                path = getattr(route, "path", None) or "unmatched"
+                http_requests.observe(elapsed, path, scope["method"], status_code)
+                if elapsed >= SLOW_REQUEST_SECONDS:
+                    breakdown = ", ".join(f"{k}={v * 1e3:.1f}ms" for k, v in sorted(stages.items()))
+                    logger.warning(
+                        "Медленный запрос %s %s: %.1f мс (%s)",
+                        scope["method"], scope["path"], elapsed * 1e3, breakdown or "без этапов",
+                    )
@@ -0,0 +1,124 @@
+# obfuscators.py
+"""
+Пул заранее вычисленных множителей r^n mod n² для шифрования Paillier.
+
+Самая дорогая часть public_key.encrypt — возведение случайного r в степень n
+по модулю n². Пока опрос открыт, фоновая задача держит для него запас таких
+множителей (вычисляются в пуле криптоопераций), и шифрование бюллетеня сводится
+к умножениям по модулю n². Каждый множитель выдаётся ровно один раз.
+
+Переменные окружения:
+    OBFUSCATOR_POOL_SIZE  — запас на один опрос (по умолчанию 256)
+    OBFUSCATOR_LOW_WATER  — порог, ниже которого запускается пополнение (64)
+    OBFUSCATOR_MAX_TOTAL  — общий предел по всем опросам (4096 ≈ 2 МиБ
+                            при 2048-битном модуле)
+"""
+import asyncio
+import datetime
+import logging
+import os
+import secrets
+from collections import deque
+
+from crypto_executor import crypto
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.getenv("OBFUSCATOR_POOL_SIZE", "256"))
+LOW_WATER = int(os.getenv("OBFUSCATOR_LOW_WATER", "64"))
+MAX_TOTAL = int(os.getenv("OBFUSCATOR_MAX_TOTAL", "4096"))
+
+# Множителей за один заход в пул криптоопераций
+_BATCH = 32
+
+
+def generate_obfuscators(n: int, count: int) -> list[int]:
+    """Выполняется в процессе пула: count значений r^n mod n²."""
+    nsquare = n * n
+    return [pow(secrets.randbelow(n - 1) + 1, n, nsquare) for _ in range(count)]
+
+
+class ObfuscatorPool:
+    """Запас множителей одного опроса."""
+
+    def __init__(self, n: int, end_date: datetime.datetime):
+        self.n = n
+        self.end_date = end_date
+        self.items: deque[int] = deque()
+        self.refill_task: asyncio.Task | None = None
+
+    def is_open(self) -> bool:
+        return datetime.datetime.now(datetime.timezone.utc) < self.end_date
+
+
+class ObfuscatorRegistry:
+    """Пулы множителей по опросам с общим ограничением памяти."""
+
+    def __init__(self, pool_size: int, low_water: int, max_total: int):
+        self.pool_size = pool_size
+        self.low_water = low_water
+        self.max_total = max_total
+        self._pools: dict[int, ObfuscatorPool] = {}
+
+    def total(self) -> int:
+        return sum(len(p.items) for p in self._pools.values())
+
+    def warm(self, poll_id: int, n: int, end_date: datetime.datetime) -> ObfuscatorPool:
+        """Заводит пул для открытого опроса и запускает пополнение."""
+        pool = self._pools.get(poll_id)
+        if pool is None or pool.n != n:
+            pool = self._pools[poll_id] = ObfuscatorPool(n, end_date)
+        self._maybe_refill(poll_id, pool)
+        return pool
+
+    async def take(self, poll_id: int, n: int, end_date: datetime.datetime, count: int) -> list[int]:
+        """
+        Забирает count множителей. deque.popleft выполняется в event loop
+        без переключений, так что один множитель не достанется двоим.
+        Недостающие (пул пуст или ещё не прогрет) вычисляются в пуле
+        криптоопераций.
+        """
+        pool = self.warm(poll_id, n, end_date)
+        taken = [pool.items.popleft() for _ in range(min(count, len(pool.items)))]
+        self._maybe_refill(poll_id, pool)
+
+        if len(taken) < count:
+            taken += await crypto.run("paillier_obfuscate", generate_obfuscators, n, count - len(taken))
+        return taken
+
+    def discard(self, poll_id: int):
+        pool = self._pools.pop(poll_id, None)
+        if pool and pool.refill_task:
+            pool.refill_task.cancel()
+
+    def close(self):
+        for poll_id in list(self._pools):
+            self.discard(poll_id)
+
+    def _maybe_refill(self, poll_id: int, pool: ObfuscatorPool):
+        if not pool.is_open():
+            self.discard(poll_id)
+            return
+        if len(pool.items) < self.low_water and pool.refill_task is None:
+            pool.refill_task = asyncio.create_task(self._refill(poll_id, pool))
+
+    async def _refill(self, poll_id: int, pool: ObfuscatorPool):
+        try:
+            while pool.is_open() and self._pools.get(poll_id) is pool:
+                room = min(self.pool_size - len(pool.items), self.max_total - self.total())
+                if room <= 0:
+                    break
+                batch = await crypto.run(
+                    "paillier_obfuscate", generate_obfuscators, pool.n, min(room, _BATCH),
+                    background=True,
+                )
+                pool.items.extend(batch)
+        except Exception:
+            logger.exception("Не удалось пополнить пул множителей опроса %s", poll_id)
+        finally:
+            pool.refill_task = None
+        if not pool.is_open():
+            self.discard(poll_id)
+
+
+registry = ObfuscatorRegistry(POOL_SIZE, LOW_WATER, MAX_TOTAL)
@@ -0,0 +1,142 @@
+# poll_context.py
+"""
+Данные страницы опроса за один запрос к базе.
+
+load() возвращает метаданные опроса (название, public_key_n, дату
+окончания, варианты, кодировку бюллетеня и профиль криптопараметров),
+бюллетень текущего пользователя и его публичный RSA-ключ. Метаданные
+после создания опроса не меняются, поэтому хранятся в небольшом
+LRU-кэше (POLL_META_CACHE_SIZE опросов): при попадании запрос читает
+только бюллетень и ключ, при промахе — всё сразу, варианты через
+подзапросы ARRAY(...). Строка poll читается всегда, так что опрос,
+удалённый другим воркером, сразу выпадает из кэша.
+
+Переменные окружения:
+    POLL_META_CACHE_SIZE — сколько опросов держать в кэше (по умолчанию 1024)
+"""
+import datetime
+import os
+from collections import OrderedDict
+from typing import NamedTuple
+
+from phe import paillier
+
+import ballot_format
+import crypto_profiles
+
+POLL_META_CACHE_SIZE = int(os.getenv("POLL_META_CACHE_SIZE", "1024"))
+
+
+class PollMeta(NamedTuple):
+    poll_id: int
+    title: str
+    public_key: paillier.PaillierPublicKey
+    end_date: datetime.datetime
+    options: tuple[tuple[int, str], ...]  # (id, option_text) по порядку id
+    encoding: int = ballot_format.ENCODING_VECTOR
+    slot_bits: int = ballot_format.SLOT_BITS
+    profile: crypto_profiles.CryptoProfile = crypto_profiles.PROFILES[crypto_profiles.LEGACY_PROFILE]
+
+    @property
+    def option_ids(self) -> list[int]:
+        return [opt_id for opt_id, _ in self.options]
+
+    @property
+    def tally_option_ids(self) -> list[int]:
+        """Варианты, под которыми лежат шифротексты бюллетеня и строки итогов."""
+        return self.option_ids[:ballot_format.ciphertext_count(self.encoding, len(self.options))]
+
+    def encode(self, option_id: int) -> list[int] | None:
+        """Открытые тексты бюллетеня за option_id; None — такого варианта нет."""
+        ids = self.option_ids
+        if option_id not in ids:
+            return None
+        return ballot_format.encode_choice(self.encoding, self.slot_bits, len(ids), ids.index(option_id))
+
+    def decode(self, values: list[int]) -> list[int]:
+        """Расшифрованный бюллетень или итоги → счётчики по вариантам."""
+        return ballot_format.decode_counts(self.encoding, self.slot_bits, len(self.options), values)
+
+    def max_plaintext(self, per_option: int) -> int:
+        return ballot_format.max_plaintext(self.encoding, self.slot_bits, len(self.options), per_option)
+
+    @property
+    def is_closed(self) -> bool:
+        return datetime.datetime.now(datetime.timezone.utc) >= self.end_date
+
+
+class PollContext(NamedTuple):
+    meta: PollMeta
+    vote: tuple | None  # (ballot, ciphertexts, sig_format, signature)
+    rsa_public_key: bytes | None  # DER публичного ключа пользователя
+
+
+_meta: OrderedDict[int, PollMeta] = OrderedDict()
+
+
+def _remember(meta: PollMeta):
+    _meta[meta.poll_id] = meta
+    _meta.move_to_end(meta.poll_id)
+    while len(_meta) > POLL_META_CACHE_SIZE:
+        _meta.popitem(last=False)
+
+
+async def load(conn, poll_id: int, user_id: int | None = None) -> PollContext | None:
+    """Контекст опроса для пользователя (user_id=None — без бюллетеня); None, если опроса нет."""
+    meta = _meta.get(poll_id)
+    if meta is not None:
+        row = await conn.fetchrow(
+            """
+            SELECT v.ballot, v.ciphertexts, v.sig_format, v.signature,
+                   (SELECT rsa_public_key FROM "user" WHERE id = $2) AS rsa_public_key
+            FROM poll p
+            LEFT JOIN vote v ON v.poll_id = p.id AND v.user_id = $2
+            WHERE p.id = $1
+            """,
+            poll_id,
+            user_id,
+        )
+        if row is None:
+            invalidate(poll_id)
+            return None
+        _meta.move_to_end(poll_id)
+    else:
+        row = await conn.fetchrow(
+            """
+            SELECT p.title, p.public_key_n, p.end_date, p.encoding, p.slot_bits, p.crypto_profile,
+                   ARRAY(SELECT id FROM poll_options WHERE poll_id = p.id ORDER BY id) AS option_ids,
+                   ARRAY(SELECT option_text FROM poll_options WHERE poll_id = p.id ORDER BY id) AS option_texts,
+                   v.ballot, v.ciphertexts, v.sig_format, v.signature,
+                   (SELECT rsa_public_key FROM "user" WHERE id = $2) AS rsa_public_key
+            FROM poll p
+            LEFT JOIN vote v ON v.poll_id = p.id AND v.user_id = $2
+            WHERE p.id = $1
+            """,
+            poll_id,
+            user_id,
+        )
+        if row is None:
+            return None
+        meta = PollMeta(
+            poll_id=poll_id,
+            title=row["title"],
+            public_key=paillier.PaillierPublicKey(n=int(row["public_key_n"])),
+            end_date=row["end_date"],
+            options=tuple(zip(row["option_ids"], row["option_texts"])),
+            encoding=row["encoding"],
+            slot_bits=row["slot_bits"],
+            profile=crypto_profiles.get(row["crypto_profile"]),
+        )
+        _remember(meta)
+
+    # Бюллетень в бинарном виде (ballot) или ещё не перенесённый из JSON
+    # (ciphertexts, см. ballot_format.py migrate) — read_ciphertexts и
+    # signed_hash понимают оба
+    vote = None
+    if row["ballot"] is not None or row["ciphertexts"] is not None:
+        vote = (row["ballot"], row["ciphertexts"], row["sig_format"], row["signature"])
+    return PollContext(meta, vote, row["rsa_public_key"])
+
+
+def invalidate(poll_id: int):
+    _meta.pop(poll_id, None)
@@ -0,0 +1,87 @@
+# poll_index.py
+"""
+Список опросов для главной страницы.
+
+Постраничная выдача по ключу (id < before, ORDER BY id DESC) вместо
+полного списка; открыт опрос или завершён, определяется в SQL. Страницы
+кэшируются в памяти процесса на POLL_INDEX_TTL секунд (но не дольше
+ближайшего end_date на странице). create_poll_post и delete_poll
+сбрасывают кэш (invalidate); другие воркеры увидят изменения не позже TTL.
+
+Переменные окружения:
+    POLL_INDEX_PAGE_SIZE — опросов на странице (по умолчанию 20)
+    POLL_INDEX_TTL       — время жизни страницы в кэше, с (по умолчанию 5)
+"""
+import datetime
+import os
+import time
+from typing import NamedTuple
+
+PAGE_SIZE = int(os.getenv("POLL_INDEX_PAGE_SIZE", "20"))
+POLL_INDEX_TTL = float(os.getenv("POLL_INDEX_TTL", "5"))
+
+# Фильтр по состоянию → условие WHERE
+STATUSES = {
+    "all": "TRUE",
+    "open": "end_date > now()",
+    "closed": "end_date <= now()",
+}
+
+
+class Page(NamedTuple):
+    polls: list              # записи (id, title, end_date, is_closed)
+    next_before: int | None  # курсор следующей страницы
+
+
+# Предел числа страниц в кэше (before приходит из запроса)
+_MAX_PAGES = 256
+
+# (status, before) → (момент устаревания по time.monotonic, страница)
+_pages: dict[tuple[str, int | None], tuple[float, Page]] = {}
+
+
+async def _fetch(conn, status: str, before: int | None) -> Page:
+    rows = await conn.fetch(
+        f"""
+        SELECT id, title, end_date, end_date <= now() AS is_closed
+        FROM poll
+        WHERE {STATUSES[status]} AND ($1::int IS NULL OR id < $1)
+        ORDER BY id DESC
+        LIMIT $2
+        """,
+        before,
+        PAGE_SIZE + 1,
+    )
+    if len(rows) > PAGE_SIZE:
+        return Page(rows[:PAGE_SIZE], rows[PAGE_SIZE - 1]["id"])
+    return Page(rows, None)
+
+
+def _expires(page: Page) -> float:
+    """Страница устаревает по TTL или когда закрывается один из её опросов."""
+    ttl = POLL_INDEX_TTL
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for poll in page.polls:
+        if not poll["is_closed"]:
+            ttl = min(ttl, (poll["end_date"] - now).total_seconds())
+    return time.monotonic() + max(ttl, 0.0)
+
+
+async def get_page(conn, status: str = "all", before: int | None = None) -> Page:
+    """Страница списка опросов (новые сверху)."""
+    if status not in STATUSES:
+        status = "all"
+    key = (status, before)
+    entry = _pages.get(key)
+    if entry is not None and time.monotonic() < entry[0]:
+        return entry[1]
+    page = await _fetch(conn, status, before)
+    if len(_pages) >= _MAX_PAGES:
+        _pages.clear()
+    _pages[key] = (_expires(page), page)
+    return page
+
+
+def invalidate():
+    """Сбрасывает кэш страниц (опрос создан или удалён)."""
+    _pages.clear()
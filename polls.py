@@ -0,0 +1,192 @@
+# polls.py
+"""
+Создание опросов: одиночное (форма администратора) и пакетное (загрузка
+JSON или CSV).
+
+Ключи Paillier берутся из запаса профиля опроса (key_pool.paillier_pools,
+см. crypto_profiles; по умолчанию CRYPTO_PROFILE); при пакетной
+загрузке недостающие генерируются параллельно в пуле криптоопераций (не
+больше crypto.workers одновременно). Каждый опрос записывается одной
+транзакцией: опрос, варианты (executemany), нулевые итоги.
+
+Упакованный бюллетень (один шифротекст вместо шифротекста на вариант, см.
+ballot_format.ENCODING_PACKED) включается для опроса флагом packed.
+
+Форматы пакетной загрузки:
+    JSON — [{"title": ..., "end_date": "2025-06-01T18:00", "options": [...],
+             "packed": false, "profile": "standard"}, ...]
+    CSV  — строка на опрос: title,end_date,вариант 1,вариант 2,...
+           (первая строка — заголовок)
+
+Переменные окружения:
+    BULK_POLL_LIMIT — наибольшее число опросов в одной загрузке (по умолчанию 500)
+"""
+import asyncio
+import csv
+import datetime
+import io
+import json
+import os
+from typing import NamedTuple
+
+import crypto_profiles
+import tally
+from ballot_format import ENCODING_PACKED, ENCODING_VECTOR, SLOT_BITS, packed_fits
+from crypto_executor import crypto
+from encryption import serialize_private_key
+from key_cache import private_keys
+from key_pool import paillier_pools
+
+BULK_POLL_LIMIT = int(os.getenv("BULK_POLL_LIMIT", "500"))
+
+
+class PollSpecError(ValueError):
+    """Ошибка в описании опроса; сообщение показывается администратору."""
+
+
+class PollSpec(NamedTuple):
+    title: str
+    end_date: datetime.datetime
+    options: list[str]
+    packed: bool = False
+    profile: str = crypto_profiles.DEFAULT_PROFILE.name
+
+
+def parse_end_date(value: str) -> datetime.datetime:
+    """ISO-дата окончания; без зоны — местное время сервера."""
+    try:
+        end_date = datetime.datetime.fromisoformat(value.strip())
+    except (ValueError, AttributeError):
+        raise PollSpecError(f"неверная дата окончания: {value!r}")
+    if end_date.tzinfo is None:
+        end_date = end_date.astimezone()
+    return end_date
+
+
+def make_spec(title, end_date, options, packed=False, profile=None) -> PollSpec:
+    """Проверяет описание одного опроса."""
+    if not isinstance(title, str) or not title.strip():
+        raise PollSpecError("пустое название")
+    if not isinstance(options, list) or not all(isinstance(o, str) for o in options):
+        raise PollSpecError("варианты должны быть списком строк")
+    options = [o.strip() for o in options if o.strip()]
+    if len(options) < 2:
+        raise PollSpecError("как минимум два варианта")
+    if not isinstance(packed, bool):
+        raise PollSpecError("packed должен быть true или false")
+    if profile is None:
+        profile = crypto_profiles.DEFAULT_PROFILE.name
+    if profile not in crypto_profiles.PROFILES:
+        raise PollSpecError(
+            f"неизвестный профиль {profile!r} (есть: {', '.join(crypto_profiles.PROFILES)})"
+        )
+    return PollSpec(title.strip(), parse_end_date(end_date), options, packed, profile)
+
+
+def parse_bulk(data: bytes, filename: str = "") -> list[PollSpec]:
+    """Разбирает загрузку (JSON или CSV по расширению/содержимому)."""
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise PollSpecError("файл должен быть в UTF-8")
+
+    if filename.lower().endswith(".json") or text.lstrip().startswith("["):
+        try:
+            items = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise PollSpecError(f"неверный JSON: {e}")
+        if not isinstance(items, list):
+            raise PollSpecError("ожидается список опросов")
+        rows = [
+            (item.get("title"), item.get("end_date"), item.get("options"), item.get("packed", False),
+             item.get("profile"))
+            if isinstance(item, dict) else (None, None, None)
+            for item in items
+        ]
+        first = 1
+    else:
+        reader = csv.reader(io.StringIO(text))
+        next(reader, None)  # заголовок
+        rows = [(r[0], r[1], r[2:]) if len(r) >= 2 else (None, None, None)
+                for r in reader if any(cell.strip() for cell in r)]
+        first = 2
+
+    if not rows:
+        raise PollSpecError("нет ни одного опроса")
+    if len(rows) > BULK_POLL_LIMIT:
+        raise PollSpecError(f"не больше {BULK_POLL_LIMIT} опросов за раз")
+
+    specs = []
+    for number, row in enumerate(rows, first):
+        try:
+            specs.append(make_spec(*row))
+        except PollSpecError as e:
+            raise PollSpecError(f"запись {number}: {e}")
+    return specs
+
+
+def check_key(spec: PollSpec, public_key):
+    """Ключ должен соответствовать профилю, а упакованный бюллетень — поместиться в открытый текст."""
+    if public_key.n.bit_length() != crypto_profiles.get(spec.profile).paillier_bits:
+        raise ValueError(f"ключ Paillier не соответствует профилю {spec.profile}")
+    if spec.packed and not packed_fits(public_key.n, len(spec.options)):
+        raise PollSpecError(
+            f"«{spec.title}»: слишком много вариантов для упакованного бюллетеня ({len(spec.options)})"
+        )
+
+
+async def create_poll(conn, spec: PollSpec, keypair) -> int:
+    """Записывает опрос одной транзакцией и возвращает его id."""
+    public_key, private_key = keypair
+    check_key(spec, public_key)
+    priv_path = None
+    try:
+        async with conn.transaction():
+            poll_id = await conn.fetchval(
+                """
+                INSERT INTO poll (title, end_date, public_key_n, public_key_g, encoding, slot_bits,
+                                  crypto_profile)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+                RETURNING id
+                """,
+                spec.title,
+                spec.end_date,
+                public_key.n,
+                public_key.g,
+                ENCODING_PACKED if spec.packed else ENCODING_VECTOR,
+                SLOT_BITS,
+                spec.profile,
+            )
+            await conn.executemany(
+                "INSERT INTO poll_options (poll_id, option_text) VALUES ($1, $2)",
+                [(poll_id, opt) for opt in spec.options],
+            )
+            await tally.init_tally(conn, poll_id)
+
+            # Приватный ключ — в защищённый каталог (не в БД!) до фиксации,
+            # чтобы у сохранённого опроса всегда был ключ
+            priv_path = private_keys.path(poll_id)
+            os.makedirs(os.path.dirname(priv_path), exist_ok=True)
+            fd = os.open(priv_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(serialize_private_key(private_key))
+    except BaseException:
+        # Опрос не сохранён — ключ не нужен
+        if priv_path is not None and os.path.exists(priv_path):
+            os.remove(priv_path)
+        raise
+    return poll_id
+
+
+async def create_polls(conn, specs: list[PollSpec]) -> list[int]:
+    """Пакетное создание: ключи параллельно, опросы по одному в транзакции."""
+    limit = asyncio.Semaphore(crypto.workers)
+
+    async def keypair(spec):
+        async with limit:
+            return await paillier_pools[spec.profile].take()
+
+    keypairs = await asyncio.gather(*[keypair(spec) for spec in specs])
+    for spec, (public_key, _) in zip(specs, keypairs):
+        check_key(spec, public_key)  # до записи первого опроса
+    return [await create_poll(conn, spec, kp) for spec, kp in zip(specs, keypairs)]
@@ -0,0 +1,124 @@
+# result_cache.py
+"""
+Кэш итогов завершённых опросов.
+
+После end_date результат опроса не меняется, поэтому окончательный подсчёт
+(полная проверка подписей и расшифровка) выполняется один раз и хранится
+в таблице poll_result вместе с числом учтённых бюллетеней и их дайджестом
+(tally.TallyResult.digest). Поверх таблицы — кэш в памяти процесса.
+
+Первый запрос после закрытия запускает подсчёт, остальные его ждут:
+внутри процесса — asyncio.Lock на опрос, между воркерами —
+pg_advisory_xact_lock. Сброс — invalidate (удаление опроса, пересчёт
+администратором). Другие воркеры увидят сброс не позже RESULT_CACHE_TTL.
+"""
+import asyncio
+import json
+import os
+import time
+
+# Пространство имён advisory-блокировок (первый ключ pg_advisory_xact_lock)
+_LOCK_NAMESPACE = 0x7265  # "re"
+
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "30"))
+
+# poll_id → (время загрузки, запись)
+_memory: dict[int, tuple[float, dict]] = {}
+# poll_id → [блокировка, сколько запросов её держат или ждут]; запись
+# удаляется, когда последний из них закончил, и при invalidate
+_locks: dict[int, list] = {}
+
+
+def _from_row(row) -> dict:
+    return {
+        "counts": {int(k): v for k, v in json.loads(row["counts"]).items()},
+        "ballot_count": row["ballot_count"],
+        "ballots_digest": row["ballots_digest"],
+    }
+
+
+def _cached(poll_id: int) -> dict | None:
+    entry = _memory.get(poll_id)
+    if entry is not None and time.monotonic() - entry[0] < RESULT_CACHE_TTL:
+        return entry[1]
+    return None
+
+
+async def _load(conn, poll_id: int) -> dict | None:
+    row = await conn.fetchrow(
+        "SELECT counts, ballot_count, ballots_digest FROM poll_result WHERE poll_id=$1",
+        poll_id,
+    )
+    if row is None:
+        return None
+    result = _from_row(row)
+    _memory[poll_id] = (time.monotonic(), result)
+    return result
+
+
+async def peek(conn, poll_id: int) -> dict | None:
+    """Сохранённые итоги без пересчёта (подходит соединение реплики)."""
+    return _cached(poll_id) or await _load(conn, poll_id)
+
+
+async def get_or_compute(conn, poll_id: int, compute) -> dict:
+    """
+    Итоги завершённого опроса: {"counts": {option_id: голосов},
+    "ballot_count": ..., "ballots_digest": hex}. При промахе вызывает
+    await compute() → такой же словарь, ровно один раз на все воркеры.
+    """
+    result = _cached(poll_id)
+    if result is not None:
+        return result
+
+    entry = _locks.setdefault(poll_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            return await _compute_once(conn, poll_id, compute)
+    finally:
+        entry[1] -= 1
+        if not entry[1] and _locks.get(poll_id) is entry:
+            del _locks[poll_id]
+
+
+async def _compute_once(conn, poll_id: int, compute) -> dict:
+    result = _cached(poll_id) or await _load(conn, poll_id)
+    if result is not None:
+        return result
+
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1, $2)", _LOCK_NAMESPACE, poll_id)
+        # Пока ждали блокировку, другой воркер мог уже посчитать
+        result = await _load(conn, poll_id)
+        if result is not None:
+            return result
+
+        result = await compute()
+        await store(conn, poll_id, result)
+    return result
+
+
+async def store(conn, poll_id: int, result: dict):
+    """Сохраняет итоги, посчитанные вне get_or_compute (например, слиянием шардов)."""
+    await conn.execute(
+        """
+        INSERT INTO poll_result (poll_id, counts, ballot_count, ballots_digest)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (poll_id) DO UPDATE
+        SET counts=EXCLUDED.counts, ballot_count=EXCLUDED.ballot_count,
+            ballots_digest=EXCLUDED.ballots_digest, computed_at=now()
+        """,
+        poll_id,
+        json.dumps(result["counts"]),
+        result["ballot_count"],
+        result["ballots_digest"],
+    )
+    _memory[poll_id] = (time.monotonic(), result)
+
+
+async def invalidate(conn, poll_id: int):
+    """Сбрасывает сохранённые итоги опроса."""
+    _memory.pop(poll_id, None)
+    _locks.pop(poll_id, None)
+    await conn.execute("DELETE FROM poll_result WHERE poll_id=$1", poll_id)
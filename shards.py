@@ -0,0 +1,315 @@
+# shards.py
+"""
+Шардированный подсчёт итогов с переносимыми частичными итогами.
+
+Бюллетени опроса делятся на N шардов по user_id (user_id mod N; то же
+деление подходит для vote, секционированной по хешу user_id). Каждый шард
+считается независимо — отдельным процессом или на другой машине с
+доступом к базе — тем же tally.aggregate с проверкой подписей. Результат
+шарда — частичный итог в JSON:
+
+    {"format": 1, "poll_id": ..., "public_key_n": "...", "option_ids": [...],
+     "shard_count": N,
+     "shards": {"3": {"counted": ..., "rejected": ..., "digest": "hex"}},
+     "products": ["hex", ...], "counted": ..., "rejected": ..., "digest": "hex"}
+
+option_ids — строки poll_tally (у упакованного опроса одна). Частичные
+итоги сливаются попарно (дерево): произведения перемножаются по модулю
+n², счётчики и дайджесты складываются, а перечень shards объединяется.
+Слияние отказывает, если шард встречается дважды или частичные итоги от
+разных опросов; итог, в котором не хватает шардов, нельзя сохранить.
+Сохранение (store, только для завершённого опроса) сверяет число
+бюллетеней с таблицей vote, записывает зашифрованные итоги в poll_tally
+и — если есть приватный ключ опроса — расшифрованные в poll_result,
+откуда их берёт poll_results.
+
+    python shards.py compute <poll_id> [--shards N] [--only 0,1,...] [--out DIR]
+    python shards.py merge FILE... [--store]
+
+Переменные окружения:
+    TALLY_SHARDS — число шардов по умолчанию (16)
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from typing import NamedTuple
+
+import asyncpg
+from phe import paillier
+
+import crypto_profiles
+import result_cache
+import tally
+from ballot_format import ciphertext_count, decode_counts, max_plaintext
+from config import DB_CONFIG
+from crypto_executor import crypto
+from key_cache import private_keys
+
+logger = logging.getLogger(__name__)
+
+TALLY_SHARDS = int(os.getenv("TALLY_SHARDS", "16"))
+
+PARTIAL_FORMAT = 1
+
+
+class ShardError(Exception):
+    """Частичные итоги не сливаются: чужой опрос, повтор или нехватка шардов."""
+
+
+class ShardInfo(NamedTuple):
+    counted: int
+    rejected: int
+    digest: int
+
+
+class Partial(NamedTuple):
+    """Частичный итог по набору шардов опроса."""
+    poll_id: int
+    n: int
+    option_ids: tuple[int, ...]
+    shard_count: int
+    shards: dict[int, ShardInfo]
+    result: tally.TallyResult
+
+    @property
+    def missing(self) -> list[int]:
+        return [i for i in range(self.shard_count) if i not in self.shards]
+
+
+# --- Подсчёт шарда ---
+async def _poll_params(conn, poll_id: int) -> tuple[int, list[int], int, int, list[int], int]:
+    poll = await conn.fetchrow(
+        "SELECT public_key_n, encoding, slot_bits, crypto_profile FROM poll WHERE id=$1", poll_id,
+    )
+    if not poll:
+        raise LookupError(f"Опрос {poll_id} не найден")
+    option_ids = [r["id"] for r in await conn.fetch(
+        "SELECT id FROM poll_options WHERE poll_id=$1 ORDER BY id", poll_id,
+    )]
+    tally_ids = option_ids[:ciphertext_count(poll["encoding"], len(option_ids))]
+    min_bits = crypto_profiles.get(poll["crypto_profile"]).rsa_bits
+    return int(poll["public_key_n"]), tally_ids, poll["encoding"], poll["slot_bits"], option_ids, min_bits
+
+
+async def compute_shard(conn, poll_id: int, shard: int, shard_count: int) -> Partial:
+    """Проверяет и суммирует бюллетени одного шарда (user_id mod shard_count = shard)."""
+    if not 0 <= shard < shard_count:
+        raise ValueError(f"шард {shard} вне 0..{shard_count - 1}")
+    n, tally_ids, _, _, _, min_bits = await _poll_params(conn, poll_id)
+    async with conn.transaction(readonly=True):
+        total = await conn.fetchval(
+            "SELECT count(*) FROM vote WHERE poll_id=$1 AND user_id % $2 = $3",
+            poll_id, shard_count, shard,
+        )
+        cursor = conn.cursor(
+            'SELECT v.user_id, v.ballot, v.ciphertexts, v.sig_format, v.signature, u.rsa_public_key '
+            'FROM vote v JOIN "user" u ON u.id = v.user_id '
+            'WHERE v.poll_id=$1 AND v.user_id % $2 = $3',
+            poll_id, shard_count, shard,
+            prefetch=tally.chunk_size(n, len(tally_ids), total),
+        )
+        result = await tally.aggregate(poll_id, n, len(tally_ids), cursor, total, min_bits=min_bits)
+    info = ShardInfo(result.counted, result.rejected, result.digest)
+    return Partial(poll_id, n, tuple(tally_ids), shard_count, {shard: info}, result)
+
+
+# --- Слияние ---
+def merge(a: Partial, b: Partial) -> Partial:
+    """Сливает частичные итоги непересекающихся наборов шардов одного опроса."""
+    if (a.poll_id, a.n, a.option_ids, a.shard_count) != (b.poll_id, b.n, b.option_ids, b.shard_count):
+        raise ShardError("частичные итоги разных опросов или разного деления на шарды")
+    duplicated = sorted(a.shards.keys() & b.shards.keys())
+    if duplicated:
+        raise ShardError(f"шарды посчитаны дважды: {duplicated}")
+    return a._replace(
+        shards={**a.shards, **b.shards},
+        result=tally.merge(a.result, b.result, a.n * a.n),
+    )
+
+
+def tree_merge(partials: list[Partial]) -> Partial:
+    """
+    Попарное слияние уровнями (log₂ N уровней). Слияние — K умножений по
+    модулю n², так что узлы дерева могут быть и на разных машинах: итог
+    любого поддерева — такой же частичный итог.
+    """
+    if not partials:
+        raise ShardError("нет частичных итогов")
+    level = list(partials)
+    while len(level) > 1:
+        merged = [merge(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        level = merged + (level[-1:] if len(level) % 2 else [])
+    return level[0]
+
+
+# --- Переносимый формат ---
+def to_json(partial: Partial) -> dict:
+    return {
+        "format": PARTIAL_FORMAT,
+        "poll_id": partial.poll_id,
+        "public_key_n": str(partial.n),
+        "option_ids": list(partial.option_ids),
+        "shard_count": partial.shard_count,
+        "shards": {
+            str(i): {"counted": s.counted, "rejected": s.rejected, "digest": f"{s.digest:064x}"}
+            for i, s in sorted(partial.shards.items())
+        },
+        "products": [f"{p:x}" for p in partial.result.products],
+        "counted": partial.result.counted,
+        "rejected": partial.result.rejected,
+        "digest": f"{partial.result.digest:064x}",
+    }
+
+
+def from_json(data: dict) -> Partial:
+    """Разбирает частичный итог и сверяет его сводку с перечнем шардов."""
+    try:
+        if data["format"] != PARTIAL_FORMAT:
+            raise ShardError(f"неизвестный формат частичного итога: {data['format']}")
+        n = int(data["public_key_n"])
+        shards = {
+            int(i): ShardInfo(s["counted"], s["rejected"], int(s["digest"], 16))
+            for i, s in data["shards"].items()
+        }
+        partial = Partial(
+            data["poll_id"], n, tuple(data["option_ids"]), data["shard_count"], shards,
+            tally.TallyResult(
+                [int(p, 16) for p in data["products"]],
+                data["counted"], data["rejected"], int(data["digest"], 16),
+            ),
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise ShardError(f"повреждённый частичный итог: {e!r}")
+
+    result = partial.result
+    if (len(result.products) != len(partial.option_ids)
+            or any(not 0 < p < n * n for p in result.products)
+            or any(not 0 <= i < partial.shard_count for i in shards)):
+        raise ShardError("частичный итог не соответствует своему опросу")
+    if (sum(s.counted for s in shards.values()) != result.counted
+            or sum(s.rejected for s in shards.values()) != result.rejected
+            or sum(s.digest for s in shards.values()) % tally.DIGEST_MOD != result.digest):
+        raise ShardError("сводка частичного итога не сходится с перечнем шардов")
+    return partial
+
+
+# --- Сохранение итогов ---
+async def store(conn, partial: Partial) -> dict | None:
+    """
+    Записывает полный (все шарды) итог в poll_tally и, если доступен
+    приватный ключ опроса, расшифрованные итоги в poll_result.
+    """
+    if partial.missing:
+        raise ShardError(f"не хватает шардов: {partial.missing}")
+    if not await conn.fetchval("SELECT end_date <= now() FROM poll WHERE id=$1", partial.poll_id):
+        raise ShardError(f"опрос {partial.poll_id} не найден или ещё открыт")
+    n, tally_ids, encoding, slot_bits, option_ids, _ = await _poll_params(conn, partial.poll_id)
+    if n != partial.n or tuple(tally_ids) != partial.option_ids:
+        raise ShardError("частичные итоги посчитаны для другого ключа или набора вариантов")
+
+    result = partial.result
+    async with conn.transaction():
+        await tally.init_tally(conn, partial.poll_id)
+        await tally.lock_tally(conn, partial.poll_id)
+        total = await conn.fetchval("SELECT count(*) FROM vote WHERE poll_id=$1", partial.poll_id)
+        if total != result.counted + result.rejected:
+            raise ShardError(
+                f"в шардах {result.counted + result.rejected} бюллетеней, в таблице vote — {total}"
+            )
+        await tally.store_tally(conn, partial.poll_id, dict(zip(tally_ids, result.products)))
+
+    try:
+        values = await private_keys.decrypt_many(
+            partial.poll_id, paillier.PaillierPublicKey(n=n), result.products,
+            max_plaintext=max_plaintext(encoding, slot_bits, len(option_ids), tally.MAX_COUNT),
+        )
+    except FileNotFoundError:
+        logger.warning("Нет приватного ключа опроса %s — сохранены только зашифрованные итоги", partial.poll_id)
+        return None
+    final = {
+        "counts": dict(zip(option_ids, decode_counts(encoding, slot_bits, len(option_ids), values))),
+        "ballot_count": result.counted,
+        "ballots_digest": f"{result.digest:064x}",
+    }
+    await result_cache.store(conn, partial.poll_id, final)
+    return final
+
+
+# --- CLI ---
+async def _compute_cli(poll_id: int, shard_count: int, only: list[int] | None, out_dir: str):
+    shards = only if only is not None else list(range(shard_count))
+    os.makedirs(out_dir, exist_ok=True)
+    # Шарды считаются параллельно, у каждого своё соединение (курсор)
+    limit = asyncio.Semaphore(max(1, crypto.workers // 2))
+
+    async def one(shard: int):
+        async with limit:
+            conn = await asyncpg.connect(**DB_CONFIG)
+            try:
+                partial = await compute_shard(conn, poll_id, shard, shard_count)
+            finally:
+                await conn.close()
+        path = os.path.join(out_dir, f"poll_{poll_id}_shard_{shard}_of_{shard_count}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(to_json(partial), f)
+        logger.info(
+            "Шард %s/%s опроса %s: учтено %s, отклонено %s → %s",
+            shard, shard_count, poll_id, partial.result.counted, partial.result.rejected, path,
+        )
+
+    try:
+        await asyncio.gather(*[one(shard) for shard in shards])
+    finally:
+        crypto.shutdown()
+
+
+async def _merge_cli(paths: list[str], store_result: bool):
+    partials = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            partials.append(from_json(json.load(f)))
+    try:
+        merged = tree_merge(partials)
+        summary = {k: v for k, v in to_json(merged).items() if k not in ("products", "shards")}
+        summary["missing_shards"] = merged.missing
+        if store_result:
+            conn = await asyncpg.connect(**DB_CONFIG)
+            try:
+                final = await store(conn, merged)
+            finally:
+                await conn.close()
+            if final is not None:
+                summary["counts"] = final["counts"]
+        print(json.dumps(summary, indent=2, ensure_ascii=False))
+    finally:
+        crypto.shutdown()
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    compute_parser = commands.add_parser("compute", help="посчитать шарды опроса")
+    compute_parser.add_argument("poll_id", type=int)
+    compute_parser.add_argument("--shards", type=int, default=TALLY_SHARDS)
+    compute_parser.add_argument("--only", type=_int_list, help="только эти шарды (для других машин — остальные)")
+    compute_parser.add_argument("--out", default=".")
+    merge_parser = commands.add_parser("merge", help="слить частичные итоги")
+    merge_parser.add_argument("paths", nargs="+")
+    merge_parser.add_argument("--store", action="store_true", help="записать итоги опроса в базу")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "compute":
+            asyncio.run(_compute_cli(args.poll_id, args.shards, args.only, args.out))
+        else:
+            asyncio.run(_merge_cli(args.paths, args.store))
+    except (ShardError, LookupError) as e:
+        sys.exit(f"❌ {e}")
@@ -0,0 +1,46 @@
+# startup.py
+"""
+Время запуска воркера: импорт приложения и lifespan до готовности.
+
+main.py импортирует этот модуль первым, так что отсчёт идёт с начала
+импорта приложения. С gunicorn --preload импорт выполняется один раз в
+мастере до fork, и воркеру остаётся только lifespan — это видно по
+признаку preloaded в отчёте. Каждый воркер пишет строку в лог и отдаёт
+длительности в /metrics (worker_startup_seconds).
+"""
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+_started = time.perf_counter()
+_import_pid = os.getpid()
+
+timings: dict[str, float] = {}  # этап → секунды
+
+
+def imported():
+    """Приложение собрано (вызывается в конце main.create_app)."""
+    timings.setdefault("import", time.perf_counter() - _started)
+
+
+def ready(lifespan_started: float):
+    """Lifespan отработал: воркер принимает запросы."""
+    timings["lifespan"] = time.perf_counter() - lifespan_started
+    preloaded = os.getpid() != _import_pid
+    logger.info(
+        "Воркер %s готов: импорт %.0f мс%s, запуск %.0f мс",
+        os.getpid(),
+        timings.get("import", 0.0) * 1e3,
+        " (в мастере, --preload)" if preloaded else "",
+        timings["lifespan"] * 1e3,
+    )
+
+
+def report() -> dict:
+    return {
+        "pid": os.getpid(),
+        "preloaded": os.getpid() != _import_pid,
+        **{f"{phase}_ms": seconds * 1e3 for phase, seconds in timings.items()},
+    }
@@ -0,0 +1,115 @@
+// ballot.js — шифрование и подпись бюллетеня в браузере (см. client_ballots.py).
+// Приватный RSA-ключ не покидает страницу: на сервер уходят шифротексты
+// Paillier и подпись сообщения "poll:{id};user:{uid};choices:{c1},{c2},...".
+(function (global) {
+    "use strict";
+
+    function modPow(base, exp, mod) {
+        let result = 1n;
+        base %= mod;
+        while (exp > 0n) {
+            if (exp & 1n) result = result * base % mod;
+            base = base * base % mod;
+            exp >>= 1n;
+        }
+        return result;
+    }
+
+    function gcd(a, b) {
+        while (b) [a, b] = [b, a % b];
+        return a;
+    }
+
+    function bytesToBigInt(bytes) {
+        let hex = "";
+        for (const b of bytes) hex += b.toString(16).padStart(2, "0");
+        return BigInt("0x" + (hex || "0"));
+    }
+
+    // Случайное r из [1, n) и взаимно простое с n
+    function randomBelow(n) {
+        const len = Math.ceil(n.toString(16).length / 2) + 8;
+        for (;;) {
+            const r = bytesToBigInt(global.crypto.getRandomValues(new Uint8Array(len))) % n;
+            if (r > 0n && gcd(r, n) === 1n) return r;
+        }
+    }
+
+    // Paillier с g = n + 1: c = (1 + n·m) · r^n mod n²
+    function encrypt(n, m) {
+        const nsquare = n * n;
+        const nude = (1n + n * BigInt(m)) % nsquare;
+        return nude * modPow(randomBelow(n), n, nsquare) % nsquare;
+    }
+
+    // --- DER: PKCS#1 RSAPrivateKey → PKCS#8 PrivateKeyInfo (для WebCrypto) ---
+    function derLength(len) {
+        if (len < 0x80) return [len];
+        const out = [];
+        while (len > 0) {
+            out.unshift(len & 0xff);
+            len >>= 8;
+        }
+        return [0x80 | out.length, ...out];
+    }
+
+    function derWrap(tag, body) {
+        return [tag, ...derLength(body.length), ...body];
+    }
+
+    function pemToPkcs8(pem) {
+        const isPkcs1 = pem.includes("BEGIN RSA PRIVATE KEY");
+        const b64 = pem.replace(/-----[^-]+-----|\s/g, "");
+        const der = Array.from(atob(b64), function (ch) { return ch.charCodeAt(0); });
+        if (!isPkcs1) return new Uint8Array(der);
+        // AlgorithmIdentifier { rsaEncryption, NULL }
+        const algorithm = [0x30, 0x0d, 0x06, 0x09, 0x2a, 0x86, 0x48, 0x86, 0xf7, 0x0d, 0x01, 0x01, 0x01, 0x05, 0x00];
+        const version = [0x02, 0x01, 0x00];
+        return new Uint8Array(derWrap(0x30, [...version, ...algorithm, ...derWrap(0x04, der)]));
+    }
+
+    async function sign(pem, message) {
+        const key = await global.crypto.subtle.importKey(
+            "pkcs8", pemToPkcs8(pem),
+            {name: "RSASSA-PKCS1-v1_5", hash: "SHA-256"},
+            false, ["sign"]
+        );
+        const sig = new Uint8Array(await global.crypto.subtle.sign(
+            "RSASSA-PKCS1-v1_5", key, new TextEncoder().encode(message)
+        ));
+        return Array.from(sig, function (b) { return b.toString(16).padStart(2, "0"); }).join("");
+    }
+
+    // Открытые тексты: вектор 0/1 или один упакованный B^index (encoding 2)
+    function plaintexts(params, optionId) {
+        const index = params.options.indexOf(optionId);
+        if (params.encoding === 2) {
+            return [1n << BigInt(index * params.slot_bits)];
+        }
+        return params.options.map(function (id) { return id === optionId ? 1n : 0n; });
+    }
+
+    // Полный бюллетень: {ciphertexts: [десятичные строки], signature: hex}
+    async function makeBallot(params, userId, optionId, pem) {
+        const n = BigInt(params.public_key_n);
+        const ciphertexts = plaintexts(params, optionId).map(function (m) {
+            return encrypt(n, m).toString();
+        });
+        const message = "poll:" + params.poll_id + ";user:" + userId + ";choices:" + ciphertexts.join(",");
+        return {ciphertexts: ciphertexts, signature: await sign(pem, message)};
+    }
+
+    async function submitBallot(pollId, userId, optionId, pem) {
+        const paramsResp = await fetch("/api/poll/" + pollId + "/params");
+        if (!paramsResp.ok) throw new Error((await paramsResp.json()).error);
+        const ballot = await makeBallot(await paramsResp.json(), userId, optionId, pem);
+        const resp = await fetch("/api/poll/" + pollId + "/ballot", {
+            method: "POST",
+            headers: {"Content-Type": "application/json"},
+            body: JSON.stringify(ballot),
+        });
+        if (!resp.ok) throw new Error((await resp.json()).error);
+    }
+
+    global.Ballot = {encrypt: encrypt, sign: sign, makeBallot: makeBallot, submitBallot: submitBallot};
+})(typeof window !== "undefined" ? window : globalThis);
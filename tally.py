@@ -0,0 +1,364 @@
+# tally.py
+"""
+Зашифрованные промежуточные итоги голосования (таблица poll_tally).
+
+Для каждого варианта хранится произведение шифротекстов всех учтённых
+бюллетеней по модулю n². Итог обновляется при каждой записи голоса,
+поэтому странице результатов достаточно одной расшифровки на вариант.
+У упакованного опроса (ballot_format.ENCODING_PACKED) строка итогов одна —
+под первым вариантом, и расшифровка тоже одна.
+
+Пересчёт с нуля (для аудита или старых опросов) выполняется пулом
+криптоопераций (crypto_executor, число процессов — CRYPTO_WORKERS):
+бюллетени читаются серверным курсором и делятся на пачки, каждый процесс
+проверяет подписи и перемножает шифротексты своей пачки, частичные
+произведения сразу перемножаются в event loop. Память не растёт с
+размером опроса.
+    python tally.py rebuild [poll_id ...]
+
+Переменные окружения:
+    TALLY_CHUNK_SIZE  — размер пачки бюллетеней (по умолчанию подбирается
+                        по размеру шифротекста, см. chunk_size)
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import sys
+import time
+from typing import NamedTuple
+
+import asyncpg
+
+import crypto_profiles
+import metrics
+import result_cache
+from config import DB_CONFIG
+from ballot_format import ENCODING_PACKED, ciphertext_width, int_to_bytes, pack_ciphertexts, signed_hash
+from crypto_executor import crypto
+from encryption import verify_hash
+from key_cache import public_keys
+
+logger = logging.getLogger(__name__)
+
+# Тривиальное шифрование нуля: g^0 · 1^n mod n² = 1
+IDENTITY = 1
+
+# Верхняя граница итога по варианту: user.id — INTEGER, а голосов в опросе
+# не больше, чем пользователей. Это много меньше p, что позволяет
+# расшифровывать итоги по половине CRT (key_cache.PrivateKeyRegistry).
+MAX_COUNT = 2 ** 31
+
+# Дайджест набора бюллетеней — сумма SHA-256 каждого учтённого бюллетеня
+# по модулю 2^256. Не зависит от порядка и разбиения на пачки, а повтор
+# бюллетеня меняет сумму (в отличие от XOR).
+DIGEST_MOD = 2 ** 256
+
+
+class TallyResult(NamedTuple):
+    """Итог подсчёта набора бюллетеней."""
+    products: list[int]  # произведения шифротекстов по вариантам (mod n²)
+    counted: int
+    rejected: int
+    digest: int  # сумма SHA-256 учтённых бюллетеней mod 2^256
+
+
+def ballot_digest(user_id: int, ballot: bytes, signature: str) -> int:
+    """SHA-256 учтённого бюллетеня (в бинарной записи) как число."""
+    h = hashlib.sha256(user_id.to_bytes(4, "big") + ballot + bytes.fromhex(signature))
+    return int.from_bytes(h.digest(), "big")
+
+
+TALLY_CHUNK_SIZE = int(os.getenv("TALLY_CHUNK_SIZE") or 0)
+
+# Объём данных одной пачки, передаваемой в процесс; размер пачки в
+# бюллетенях выводится из ciphertext_width(n) (см. chunk_size). Шифротекст
+# (mod n²) занимает 768 байт при модуле 3072 бит (профиль standard) и
+# 1024 байта при 4096 (high), так что 1 МиБ — это ~120 и ~90 бюллетеней
+# по 10 вариантов: десятки миллисекунд работы на пачку (в основном
+# проверка подписей), и накладные расходы на pickle/IPC остаются в
+# пределах нескольких процентов.
+_CHUNK_BYTES = 1 << 20
+_MIN_CHUNK, _MAX_CHUNK = 16, 4096
+
+# Пачек в работе одновременно: по две на процесс, чтобы процессы не ждали
+# чтения из курсора, а память оставалась ограниченной
+MAX_INFLIGHT = 2 * crypto.workers
+
+
+def chunk_size(n: int, option_count: int, ballots: int) -> int:
+    """Размер пачки бюллетеней для модуля n и числа вариантов."""
+    if TALLY_CHUNK_SIZE:
+        return TALLY_CHUNK_SIZE
+    ballot_bytes = option_count * ciphertext_width(n) + 1024  # + подпись и ключ
+    size = max(_MIN_CHUNK, min(_MAX_CHUNK, _CHUNK_BYTES // ballot_bytes))
+    # Минимум ~4 пачки на процесс, чтобы процессы не простаивали в хвосте
+    per_worker = -(-ballots // (4 * crypto.workers))
+    return max(1, min(size, per_worker))
+
+
+async def init_tally(conn, poll_id: int):
+    """
+    Создаёт нулевые итоги опроса (если их ещё нет): по строке на вариант,
+    а у упакованного опроса — одну строку под первым вариантом.
+    """
+    await conn.execute(
+        """
+        INSERT INTO poll_tally (poll_id, option_id, ciphertext)
+        SELECT o.poll_id, o.id, $2
+        FROM poll_options o JOIN poll p ON p.id = o.poll_id
+        WHERE o.poll_id = $1
+          AND (p.encoding <> $3
+               OR o.id = (SELECT min(id) FROM poll_options WHERE poll_id = $1))
+        ON CONFLICT (poll_id, option_id) DO NOTHING
+        """,
+        poll_id,
+        int_to_bytes(IDENTITY),
+        ENCODING_PACKED,
+    )
+
+
+async def lock_tally(conn, poll_id: int) -> dict[int, int]:
+    """
+    Блокирует строки итогов опроса до конца транзакции и возвращает
+    {option_id: шифротекст}. Пустой словарь — итоги ещё не построены.
+    """
+    rows = await conn.fetch(
+        "SELECT option_id, ciphertext FROM poll_tally WHERE poll_id=$1 FOR UPDATE",
+        poll_id,
+    )
+    return {row["option_id"]: int.from_bytes(row["ciphertext"], "big") for row in rows}
+
+
+async def store_tally(conn, poll_id: int, totals: dict[int, int]):
+    """Сохраняет итоги опроса (строки должны быть заблокированы lock_tally)."""
+    await conn.executemany(
+        "UPDATE poll_tally SET ciphertext=$3 WHERE poll_id=$1 AND option_id=$2",
+        [(poll_id, opt_id, int_to_bytes(c)) for opt_id, c in totals.items()],
+    )
+
+
+def fold_ballot(totals, option_ids, nsquare, new_cts, old_cts=None):
+    """
+    Добавляет бюллетень к итогам (гомоморфное сложение = умножение по n²).
+    Заменённый бюллетень вычитается умножением на обратный по модулю n².
+    """
+    for i, opt_id in enumerate(option_ids):
+        factor = new_cts[i]
+        if old_cts is not None:
+            factor = factor * pow(old_cts[i], -1, nsquare) % nsquare
+        totals[opt_id] = totals[opt_id] * factor % nsquare
+
+
+def _tally_chunk(poll_id: int, n: int, option_count: int, rows: list[tuple], min_bits: int = 0):
+    """
+    Выполняется в процессе пула: проверяет подписи пачки бюллетеней и
+    возвращает TallyResult пачки. Ключи избирателей короче min_bits
+    (rsa_bits профиля опроса) не принимаются.
+    """
+    nsquare = n * n
+    width = ciphertext_width(n)
+    partial = [IDENTITY] * option_count
+    counted = rejected = digest = 0
+    for user_id, ballot, ciphertexts, sig_format, signature, pub_der in rows:
+        try:
+            h, values = signed_hash(poll_id, user_id, ballot, ciphertexts, sig_format, width)
+        except (ValueError, TypeError):
+            # Повреждённый бюллетень не учитывается, как и в audit._audit_chunk
+            rejected += 1
+            continue
+        try:
+            # Ключ каждого избирателя разбирается в процессе один раз
+            pub = public_keys.get(user_id, pub_der)
+        except (ValueError, IndexError, TypeError):
+            pub = None
+        if pub is not None and pub.size_in_bits() < min_bits:
+            pub = None
+        if pub is None or len(values) != option_count or not verify_hash(pub, h, signature):
+            # Подпись не совпала → игнорируем голос
+            rejected += 1
+            continue
+        for i, c in enumerate(values):
+            partial[i] = partial[i] * c % nsquare
+        counted += 1
+        packed = ballot if ballot is not None else pack_ciphertexts(values, width)
+        digest = (digest + ballot_digest(user_id, packed, signature)) % DIGEST_MOD
+    return TallyResult(partial, counted, rejected, digest)
+
+
+async def aggregate(poll_id: int, n: int, option_count: int, rows, total: int, progress=None,
+                    min_bits: int = 0) -> TallyResult:
+    """
+    Гомоморфно суммирует бюллетени в пуле процессов. rows — асинхронный
+    поток строк (user_id, ballot, ciphertexts, sig_format, signature,
+    rsa_public_key), например курсор asyncpg; total — ожидаемое число строк.
+    В памяти одновременно не больше MAX_INFLIGHT пачек, сколько бы ни было
+    бюллетеней. progress(обработано, total) вызывается после каждой пачки.
+    min_bits — наименьшая длина ключа избирателя (профиль опроса).
+    """
+    size = chunk_size(n, option_count, total)
+    nsquare = n * n
+    result = TallyResult([IDENTITY] * option_count, 0, 0, 0)
+    inflight = set()
+
+    async def drain(return_when):
+        nonlocal result, inflight
+        done, inflight = await asyncio.wait(inflight, return_when=return_when)
+        for task in done:
+            result = merge(result, task.result(), nsquare)
+        if progress is not None:
+            progress(result.counted + result.rejected, total)
+
+    def submit(chunk):
+        # Фоновый режим: пачки ждут свободного места в пуле, а не получают 503
+        inflight.add(asyncio.ensure_future(crypto.run(
+            "tally_chunk", _tally_chunk, poll_id, n, option_count, chunk, min_bits, background=True,
+        )))
+
+    try:
+        chunk = []
+        async for row in rows:
+            chunk.append(tuple(row))
+            if len(chunk) < size:
+                continue
+            submit(chunk)
+            chunk = []
+            if len(inflight) >= MAX_INFLIGHT:
+                await drain(asyncio.FIRST_COMPLETED)
+        if chunk:
+            submit(chunk)
+        while inflight:
+            await drain(asyncio.FIRST_COMPLETED)
+    finally:
+        for task in inflight:
+            task.cancel()
+    return result
+
+
+def merge(a: TallyResult, b: TallyResult, nsquare: int) -> TallyResult:
+    """Объединяет итоги двух непересекающихся наборов бюллетеней."""
+    return TallyResult(
+        [x * y % nsquare for x, y in zip(a.products, b.products)],
+        a.counted + b.counted,
+        a.rejected + b.rejected,
+        (a.digest + b.digest) % DIGEST_MOD,
+    )
+
+
+def log_progress(poll_id: int, every: float = 5.0):
+    """progress-колбэк для aggregate: пишет в лог не чаще раза в every секунд."""
+    last = 0.0
+
+    def report(done: int, total: int):
+        nonlocal last
+        now = time.monotonic()
+        if now - last >= every or done >= total:
+            last = now
+            logger.info("Подсчёт опроса %s: %s из %s бюллетеней", poll_id, done, total)
+
+    return report
+
+
+async def rebuild_tally(conn, poll_id: int, progress=None) -> tuple[dict[int, int], TallyResult]:
+    """
+    Пересчитывает итоги опроса с нуля по таблице vote, читая бюллетени
+    серверным курсором. Учитываются только бюллетени с корректной подписью.
+    Возвращает ({option_id: шифротекст}, TallyResult).
+
+    Пересчёт идёт по снимку (REPEATABLE READ) без блокировки итогов, так что
+    очередь записи тем временем принимает голоса. Строки poll_tally
+    блокируются только для сверки и замены: если итоги с момента снимка
+    изменились, их приращение current · seen⁻¹ (голоса, записанные во время
+    пересчёта) переносится на пересчитанные итоги.
+    """
+    poll = await conn.fetchrow("SELECT public_key_n, crypto_profile FROM poll WHERE id=$1", poll_id)
+    if not poll:
+        raise LookupError(f"Опрос {poll_id} не найден")
+    n = int(poll["public_key_n"])
+    min_bits = crypto_profiles.get(poll["crypto_profile"]).rsa_bits
+
+    started = time.monotonic()
+    nested = conn.is_in_transaction()
+    await init_tally(conn, poll_id)
+    # Во внешней транзакции (итоги завершённого опроса под advisory-блокировкой
+    # result_cache) уровень изоляции задаёт она
+    snapshot = conn.transaction() if nested else conn.transaction(readonly=True, isolation="repeatable_read")
+    async with snapshot:
+        seen = await read_tally(conn, poll_id)
+        option_ids = sorted(seen)
+        total = await conn.fetchval("SELECT count(*) FROM vote WHERE poll_id=$1", poll_id)
+        size = chunk_size(n, len(option_ids), total)
+
+        # Ключи избирателей приходят тем же запросом (JOIN), а не по одному
+        cursor = conn.cursor(
+            'SELECT v.user_id, v.ballot, v.ciphertexts, v.sig_format, v.signature, u.rsa_public_key '
+            'FROM vote v JOIN "user" u ON u.id = v.user_id '
+            'WHERE v.poll_id=$1',
+            poll_id,
+            prefetch=size,
+        )
+        result = await aggregate(
+            poll_id, n, len(option_ids), cursor, total, progress or log_progress(poll_id), min_bits,
+        )
+    totals = dict(zip(option_ids, result.products))
+
+    nsquare = n * n
+    async with conn.transaction():
+        current = await lock_tally(conn, poll_id)
+        if current.keys() != seen.keys():
+            raise LookupError(f"Опрос {poll_id} удалён во время пересчёта")
+        if current != seen:
+            totals = {
+                opt_id: totals[opt_id] * current[opt_id] * pow(seen[opt_id], -1, nsquare) % nsquare
+                for opt_id in option_ids
+            }
+        await store_tally(conn, poll_id, totals)
+
+    elapsed = time.monotonic() - started
+    metrics.tally_duration.observe(elapsed)
+    metrics.tally_ballots.inc(result.counted, "counted")
+    metrics.tally_ballots.inc(result.rejected, "rejected")
+    logger.info(
+        "Итоги опроса %s пересчитаны за %.1f с: учтено %s, отклонено %s (%.0f бюллетеней/с)",
+        poll_id, elapsed, result.counted, result.rejected,
+        (result.counted + result.rejected) / elapsed if elapsed > 0 else 0.0,
+    )
+    return totals, result
+
+
+async def read_tally(conn, poll_id: int) -> dict[int, int]:
+    """Текущие зашифрованные итоги опроса без пересчёта; {} если их нет."""
+    rows = await conn.fetch(
+        "SELECT option_id, ciphertext FROM poll_tally WHERE poll_id=$1",
+        poll_id,
+    )
+    return {row["option_id"]: int.from_bytes(row["ciphertext"], "big") for row in rows}
+
+
+async def load_tally(conn, poll_id: int) -> dict[int, int]:
+    """Текущие зашифрованные итоги опроса; при отсутствии строятся с нуля."""
+    totals = await read_tally(conn, poll_id)
+    if not totals:
+        totals, _ = await rebuild_tally(conn, poll_id)
+    return totals
+
+
+async def _rebuild_cli(poll_ids: list[int]):
+    conn = await asyncpg.connect(**DB_CONFIG)
+    try:
+        if not poll_ids:
+            poll_ids = [r["id"] for r in await conn.fetch("SELECT id FROM poll ORDER BY id")]
+        for poll_id in poll_ids:
+            # Пересчёт администратором сбрасывает сохранённые итоги
+            await result_cache.invalidate(conn, poll_id)
+            await rebuild_tally(conn, poll_id)
+    finally:
+        await conn.close()
+        crypto.shutdown()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        sys.exit("Использование: python tally.py rebuild [poll_id ...]")
+    asyncio.run(_rebuild_cli([int(x) for x in sys.argv[2:]]))
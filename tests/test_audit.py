@@ -0,0 +1,159 @@
+# tests/test_audit.py
+"""audit: продолжение прерванного аудита и проверка протокола."""
+import asyncio
+import datetime
+import json
+from contextlib import asynccontextmanager
+
+import pytest
+from Crypto.PublicKey import RSA
+from phe import paillier
+
+import audit
+import tally
+from ballot_format import SIG_PACKED, ciphertext_width, pack_ciphertexts, packed_hash
+from crypto_executor import crypto
+from encryption import sign_hash
+from key_cache import private_keys
+
+POLL_ID = 7
+OPTION_IDS = [10, 11]
+PUBLIC_KEY, _ = paillier.generate_paillier_keypair(n_length=512)
+N = PUBLIC_KEY.n
+VOTER_KEY = RSA.generate(2048)  # rsa_bits профиля standard
+SHORT_KEY = RSA.generate(1024)
+AUDITOR_KEY = RSA.generate(1024)
+
+
+def _ballot(user_id: int, choice: int, key=VOTER_KEY, tamper: bool = False) -> tuple:
+    width = ciphertext_width(N)
+    blob = pack_ciphertexts([PUBLIC_KEY.raw_encrypt(int(i == choice)) for i in range(2)], width)
+    signature = sign_hash(key, packed_hash(POLL_ID, user_id, blob))
+    if tamper:
+        signature = sign_hash(key, packed_hash(POLL_ID, user_id + 1, blob))
+    return (user_id, blob, None, SIG_PACKED, signature, key.publickey().export_key("DER"))
+
+
+ROWS = [_ballot(user_id, user_id % 2) for user_id in range(1, 9)] + [
+    _ballot(20, 0, key=SHORT_KEY),
+    _ballot(21, 1, tamper=True),
+    (22, b"\x00" * 5, None, SIG_PACKED, "ab", VOTER_KEY.publickey().export_key("DER")),
+]
+
+
+class FakeConn:
+    """Опрос POLL_ID с бюллетенями ROWS; seen — user_id, прочитанные курсором."""
+
+    def __init__(self):
+        self.seen = []
+
+    async def fetchrow(self, query, *args):
+        if "FROM poll WHERE" in query:
+            return {
+                "public_key_n": str(N), "encoding": 1, "slot_bits": 32,
+                "crypto_profile": "standard", "is_closed": True,
+            }
+        return None  # poll_result: итоги ещё не сохранены
+
+    async def fetch(self, query, *args):
+        return [{"id": opt_id} for opt_id in OPTION_IDS]
+
+    async def fetchval(self, query, *args):
+        return len(ROWS)
+
+    @asynccontextmanager
+    async def transaction(self, **kwargs):
+        yield
+
+    async def cursor(self, query, *args, prefetch=None):
+        for row in sorted(ROWS):
+            self.seen.append(row[0])
+            yield row
+
+
+@pytest.fixture(autouse=True)
+def checked(monkeypatch, tmp_path):
+    """Пачки проверяются в этом же процессе; возвращает проверенные user_id."""
+    user_ids = []
+
+    async def run(op, fn, *args, background=False):
+        user_ids.extend(row[0] for row in args[3])
+        return fn(*args)
+
+    monkeypatch.setattr(crypto, "run", run)
+    monkeypatch.setattr(tally, "TALLY_CHUNK_SIZE", 3)
+    monkeypatch.setattr(private_keys, "key_dir", str(tmp_path))  # ключа опроса нет
+    return user_ids
+
+
+def _audit(path, conn=None, sign_key=None):
+    return asyncio.run(audit.audit(conn or FakeConn(), POLL_ID, str(path), sign_key))
+
+
+def _records(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_audit_counts_and_reasons(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    final = _audit(path, sign_key=AUDITOR_KEY)
+    assert (final["counted"], final["rejected"], final["counts"]) == (8, 3, None)
+    rejected = dict(r for chunk in _records(path) if chunk["type"] == "chunk" for r in chunk["rejected"])
+    assert rejected == {
+        20: audit.SHORT_PUBLIC_KEY, 21: audit.BAD_SIGNATURE, 22: audit.OPTION_COUNT,
+    }
+    assert audit.verify_transcript(str(path), AUDITOR_KEY.publickey()) == []
+
+
+def test_resume_skips_recorded_chunks(tmp_path, checked):
+    full = tmp_path / "full.jsonl"
+    expected = _audit(full)
+    checked.clear()
+
+    # Прерванный аудит: заголовок, две пачки и недописанная третья
+    lines = full.read_text(encoding="utf-8").splitlines(keepends=True)
+    assert [json.loads(line)["type"] for line in lines[:3]] == ["header", "chunk", "chunk"]
+    partial = tmp_path / "partial.jsonl"
+    partial.write_text("".join(lines[:3]) + lines[3][:10], encoding="utf-8")
+    recorded = [json.loads(line) for line in lines[1:3]]
+
+    final = _audit(partial)
+    # Проверены заново только бюллетени вне записанных диапазонов
+    for chunk in recorded:
+        assert not [u for u in checked if chunk["first"] <= u <= chunk["last"]]
+    assert sorted(checked) == sorted(
+        row[0] for row in ROWS if not any(c["first"] <= row[0] <= c["last"] for c in recorded)
+    )
+    for key in ("products", "counted", "rejected", "digest"):
+        assert final[key] == expected[key]
+    assert audit.verify_transcript(str(partial)) == []
+
+
+def test_finished_audit_is_not_repeated(tmp_path, checked):
+    path = tmp_path / "audit.jsonl"
+    first = _audit(path)
+    checked.clear()
+    conn = FakeConn()
+    assert _audit(path, conn) == first
+    assert conn.seen == checked == []
+
+
+def test_verify_detects_tampering(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    _audit(path, sign_key=AUDITOR_KEY)
+    records = _records(path)
+    chunk = records[1]
+    chunk["ballots"] = chunk["ballots"][1:]  # выброшен учтённый бюллетень
+    path.write_text("".join(audit._dumps(r) for r in records), encoding="utf-8")
+    problems = audit.verify_transcript(str(path), AUDITOR_KEY.publickey())
+    assert "SHA-256 протокола не совпадает" in problems
+    assert any("дайджесты не сходятся" in p for p in problems)
+
+
+def test_other_poll_transcript_is_refused(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    header = {"type": "header", "version": audit.TRANSCRIPT_VERSION, "poll_id": POLL_ID + 1,
+              "started_at": datetime.datetime.now().isoformat()}
+    path.write_text(audit._dumps(header), encoding="utf-8")
+    with pytest.raises(audit.AuditError):
+        _audit(path)
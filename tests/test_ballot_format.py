@@ -0,0 +1,59 @@
+# tests/test_ballot_format.py
+"""ballot_format: упаковка шифротекстов и кодирование выбора по слотам."""
+from phe import paillier
+
+from ballot_format import (
+    ENCODING_PACKED, ENCODING_VECTOR, SLOT_BITS, ciphertext_width, decode_counts, encode_choice,
+    max_plaintext, pack_ciphertexts, packed_fits, unpack_ciphertexts,
+)
+
+N = 3233 * 3259
+
+
+def test_pack_roundtrip_at_width_boundary():
+    # Наибольший шифротекст (n² − 1) занимает ровно width байт, малые
+    # дополняются нулями слева
+    width = ciphertext_width(N)
+    values = [0, 1, N * N - 1, 255]
+    blob = pack_ciphertexts(values, width)
+    assert len(blob) == len(values) * width
+    assert unpack_ciphertexts(blob, width) == values
+    assert (N * N - 1).bit_length() > 8 * (width - 1)
+
+
+def test_vector_encoding():
+    assert encode_choice(ENCODING_VECTOR, SLOT_BITS, 3, 1) == [0, 1, 0]
+    assert decode_counts(ENCODING_VECTOR, SLOT_BITS, 3, [4, 0, 7]) == [4, 0, 7]
+
+
+def test_packed_encoding_uses_own_slot():
+    for index in range(4):
+        [m] = encode_choice(ENCODING_PACKED, SLOT_BITS, 4, index)
+        assert decode_counts(ENCODING_PACKED, SLOT_BITS, 4, [m]) == [int(i == index) for i in range(4)]
+
+
+def test_packed_slot_holds_max_count_without_carry():
+    # Слот заполнен до предела и соседний вариант не задет
+    full = (1 << SLOT_BITS) - 1
+    total = full * encode_choice(ENCODING_PACKED, SLOT_BITS, 3, 1)[0] + 5
+    assert decode_counts(ENCODING_PACKED, SLOT_BITS, 3, [total]) == [5, full, 0]
+    assert total < max_plaintext(ENCODING_PACKED, SLOT_BITS, 3, 0)
+
+
+def test_packed_fits_boundary():
+    n = (1 << 128) + 1  # 129 бит: в открытый текст помещается 127 бит
+    assert packed_fits(n, 3, 32)  # 96 бит
+    assert not packed_fits(n, 4, 32)  # 128 бит
+    assert packed_fits(n, 127, 1)
+    assert not packed_fits(n, 128, 1)
+
+
+def test_packed_sum_decrypts_to_counts():
+    public_key, private_key = paillier.generate_paillier_keypair(n_length=512)
+    choices = [0, 2, 2, 1, 2]
+    total = 1
+    for index in choices:
+        [m] = encode_choice(ENCODING_PACKED, SLOT_BITS, 3, index)
+        total = total * public_key.raw_encrypt(m) % public_key.nsquare
+    counts = decode_counts(ENCODING_PACKED, SLOT_BITS, 3, [private_key.raw_decrypt(total)])
+    assert counts == [1, 1, 3]
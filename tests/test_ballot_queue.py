@@ -0,0 +1,66 @@
+# tests/test_ballot_queue.py
+"""BallotWriter: если пачка не записалась, бюллетени пишутся по одному."""
+import asyncio
+from contextlib import asynccontextmanager
+
+from ballot_queue import BallotRejected, BallotWriter, PendingBallot
+
+
+class FakePool:
+    @asynccontextmanager
+    async def acquire(self):
+        yield object()
+
+
+class FlakyWriter(BallotWriter):
+    """_write падает на любой пачке, где есть бюллетень пользователя bad_user."""
+
+    def __init__(self, bad_user: int):
+        super().__init__(maxsize=10, batch_size=10, flush_interval=0, timeout=1)
+        self.db_pool = FakePool()
+        self.bad_user = bad_user
+        self.calls = []
+
+    async def _write(self, conn, items):
+        self.calls.append([item.user_id for item in items])
+        if any(item.user_id == self.bad_user for item in items):
+            raise ValueError("ошибка записи")
+        return [BallotRejected("Голосование завершено.") if item.poll_id == 2 else None for item in items]
+
+
+def _item(user_id: int, poll_id: int = 1) -> PendingBallot:
+    return PendingBallot(poll_id, user_id, b"", 2, "ab", [1], [10], 4, 1)
+
+
+def _flush(writer: BallotWriter, items: list[PendingBallot]) -> list:
+    async def run():
+        loop = asyncio.get_running_loop()
+        batch = [(item, loop.create_future()) for item in items]
+        await writer._flush(batch)
+        return [future.exception() for _, future in batch]
+
+    return asyncio.run(run())
+
+
+def test_failed_batch_is_retried_one_by_one():
+    writer = FlakyWriter(bad_user=2)
+    errors = _flush(writer, [_item(1), _item(2), _item(3)])
+    assert writer.calls == [[1, 2, 3], [1], [2], [3]]
+    assert errors[0] is None and errors[2] is None
+    assert isinstance(errors[1], ValueError)
+    assert (writer.written, writer.rejected, writer.batches) == (2, 1, 1)
+
+
+def test_single_ballot_failure_is_not_retried():
+    writer = FlakyWriter(bad_user=1)
+    errors = _flush(writer, [_item(1)])
+    assert writer.calls == [[1]]
+    assert isinstance(errors[0], ValueError)
+
+
+def test_rejected_ballot_keeps_its_reason():
+    writer = FlakyWriter(bad_user=0)
+    errors = _flush(writer, [_item(1), _item(2, poll_id=2)])
+    assert writer.calls == [[1, 2]]
+    assert errors[0] is None
+    assert isinstance(errors[1], BallotRejected)
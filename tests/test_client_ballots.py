@@ -0,0 +1,57 @@
+# tests/test_client_ballots.py
+"""client_ballots.parse_ciphertexts: форма бюллетеня, зашифрованного в браузере."""
+import pytest
+
+from client_ballots import ClientBallotError, parse_ciphertexts
+
+P, Q = 3233, 3259  # n = P·Q; для проверки формы простота множителей не важна
+N = P * Q
+
+
+def _payload(*ciphertexts, signature="ab"):
+    return {"ciphertexts": list(ciphertexts), "signature": signature}
+
+
+def test_valid_ballot():
+    strs, values = parse_ciphertexts(_payload("5", str(N * N - 1)), N, 2)
+    assert strs == ["5", str(N * N - 1)]
+    assert values == [5, N * N - 1]
+
+
+@pytest.mark.parametrize("ciphertext", [
+    "007",  # не каноническая запись: подписана другая строка
+    "+7",
+    " 7",
+    "7.0",
+    "-7",
+    "²",
+    "",
+    7,
+])
+def test_rejects_non_canonical_decimal(ciphertext):
+    with pytest.raises(ClientBallotError):
+        parse_ciphertexts(_payload(ciphertext, "5"), N, 2)
+
+
+@pytest.mark.parametrize("ciphertext", [
+    0,
+    N * N,
+    N * N + 5,
+    P,  # gcd(c, n) = p
+    Q * 17,  # gcd(c, n) = q
+])
+def test_rejects_outside_group(ciphertext):
+    with pytest.raises(ClientBallotError, match="вне группы"):
+        parse_ciphertexts(_payload(str(ciphertext), "5"), N, 2)
+
+
+@pytest.mark.parametrize("payload", [
+    [],
+    {"ciphertexts": ["5"], "signature": "ab"},  # вариантов два
+    {"ciphertexts": "5,5", "signature": "ab"},
+    {"ciphertexts": ["5", "5"]},
+    {"ciphertexts": ["5", "5"], "signature": ""},
+])
+def test_rejects_malformed_payload(payload):
+    with pytest.raises(ClientBallotError):
+        parse_ciphertexts(payload, N, 2)
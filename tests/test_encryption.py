@@ -0,0 +1,43 @@
+# tests/test_encryption.py
+"""encryption.decrypt_values: половина CRT даёт то же, что расшифровка phe."""
+import secrets
+
+from phe import paillier
+
+from encryption import decrypt_values, encrypt_with_obfuscator
+
+PUBLIC_KEY, PRIVATE_KEY = paillier.generate_paillier_keypair(n_length=512)
+P = PRIVATE_KEY.p
+
+
+def test_half_crt_matches_phe():
+    plaintexts = [0, 1, 2 ** 31, P - 1] + [secrets.randbelow(P) for _ in range(20)]
+    ciphertexts = [PUBLIC_KEY.raw_encrypt(m) for m in plaintexts]
+    assert decrypt_values(PRIVATE_KEY, ciphertexts, max_plaintext=P - 1) == plaintexts
+    assert decrypt_values(PRIVATE_KEY, ciphertexts, max_plaintext=P - 1) == [
+        PRIVATE_KEY.raw_decrypt(c) for c in ciphertexts
+    ]
+
+
+def test_half_crt_on_homomorphic_sum():
+    total = 1
+    for m in (3, 0, 1, 7):
+        total = total * PUBLIC_KEY.raw_encrypt(m) % PUBLIC_KEY.nsquare
+    assert decrypt_values(PRIVATE_KEY, [total], max_plaintext=2 ** 31) == [11]
+
+
+def test_large_plaintext_uses_full_decryption():
+    # Открытый текст ≥ p половина CRT восстановить не может — берётся полная расшифровка
+    m = P + 12345
+    c = PUBLIC_KEY.raw_encrypt(m)
+    assert decrypt_values(PRIVATE_KEY, [c], max_plaintext=P) == [m]
+    assert decrypt_values(PRIVATE_KEY, [c]) == [m]
+    assert decrypt_values(PRIVATE_KEY, [c], max_plaintext=P - 1) != [m]
+
+
+def test_pooled_obfuscator_encryption():
+    r = secrets.randbelow(PUBLIC_KEY.n - 1) + 1
+    obfuscator = pow(r, PUBLIC_KEY.n, PUBLIC_KEY.nsquare)
+    c = encrypt_with_obfuscator(PUBLIC_KEY, 42, obfuscator)
+    assert c == PUBLIC_KEY.raw_encrypt(42, r_value=r)
+    assert decrypt_values(PRIVATE_KEY, [c], max_plaintext=100) == [42]
@@ -0,0 +1,66 @@
+# tests/test_poll_context.py
+"""poll_context.load: бюллетени в бинарном виде и ещё не перенесённые из JSON."""
+import asyncio
+import datetime
+import json
+
+from phe import paillier
+
+import poll_context
+from ballot_format import SIG_DECIMAL, SIG_PACKED, ciphertext_width, pack_ciphertexts, read_ciphertexts
+
+N = 3233 * 3259  # игрушечный модуль: формату бюллетеня длина ключа не важна
+
+
+class FakeConn:
+    """Отдаёт одну заранее заданную строку на любой fetchrow."""
+
+    def __init__(self, row):
+        self.row = row
+
+    async def fetchrow(self, query, *args):
+        return self.row
+
+
+def _row(ballot, ciphertexts, sig_format):
+    return {
+        "title": "Опрос",
+        "public_key_n": str(N),
+        "end_date": datetime.datetime(2100, 1, 1, tzinfo=datetime.timezone.utc),
+        "encoding": 1,
+        "slot_bits": 32,
+        "crypto_profile": "standard",
+        "option_ids": [10, 11],
+        "option_texts": ["да", "нет"],
+        "ballot": ballot,
+        "ciphertexts": ciphertexts,
+        "sig_format": sig_format,
+        "signature": "ab",
+        "rsa_public_key": b"der",
+    }
+
+
+def _load(row, poll_id):
+    poll_context.invalidate(poll_id)
+    return asyncio.run(poll_context.load(FakeConn(row), poll_id, user_id=1))
+
+
+def test_packed_ballot():
+    width = ciphertext_width(N)
+    ctx = _load(_row(pack_ciphertexts([5, 7], width), None, SIG_PACKED), 1)
+    assert isinstance(ctx.meta.public_key, paillier.PaillierPublicKey)
+    ballot, ciphertexts = ctx.vote[:2]
+    assert read_ciphertexts(ballot, ciphertexts, width) == [5, 7]
+
+
+def test_legacy_json_ballot():
+    # Строка, не перенесённая ballot_format.py migrate: ballot NULL, шифротексты в JSON
+    ctx = _load(_row(None, json.dumps(["5", "7"]), SIG_DECIMAL), 2)
+    assert ctx.vote is not None
+    ballot, ciphertexts = ctx.vote[:2]
+    assert read_ciphertexts(ballot, ciphertexts, ciphertext_width(N)) == [5, 7]
+
+
+def test_no_vote():
+    ctx = _load(_row(None, None, None), 3)
+    assert ctx.vote is None
@@ -0,0 +1,75 @@
+# tests/test_shards.py
+"""shards: слияние частичных итогов и разбор переносимого формата."""
+import pytest
+from phe import paillier
+
+import shards
+import tally
+from shards import Partial, ShardError, ShardInfo
+
+PUBLIC_KEY, PRIVATE_KEY = paillier.generate_paillier_keypair(n_length=512)
+N = PUBLIC_KEY.n
+OPTION_IDS = (10, 11)
+
+
+def _partial(shard: int, votes: list[int], shard_count: int = 4, poll_id: int = 1) -> Partial:
+    """Частичный итог шарда: votes — открытые тексты по вариантам."""
+    products = [PUBLIC_KEY.raw_encrypt(m) for m in votes]
+    digest = 1000 + shard
+    result = tally.TallyResult(products, counted=sum(votes), rejected=shard, digest=digest)
+    info = ShardInfo(result.counted, result.rejected, digest)
+    return Partial(poll_id, N, OPTION_IDS, shard_count, {shard: info}, result)
+
+
+def _decrypt(partial: Partial) -> list[int]:
+    return [PRIVATE_KEY.raw_decrypt(c) for c in partial.result.products]
+
+
+def test_tree_merge_sums_all_shards():
+    partial = shards.tree_merge([_partial(i, [i, 1]) for i in range(4)])
+    assert partial.missing == []
+    assert _decrypt(partial) == [0 + 1 + 2 + 3, 4]
+    assert partial.result.counted == sum(i + 1 for i in range(4))
+    assert partial.result.rejected == 0 + 1 + 2 + 3
+    assert partial.result.digest == sum(1000 + i for i in range(4))
+
+
+def test_merge_rejects_duplicate_shard():
+    merged = shards.merge(_partial(0, [1, 0]), _partial(1, [0, 1]))
+    with pytest.raises(ShardError, match="дважды"):
+        shards.merge(merged, _partial(1, [0, 1]))
+
+
+def test_merge_rejects_other_poll_or_split():
+    with pytest.raises(ShardError):
+        shards.merge(_partial(0, [1, 0]), _partial(1, [1, 0], poll_id=2))
+    with pytest.raises(ShardError):
+        shards.merge(_partial(0, [1, 0]), _partial(1, [1, 0], shard_count=8))
+
+
+def test_missing_shards():
+    partial = shards.merge(_partial(0, [1, 0]), _partial(2, [1, 0]))
+    assert partial.missing == [1, 3]
+
+
+def test_json_roundtrip():
+    partial = shards.merge(_partial(0, [1, 0]), _partial(3, [2, 5]))
+    assert shards.from_json(shards.to_json(partial)) == partial
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda d: d.update(format=99),
+    lambda d: d.pop("products"),
+    lambda d: d.update(public_key_n="не число"),
+    lambda d: d["products"].append("1"),  # лишний вариант
+    lambda d: d["products"].__setitem__(0, "0"),  # вне (0, n²)
+    lambda d: d["products"].__setitem__(0, f"{N * N:x}"),
+    lambda d: d["shards"].update({"7": {"counted": 0, "rejected": 0, "digest": "0"}}),  # шард ≥ N
+    lambda d: d.update(counted=d["counted"] + 1),  # сводка не сходится
+    lambda d: d.update(digest=f"{0:064x}"),
+])
+def test_from_json_rejects_corrupt_partial(corrupt):
+    data = shards.to_json(shards.merge(_partial(0, [1, 0]), _partial(1, [0, 1])))
+    corrupt(data)
+    with pytest.raises(ShardError):
+        shards.from_json(data)
@@ -0,0 +1,70 @@
+# tests/test_tally.py
+"""tally: добавление бюллетеня к итогам, замена прежнего и проверка пачки."""
+import json
+
+from Crypto.PublicKey import RSA
+from phe import paillier
+
+import tally
+from ballot_format import SIG_DECIMAL
+from encryption import ballot_hash, sign_hash
+
+# Короткий ключ: гомоморфным свойствам длина модуля не важна
+PUBLIC_KEY, PRIVATE_KEY = paillier.generate_paillier_keypair(n_length=512)
+NSQUARE = PUBLIC_KEY.nsquare
+OPTION_IDS = [10, 11, 12]
+
+
+def _encrypt(values):
+    return [PUBLIC_KEY.raw_encrypt(m) for m in values]
+
+
+def _decrypt(totals):
+    return [PRIVATE_KEY.raw_decrypt(totals[opt_id]) for opt_id in OPTION_IDS]
+
+
+def _empty():
+    return {opt_id: tally.IDENTITY for opt_id in OPTION_IDS}
+
+
+def test_fold_adds_ballots():
+    totals = _empty()
+    tally.fold_ballot(totals, OPTION_IDS, NSQUARE, _encrypt([1, 0, 0]))
+    tally.fold_ballot(totals, OPTION_IDS, NSQUARE, _encrypt([0, 0, 1]))
+    tally.fold_ballot(totals, OPTION_IDS, NSQUARE, _encrypt([1, 0, 0]))
+    assert _decrypt(totals) == [2, 0, 1]
+
+
+def test_fold_replaces_ballot():
+    totals = _empty()
+    old = _encrypt([1, 0, 0])
+    tally.fold_ballot(totals, OPTION_IDS, NSQUARE, _encrypt([0, 1, 0]))
+    tally.fold_ballot(totals, OPTION_IDS, NSQUARE, old)
+    # Избиратель передумал: прежний бюллетень вычитается обратным по модулю n²
+    tally.fold_ballot(totals, OPTION_IDS, NSQUARE, _encrypt([0, 0, 1]), old_cts=old)
+    assert _decrypt(totals) == [0, 1, 1]
+
+
+def test_replacing_only_ballot_gives_identity_sum():
+    totals = _empty()
+    ballot = _encrypt([0, 1, 0])
+    tally.fold_ballot(totals, OPTION_IDS, NSQUARE, ballot)
+    tally.fold_ballot(totals, OPTION_IDS, NSQUARE, _encrypt([0, 0, 0]), old_cts=ballot)
+    assert _decrypt(totals) == [0, 0, 0]
+
+
+def test_chunk_rejects_malformed_ballots():
+    # Повреждённые строки отклоняются, как в audit._audit_chunk, а не обрывают пересчёт
+    key = RSA.generate(1024)
+    der = key.publickey().export_key("DER")
+    strs = [str(c) for c in _encrypt([0, 1, 0])]
+    good = (1, None, json.dumps(strs), SIG_DECIMAL, sign_hash(key, ballot_hash(5, 1, strs)), der)
+    rows = [
+        good,
+        (2, None, "{не json", SIG_DECIMAL, "ab", der),
+        (3, None, json.dumps(["x", "1", "2"]), SIG_DECIMAL, "ab", der),
+        (4, None, None, SIG_DECIMAL, "ab", der),
+    ]
+    result = tally._tally_chunk(5, PUBLIC_KEY.n, len(OPTION_IDS), rows)
+    assert (result.counted, result.rejected) == (1, 3)
+    assert _decrypt(dict(zip(OPTION_IDS, result.products))) == [0, 1, 0]